@@ -0,0 +1,57 @@
+"""
+Benchmark automatic window/level: two np.percentile calls vs one pixel
+histogram, and vs re-windowing from a histogram kept with the slice.
+
+Usage:
+    python -m benchmarks.bench_autowindow --sizes 512x512 4096x4096
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from libs.dicom_autowindow import PixelHistogram, autoWindow, windowFromPercentiles
+
+
+def parse_size(size):
+    height, width = size.lower().split('x')
+    return int(height), int(width)
+
+
+def percentile_window(img, percentiles):
+    p_low = float(np.percentile(img, percentiles[0]))
+    p_high = float(np.percentile(img, percentiles[1]))
+    return windowFromPercentiles(p_low, p_high)
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    percentiles = tuple(args.percentiles)
+    print('{:>12} {:>16} {:>16} {:>16} {:>8}'.format(
+        'size', 'percentile (ms)', 'histogram (ms)', 'kept hist (ms)', 'speedup'))
+    for size in args.sizes:
+        img = rng.randint(-1024, 3072, size=parse_size(size)).astype(np.int16)
+        histogram = PixelHistogram.fromPixels(img)
+        assert autoWindow(img, percentiles) == percentile_window(img, percentiles)
+
+        percentile_s = min(timeit.repeat(lambda: percentile_window(img, percentiles),
+                                         number=1, repeat=args.repeat))
+        histogram_s = min(timeit.repeat(lambda: autoWindow(img, percentiles),
+                                        number=1, repeat=args.repeat))
+        kept_s = min(timeit.repeat(lambda: autoWindow(img, percentiles, histogram=histogram),
+                                   number=1, repeat=args.repeat))
+        print('{:>12} {:>16.2f} {:>16.2f} {:>16.3f} {:>7.1f}x'.format(
+            size, 1000 * percentile_s, 1000 * histogram_s, 1000 * kept_s, percentile_s / histogram_s))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', nargs='+', default=['512x512', '4096x4096'],
+                        help='Image sizes as HEIGHTxWIDTH.')
+    parser.add_argument('--percentiles', type=float, nargs=2, default=[1, 99],
+                        help='Low and high percentiles of the window.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions per size.')
+
+    main(parser.parse_args())
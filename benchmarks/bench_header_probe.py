@@ -0,0 +1,80 @@
+"""
+Benchmark bytes read and time per file for series discovery headers:
+a full header read (stop_before_pixels) vs DICOMReader.probeHeader.
+
+Generated files carry a private vendor block after the discovery tags, as
+scanner CT slices usually do. Bytes are counted from /proc/self/io (Linux).
+
+Usage:
+    python -m benchmarks.bench_header_probe --num_files 200 --private_kb 32
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from libs.dicom_io import DICOMReader
+from tests.synthetic_dicom import writeSyntheticDICOM
+
+
+def bytes_read():
+    try:
+        with open('/proc/self/io') as fh:
+            for line in fh:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def generate_files(root, num_files, private_kb):
+    paths = []
+    for i in range(num_files):
+        path = os.path.join(root, '{:05d}.dcm'.format(i))
+        writeSyntheticDICOM(path, rows=512, columns=512, instance_number=i + 1)
+        if private_kb > 0:
+            dcm = DICOMReader.readRawDICOM(path)
+            block = dcm.private_block(0x0029, 'SIEMENS CSA HEADER', create=True)
+            block.add_new(0x10, 'OB', b'\0' * (1024 * private_kb))
+            dcm.save_as(path)
+        paths.append(path)
+    return paths
+
+
+def measure(read_fn, paths):
+    start_bytes = bytes_read()
+    start = time.perf_counter()
+    for path in paths:
+        read_fn(path)
+    elapsed = time.perf_counter() - start
+    end_bytes = bytes_read()
+    per_file = (end_bytes - start_bytes) / len(paths) if start_bytes is not None else float('nan')
+    return elapsed / len(paths), per_file
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix='bench_probe_')
+    try:
+        paths = generate_files(root, args.num_files, args.private_kb)
+        modes = (
+            ('full header', lambda p: DICOMReader.readRawDICOM(p, stop_before_pixels=True)),
+            ('probe', DICOMReader.probeHeader),
+        )
+        print('{:>12} {:>12} {:>14}'.format('mode', 'ms/file', 'KB read/file'))
+        for name, read_fn in modes:
+            seconds, num_bytes = measure(read_fn, paths)
+            print('{:>12} {:>12.3f} {:>14.1f}'.format(name, 1000 * seconds, num_bytes / 1024))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--num_files', type=int, default=200, help='Number of generated files.')
+    parser.add_argument('--private_kb', type=int, default=32, help='Size of the private vendor block in KB.')
+
+    main(parser.parse_args())
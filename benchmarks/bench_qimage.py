@@ -0,0 +1,87 @@
+"""
+Benchmark memory allocated and time per rendered DICOM frame, as during a
+window/level slider drag: the previous path (fresh uint8 image, color table
+rebuilt and QImage detached by setColorTable) vs an in-place FrameBuffer
+and a zero-copy QImage.
+
+Allocations are measured with tracemalloc, which sees NumPy and Python
+allocations. The pixel copy made by QImage.setColorTable is C++ memory and
+is reported separately from the image size.
+
+Usage:
+    python -m benchmarks.bench_qimage --sizes 512x512 4096x4096
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from libs.dicom_window import applyWindowLUT
+from libs.qimage_adapter import FrameBuffer, ndarrayToQImage
+
+try:
+    from PyQt5.QtGui import QImage, qRgb
+except ImportError:
+    from PyQt4.QtGui import QImage, qRgb
+
+
+def parse_size(size):
+    height, width = size.lower().split('x')
+    return int(height), int(width)
+
+
+def render_previous(img, w_center, w_width):
+    arr = applyWindowLUT(img, w_center, w_width)
+    gray_color_table = [qRgb(i, i, i) for i in range(256)]
+    qim = QImage(arr.data, arr.shape[1], arr.shape[0], arr.strides[0], QImage.Format_Indexed8)
+    qim.setColorTable(gray_color_table)
+    return qim
+
+
+def render_frame_buffer(img, w_center, w_width, frame):
+    out = frame.get(img.shape)
+    return ndarrayToQImage(applyWindowLUT(img, w_center, w_width, out=out))
+
+
+def measure(render_fn, num_frames):
+    """Get (traced bytes allocated per frame, ms per frame) over a simulated drag."""
+    render_fn(0)
+    tracemalloc.start()
+    total_bytes = 0
+    start = time.perf_counter()
+    for i in range(num_frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        qim = render_fn(i)
+        _, peak = tracemalloc.get_traced_memory()
+        total_bytes += peak - before
+        del qim
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    return total_bytes / num_frames, 1000 * elapsed / num_frames
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    print('{:>12} {:>14} {:>14} {:>12} {:>12} {:>12}'.format(
+        'size', 'prev KB/frame', 'new KB/frame', 'prev ms', 'new ms', 'Qt copy KB'))
+    for size in args.sizes:
+        img = rng.randint(-1024, 3072, size=parse_size(size)).astype(np.int16)
+        frame = FrameBuffer()
+        # Window levels sweep like a slider drag, so lookup tables are built in both runs
+        prev_bytes, prev_ms = measure(lambda i: render_previous(img, i, 400), args.frames)
+        new_bytes, new_ms = measure(lambda i: render_frame_buffer(img, i + 0.5, 400, frame), args.frames)
+        print('{:>12} {:>14.1f} {:>14.1f} {:>12.2f} {:>12.2f} {:>12.1f}'.format(
+            size, prev_bytes / 1024, new_bytes / 1024, prev_ms, new_ms, img.size / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', nargs='+', default=['512x512', '4096x4096'],
+                        help='Image sizes as HEIGHTxWIDTH.')
+    parser.add_argument('--frames', type=int, default=50, help='Frames rendered per size.')
+
+    main(parser.parse_args())
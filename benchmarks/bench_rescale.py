@@ -0,0 +1,68 @@
+"""
+Benchmark peak memory and time of stored-pixel to Hounsfield Unit conversion:
+the previous _dicomToRaw arithmetic vs libs.dicom_rescale.rescaleToHU.
+
+Peak memory is measured with tracemalloc and excludes the decoded input.
+
+Usage:
+    python -m benchmarks.bench_rescale --size 4096x4096
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from libs.dicom_rescale import rescaleToHU
+
+
+def parse_size(size):
+    height, width = size.lower().split('x')
+    return int(height), int(width)
+
+
+def legacy_dicom_to_raw(stored, slope, intercept, dtype=np.int16):
+    img_np = stored.astype(dtype)
+    img_np[img_np == -2000] = 0
+    if slope != 1:
+        img_np = slope * img_np.astype(np.float64)
+        img_np = img_np.astype(dtype)
+    img_np += int(intercept)
+    img_np = img_np.astype(np.int16)
+    return img_np
+
+
+def measure(convert_fn, stored):
+    """Get (peak MB allocated, ms) for one conversion of a fresh copy of `stored`."""
+    stored = stored.copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = convert_fn(stored)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 2 ** 20, 1000 * elapsed
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    shape = parse_size(args.size)
+    print('{:>8} {:>6} {:>16} {:>14} {:>12} {:>10}'.format(
+        'stored', 'slope', 'legacy peak MB', 'new peak MB', 'legacy ms', 'new ms'))
+    for dtype in (np.int16, np.uint16):
+        stored = rng.randint(0, 4096, size=shape).astype(dtype)
+        for slope in (1, 0.5):
+            legacy_mb, legacy_ms = measure(lambda s: legacy_dicom_to_raw(s, slope, -1024), stored)
+            new_mb, new_ms = measure(lambda s: rescaleToHU(s, slope, -1024, bits_stored=12), stored)
+            print('{:>8} {:>6} {:>16.1f} {:>14.1f} {:>12.1f} {:>10.1f}'.format(
+                np.dtype(dtype).name, slope, legacy_mb, new_mb, legacy_ms, new_ms))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--size', default='4096x4096', help='Image size as HEIGHTxWIDTH.')
+
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+"""
+Benchmark DICOMReader.scanAllDICOMs throughput against the number of workers.
+
+Generates a synthetic study tree (unless --root is given), scans it serially
+and with thread and process pools, checks that every parallel scan matches
+the serial one, and prints files/sec for each configuration.
+
+Usage:
+    python -m benchmarks.bench_scan --num_series 20 --num_slices 100 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from libs.dicom_io import DICOMReader
+from tests.synthetic_dicom import writeSyntheticDICOM
+
+
+def generate_tree(root, num_series, num_slices, size):
+    for series_num in range(1, num_series + 1):
+        series_dir = os.path.join(root, 'study', 'series_{:03d}'.format(series_num))
+        os.makedirs(series_dir)
+        for instance_num in range(1, num_slices + 1):
+            writeSyntheticDICOM(os.path.join(series_dir, '{:05d}.dcm'.format(instance_num)),
+                                rows=size, columns=size, series_number=series_num,
+                                instance_number=instance_num)
+
+
+def summarize(series_infos):
+    return [(s.series_num, s.height, s.width, s.description, tuple(s.sorted_paths()))
+            for s in series_infos]
+
+
+def time_scan(root, num_workers, use_processes):
+    start = time.perf_counter()
+    series_infos = DICOMReader.scanAllDICOMs(root, check_preloaded=False, num_workers=num_workers,
+                                             use_processes=use_processes)
+    return time.perf_counter() - start, summarize(series_infos)
+
+
+def main(args):
+    root = args.root
+    tmp_dir = None
+    if root is None:
+        tmp_dir = root = tempfile.mkdtemp(prefix='bench_scan_')
+        print('Generating {} series x {} slices in {}'.format(args.num_series, args.num_slices, root))
+        generate_tree(root, args.num_series, args.num_slices, args.size)
+
+    try:
+        serial_s, expected = time_scan(root, 0, False)
+        num_files = sum(len(s[4]) for s in expected)
+        print('{:>10} {:>8} {:>10} {:>12}'.format('pool', 'workers', 'seconds', 'files/sec'))
+        print('{:>10} {:>8} {:>10.2f} {:>12.0f}'.format('serial', 0, serial_s, num_files / serial_s))
+        for use_processes in (False, True):
+            for num_workers in args.workers:
+                elapsed, result = time_scan(root, num_workers, use_processes)
+                assert result == expected, 'Parallel scan does not match serial scan'
+                print('{:>10} {:>8} {:>10.2f} {:>12.0f}'.format(
+                    'process' if use_processes else 'thread', num_workers, elapsed, num_files / elapsed))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--root', type=str, default=None, help='Existing tree to scan instead of a generated one.')
+    parser.add_argument('--num_series', type=int, default=10, help='Number of generated series.')
+    parser.add_argument('--num_slices', type=int, default=100, help='Number of slices per generated series.')
+    parser.add_argument('--size', type=int, default=64, help='Rows and columns of generated slices.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to time.')
+
+    main(parser.parse_args())
@@ -0,0 +1,156 @@
+"""
+Benchmark the cold start of labelImg: import time and time to first paint.
+
+Every run starts a fresh interpreter with an empty home directory, so no
+settings or last opened file are loaded, and measures:
+
+    import        importing labelImg
+    window        building the QApplication and the MainWindow, shown
+    first_paint   until the first widget is painted, from interpreter start
+    process       from launching the interpreter until first paint (parent clock)
+
+It also lists the modules that must be imported on first use only (pydicom,
+lxml, tqdm) but were imported by the time of the first paint; any such
+module counts as a regression.
+
+Results are written as JSON in the layout of benchmarks.bench_suite and are
+compared to a baseline the same way, exiting with status 1 on regressions.
+
+Usage:
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_startup --output startup.json
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_startup --baseline startup.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules kept out of startup, imported when first needed
+LAZY_MODULES = ('pydicom', 'lxml', 'tqdm')
+STARTUP_GROUP = 'startup'
+
+
+def measure_startup():
+    """Measure one cold start in this process and print it as one JSON line."""
+    start = time.perf_counter()
+    import labelImg
+    imported = time.perf_counter()
+
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+
+    class FirstPaint(QObject):
+        painted = None
+        painted_at = None
+
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and self.painted is None:
+                self.painted = time.perf_counter()
+                # Wall clock, comparable with the parent process
+                self.painted_at = time.time()
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    # The predefined classes are found next to sys.argv[0]
+    sys.argv = [labelImg.__file__]
+    first_paint = FirstPaint()
+    window_start = time.perf_counter()
+    app, win = labelImg.get_main_app(sys.argv)
+    window_shown = time.perf_counter()
+    app.installEventFilter(first_paint)
+    app.exec_()
+
+    print(json.dumps({
+        'import': imported - start,
+        'window': window_shown - window_start,
+        'first_paint': first_paint.painted - start,
+        'painted_at': first_paint.painted_at,
+        'eager_modules': [m for m in LAZY_MODULES if m in sys.modules],
+    }))
+    sys.stdout.flush()
+
+
+def run(args):
+    from benchmarks.bench_suite import RESULTS_VERSION, stats
+
+    samples = {'import': [], 'window': [], 'first_paint': [], 'process': []}
+    eager_modules = set()
+    for _ in range(args.repeat):
+        home = tempfile.mkdtemp(prefix='bench_startup_')
+        try:
+            env = dict(os.environ, HOME=home)
+            launched_at = time.time()
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--measure'], env=env)
+        finally:
+            shutil.rmtree(home)
+        # Only the last line: Qt may print warnings before it
+        sample = json.loads(output.decode().strip().splitlines()[-1])
+        for metric in ('import', 'window', 'first_paint'):
+            samples[metric].append(sample[metric])
+        # Interpreter exit is not part of startup, so count until the first paint
+        samples['process'].append(sample['painted_at'] - launched_at)
+        eager_modules.update(sample['eager_modules'])
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {
+            'python': sys.version.split()[0],
+            'qpa': os.environ.get('QT_QPA_PLATFORM', ''),
+            'cpu_count': os.cpu_count(),
+        },
+        'scales': {STARTUP_GROUP: {metric: stats(seconds) for metric, seconds in samples.items()}},
+        'eager_modules': sorted(eager_modules),
+    }
+
+
+def main(args):
+    if args.measure:
+        measure_startup()
+        return
+    # Not imported by the measured process: bench_suite imports pydicom
+    from benchmarks.bench_suite import compare, print_results
+
+    if args.input is not None:
+        with open(args.input) as fh:
+            results = json.load(fh)
+    else:
+        results = run(args)
+        print_results(results)
+    if results['eager_modules']:
+        print('Imported at startup: {}'.format(', '.join(results['eager_modules'])))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print('Results written to {}'.format(args.output))
+
+    regressions = ['import of {}'.format(m) for m in results['eager_modules']]
+    if args.baseline is not None:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions += compare(results, baseline, args.tolerance, args.min_ms)
+    if regressions:
+        print('{} regressions'.format(len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--repeat', type=int, default=5, help='Number of cold starts.')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to write results to.')
+    parser.add_argument('--input', type=str, default=None, help='Compare stored results instead of running.')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Median slowdown over the baseline flagged as a regression.')
+    parser.add_argument('--min_ms', type=float, default=20,
+                        help='Smallest median slowdown in ms flagged as a regression.')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+
+    main(parser.parse_args())
@@ -0,0 +1,222 @@
+"""
+Benchmark suite for the dicom_io hot paths on synthetic DICOM trees.
+
+Each scale is written as SERIESxSLICES@SIZE, e.g. 1x50@512 for one series of
+50 slices of 512x512 pixels, up to 200x500@512 or 1x50@4096. For each scale a
+tree is generated with pydicom and the following stages are timed:
+
+    scanAllDICOMs   serial scan of the whole tree
+    readRawDICOM    full parse of one file, pixels included
+    _dicomToRaw     pixel decode and rescale to Hounsfield Units
+    _applyWindow    windowing to uint8
+    _toQImage       uint8 image to QImage
+    getQImage       end to end, with a cold slice cache
+
+Results are written as JSON. With --baseline, the run is compared to a
+stored result and regressions of the median time are flagged, making the
+command exit with status 1.
+
+Usage:
+    python -m benchmarks.bench_suite --scales 1x50@512 1x50@2048 --output results.json
+    python -m benchmarks.bench_suite --scales 1x50@512 --baseline results.json
+    python -m benchmarks.bench_suite --input new.json --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pydicom
+
+from benchmarks.bench_scan import generate_tree
+from libs.dicom_io import DICOMReader
+
+RESULTS_VERSION = 1
+# Statistic compared against the baseline
+COMPARE_METRIC = 'p50_ms'
+
+
+def parse_scale(scale):
+    counts, size = scale.lower().split('@')
+    num_series, num_slices = counts.split('x')
+    return int(num_series), int(num_slices), int(size)
+
+
+def stats(seconds):
+    ms = 1000 * np.asarray(seconds)
+    return {
+        'n': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'min_ms': float(ms.min()),
+    }
+
+
+def time_each(fn, items):
+    """Time `fn(item)` once per item, returning the list of seconds."""
+    seconds = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_scale(root, max_slices, scan_repeat, w_level, w_width):
+    results = {}
+
+    scan_seconds = []
+    for _ in range(scan_repeat):
+        start = time.perf_counter()
+        series_infos = DICOMReader.scanAllDICOMs(root, check_preloaded=False)
+        scan_seconds.append(time.perf_counter() - start)
+    num_files = sum(len(s) for s in series_infos)
+    results['scanAllDICOMs'] = dict(stats(scan_seconds), files=num_files,
+                                    files_per_sec=num_files / min(scan_seconds))
+
+    paths = [p for s in series_infos for p in s.sorted_paths()][:max_slices]
+    results['readRawDICOM'] = stats(time_each(
+        lambda p: DICOMReader.readRawDICOM(p).pixel_array, paths))
+
+    # Decode from freshly parsed files: pydicom caches the decoded pixels
+    dcms = [DICOMReader.readRawDICOM(p) for p in paths]
+    raws = []
+    results['_dicomToRaw'] = stats(time_each(lambda dcm: raws.append(DICOMReader._dicomToRaw(dcm)), dcms))
+    del dcms
+
+    windowed = []
+    results['_applyWindow'] = stats(time_each(
+        lambda raw: windowed.append(DICOMReader._applyWindow(raw, w_level, w_width)), raws))
+    del raws
+
+    results['_toQImage'] = stats(time_each(DICOMReader._toQImage, windowed))
+    del windowed
+
+    def get_q_image(path):
+        DICOMReader.sliceCache.clear()
+        DICOMReader.getQImage(path, w_width, w_level)
+    results['getQImage'] = stats(time_each(get_q_image, paths))
+    DICOMReader.sliceCache.clear()
+
+    return results
+
+
+def run(args):
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pydicom': pydicom.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'scales': {},
+    }
+    for scale in args.scales:
+        num_series, num_slices, size = parse_scale(scale)
+        if args.data_dir is not None:
+            root = os.path.join(args.data_dir, scale)
+            # Generated trees are kept in --data_dir and reused by later runs
+            if not os.path.isdir(root):
+                print('Generating {} in {}'.format(scale, root))
+                generate_tree(root, num_series, num_slices, size)
+        else:
+            root = tempfile.mkdtemp(prefix='bench_suite_')
+            print('Generating {} in {}'.format(scale, root))
+            generate_tree(root, num_series, num_slices, size)
+
+        try:
+            print('Timing {}'.format(scale))
+            results['scales'][scale] = run_scale(root, args.max_slices, args.scan_repeat,
+                                                 args.level, args.width)
+        finally:
+            if args.data_dir is None:
+                shutil.rmtree(root)
+
+    return results
+
+
+def print_results(results):
+    print('{:>14} {:>14} {:>6} {:>10} {:>10} {:>10}'.format('scale', 'stage', 'n', 'p50 (ms)', 'p95 (ms)', 'mean (ms)'))
+    for scale, stages in results['scales'].items():
+        for stage, s in stages.items():
+            print('{:>14} {:>14} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                scale, stage, s['n'], s['p50_ms'], s['p95_ms'], s['mean_ms']))
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Print the change of every stage against the baseline.
+
+    Returns:
+        List of (scale, stage) whose median time grew by more than
+        `tolerance` and by more than `min_ms`, so that timer noise of
+        sub-millisecond stages is not flagged.
+    """
+    regressions = []
+    print('{:>14} {:>14} {:>12} {:>12} {:>8}'.format('scale', 'stage', 'base (ms)', 'new (ms)', 'change'))
+    for scale, stages in results['scales'].items():
+        for stage, s in stages.items():
+            base = baseline.get('scales', {}).get(scale, {}).get(stage)
+            if base is None:
+                continue
+            ratio = s[COMPARE_METRIC] / max(base[COMPARE_METRIC], 1e-9)
+            flag = ''
+            if ratio > 1 + tolerance and s[COMPARE_METRIC] - base[COMPARE_METRIC] > min_ms:
+                regressions.append((scale, stage))
+                flag = '  REGRESSION'
+            print('{:>14} {:>14} {:>12.2f} {:>12.2f} {:>+7.0f}%{}'.format(
+                scale, stage, base[COMPARE_METRIC], s[COMPARE_METRIC], 100 * (ratio - 1), flag))
+    return regressions
+
+
+def main(args):
+    if args.input is not None:
+        with open(args.input) as fh:
+            results = json.load(fh)
+    else:
+        results = run(args)
+        print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print('Results written to {}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        if regressions:
+            print('{} regressions over {:.0f}%'.format(len(regressions), 100 * args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--scales', nargs='+', default=['1x50@512', '1x50@2048'],
+                        help='Scales to time as SERIESxSLICES@SIZE.')
+    parser.add_argument('--data_dir', type=str, default=None,
+                        help='Directory to keep generated trees in, to reuse them across runs.')
+    parser.add_argument('--max_slices', type=int, default=50, help='Slices timed per per-slice stage.')
+    parser.add_argument('--scan_repeat', type=int, default=3, help='Timed scans of each tree.')
+    parser.add_argument('--level', type=float, default=40, help='Window level.')
+    parser.add_argument('--width', type=float, default=400, help='Window width.')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to write results to.')
+    parser.add_argument('--input', type=str, default=None, help='Compare stored results instead of running.')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Median slowdown over the baseline flagged as a regression.')
+    parser.add_argument('--min_ms', type=float, default=0.1,
+                        help='Smallest median slowdown in ms flagged as a regression.')
+
+    main(parser.parse_args())
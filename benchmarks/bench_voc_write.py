@@ -0,0 +1,111 @@
+"""
+Benchmark writing Pascal VOC annotation files in bulk: the previous writer
+(ElementTree serialization, parsed again and pretty printed by lxml, spaces
+replaced by tabs, then decoded and written through codecs) vs the current
+single-pass serializer.
+
+Every document is checked to be byte-identical between the two writers.
+Serialization and the full save (to files in --output_dir) are timed
+separately, because the current save also fsyncs every file.
+
+Usage:
+    python -m benchmarks.bench_voc_write --num_files 10000 --max_boxes 10
+"""
+
+import argparse
+import codecs
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from xml.etree import ElementTree
+
+from libs.pascal_voc_io import ENCODE_METHOD, XML_EXT, PascalVocWriter
+
+LABELS = ['nodule', 'mass', 'vessel', 'calcification', 'lymph node', 'ground-glass & solid']
+
+
+def prettify_previous(elem):
+    from lxml import etree
+
+    rough_string = ElementTree.tostring(elem, 'utf8')
+    root = etree.fromstring(rough_string)
+    return etree.tostring(root, pretty_print=True, encoding=ENCODE_METHOD).replace("  ".encode(), "\t".encode())
+
+
+def save_previous(writer, target_file):
+    root = writer.genXML()
+    writer.appendObjects(root)
+    out_file = codecs.open(target_file, 'w', encoding=ENCODE_METHOD)
+    out_file.write(prettify_previous(root).decode('utf8'))
+    out_file.close()
+
+
+def make_writers(num_files, max_boxes, seed):
+    rng = random.Random(seed)
+    writers = []
+    for i in range(num_files):
+        writer = PascalVocWriter('series_{:03d}'.format(i // 100), '{:05d}.dcm'.format(i), (512, 512, 1),
+                                 localImgPath='/data/study/series_{:03d}/{:05d}.dcm'.format(i // 100, i))
+        writer.verified = i % 3 == 0
+        for _ in range(rng.randint(0, max_boxes)):
+            xmin, ymin = rng.randint(1, 400), rng.randint(1, 400)
+            writer.addBndBox(xmin, ymin, xmin + rng.randint(4, 100), ymin + rng.randint(4, 100),
+                             rng.choice(LABELS), rng.random() < 0.1)
+        writers.append(writer)
+    return writers
+
+
+def time_all(fn, writers):
+    start = time.perf_counter()
+    for i, writer in enumerate(writers):
+        fn(i, writer)
+    return time.perf_counter() - start
+
+
+def main(args):
+    writers = make_writers(args.num_files, args.max_boxes, args.seed)
+    trees = []
+    for writer in writers:
+        root = writer.genXML()
+        writer.appendObjects(root)
+        trees.append(root)
+
+    num_mismatched = sum(prettify_previous(root) != writer.prettify(root)
+                         for writer, root in zip(writers, trees))
+    print('{} documents, {} not byte-identical'.format(len(trees), num_mismatched))
+
+    results = {}
+    results['serialize previous'] = time_all(lambda i, w: prettify_previous(trees[i]), writers)
+    results['serialize current'] = time_all(lambda i, w: w.prettify(trees[i]), writers)
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='bench_voc_write_')
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        results['save previous'] = time_all(
+            lambda i, w: save_previous(w, os.path.join(output_dir, 'previous_{:05d}{}'.format(i, XML_EXT))),
+            writers)
+        results['save current'] = time_all(
+            lambda i, w: w.save(os.path.join(output_dir, 'current_{:05d}{}'.format(i, XML_EXT))),
+            writers)
+    finally:
+        if args.output_dir is None:
+            shutil.rmtree(output_dir)
+
+    print('{:>20} {:>10} {:>12}'.format('stage', 'total (s)', 'files/sec'))
+    for stage, seconds in results.items():
+        print('{:>20} {:>10.2f} {:>12.0f}'.format(stage, seconds, len(writers) / seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--num_files', type=int, default=10000, help='Number of annotation files.')
+    parser.add_argument('--max_boxes', type=int, default=10, help='Maximum number of boxes per file.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random boxes.')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Directory to save files to. Defaults to a temporary directory.')
+
+    main(parser.parse_args())
@@ -0,0 +1,49 @@
+"""
+Microbenchmark for DICOM windowing: float64 reference vs lookup table.
+
+Usage:
+    python -m benchmarks.bench_windowing --sizes 512x512 4096x5120
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from libs.dicom_window import applyWindowLUT, windowFloat
+
+
+def parse_size(size):
+    height, width = size.lower().split('x')
+    return int(height), int(width)
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    print('{:>12} {:>14} {:>14} {:>8}'.format('size', 'float64 (ms)', 'lut (ms)', 'speedup'))
+    for size in args.sizes:
+        shape = parse_size(size)
+        img = rng.randint(-1024, 3072, size=shape).astype(np.int16)
+        out = np.empty(shape, dtype=np.uint8)
+
+        # Build the lookup table outside of the timed region, as a slider drag would
+        applyWindowLUT(img, args.level, args.width, out=out)
+
+        float_s = min(timeit.repeat(lambda: windowFloat(img, args.level, args.width),
+                                    number=1, repeat=args.repeat))
+        lut_s = min(timeit.repeat(lambda: applyWindowLUT(img, args.level, args.width, out=out),
+                                  number=1, repeat=args.repeat))
+        print('{:>12} {:>14.2f} {:>14.2f} {:>7.1f}x'.format(
+            size, 1000 * float_s, 1000 * lut_s, float_s / lut_s))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', nargs='+', default=['512x512', '2048x2048', '4096x5120'],
+                        help='Image sizes as HEIGHTxWIDTH.')
+    parser.add_argument('--level', type=float, default=40, help='Window level.')
+    parser.add_argument('--width', type=float, default=400, help='Window width.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions per size.')
+
+    main(parser.parse_args())
@@ -8,13 +8,15 @@ warnings.filterwarnings(
 )
 
 import codecs
+import copy
 import os.path
 import platform
 import sys
 import subprocess
+import threading
 import time
-import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 try:
@@ -38,7 +40,12 @@ import resources
 # Add internal libs
 from libs.constants import *
 from libs.dicom_dialog import DICOMDialog
-from libs.dicom_io import DICOMReader
+from libs.dicom_autowindow import DEFAULT_PERCENTILES, DEFAULT_WINDOW_SAMPLES
+from libs.dicom_index import DICOMIndex
+from libs.dicom_loader import DICOMSliceLoader
+from libs.dicom_io import DICOMReader, SliceSources, DEFAULT_CACHE_MB, DEFAULT_SCAN_WORKERS
+from libs.dicom_prefetch import DICOMPrefetcher, DEFAULT_PREFETCH
+from libs.dicom_volume import SeriesVolumeCache, DEFAULT_VOLUME_DIR
 from libs.lib import (
     struct,
     newAction,
@@ -57,6 +64,10 @@ from libs.colorDialog import ColorDialog
 from libs.labelFile import LabelFile, LabelFileError
 from libs.toolBar import ToolBar
 from libs.pascal_voc_io import PascalVocReader
+from libs.qimage_adapter import FrameBuffer
+from libs.render_scheduler import RenderScheduler
+from libs.save_queue import AnnotationSaveQueue
+from libs.timing import stageTimer
 from libs.pascal_voc_io import XML_EXT
 from libs.yolo_io import YoloReader
 from libs.yolo_io import TXT_EXT
@@ -107,6 +118,10 @@ class HashableQListWidgetItem(QListWidgetItem):
 class MainWindow(QMainWindow, WindowMixin):
     FIT_WINDOW, FIT_WIDTH, MANUAL_ZOOM = list(range(3))
 
+    # Emitted from a worker thread with (series, future) when a series window is computed
+    seriesWindowReady = pyqtSignal(object, object)
+    seriesVolumeReady = pyqtSignal(object, object)
+
     def __init__(
         self, defaultFilename=None, defaultPrefdefClassFile=None, defaultSaveDir=None
     ):
@@ -135,6 +150,54 @@ class MainWindow(QMainWindow, WindowMixin):
 
         self.dicomWindowLevel = self.settings.get(SETTING_DICOM_WLEVEL, 200)
         self.dicomWindowWidth = self.settings.get(SETTING_DICOM_WWIDTH, 1000)
+        # Percentiles of the slice spanned by the automatic window
+        self.dicomAutoPercentiles = self.settings.get(
+            SETTING_DICOM_AUTO_PERCENTILES, DEFAULT_PERCENTILES
+        )
+
+        # Decoded slices are shared by load, reload and auto-adjust
+        DICOMReader.sliceCache.setBudget(
+            self.settings.get(SETTING_DICOM_CACHE_MB, DEFAULT_CACHE_MB)
+        )
+        # Neighbouring slices are decoded in the background while browsing a series
+        self.dicomPrefetcher = DICOMPrefetcher(
+            num_ahead=self.settings.get(SETTING_DICOM_PREFETCH, DEFAULT_PREFETCH)
+        )
+        # DICOM slices are decoded and rendered off the GUI thread, latest request wins
+        self.dicomLoader = DICOMSliceLoader(prefetcher=self.dicomPrefetcher, parent=self)
+        self.dicomLoader.sliceLoaded.connect(self.onDicomSliceLoaded)
+        self.dicomLoader.loadFailed.connect(self.onDicomLoadFailed)
+        # Series index of the last opened DICOM folder, if it has one
+        self.dicomIndex = None
+        # Series being browsed, and its series-level automatic window once computed
+        self.dicomSeries = None
+        self.dicomSeriesWindow = None
+        self.dicomWindowExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="dicom-series-window"
+        )
+        self.seriesWindowReady.connect(self.onSeriesWindowReady)
+        # Memory-mapped volume of the series being browsed, once cached
+        self.dicomVolumeCache = SeriesVolumeCache(
+            self.settings.get(SETTING_DICOM_VOLUME_DIR, DEFAULT_VOLUME_DIR)
+        )
+        self.dicomVolume = None
+        self.dicomVolumeExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="dicom-series-volume"
+        )
+        self.seriesVolumeReady.connect(self.onSeriesVolumeReady)
+        # Set to stop the window and volume of a series once it is left
+        self.dicomSeriesCancel = threading.Event()
+        self.dicomSeriesFutures = []
+        # Displayed DICOM slices are windowed in place into this frame
+        self.dicomFrame = FrameBuffer()
+        # Start of the latest load, timed until its image is shown
+        self.loadStartTime = None
+        # Annotation files are written in the background
+        self.saveQueue = AnnotationSaveQueue(parent=self)
+        self.saveQueue.saved.connect(self.onAnnotationSaved)
+        self.saveQueue.saveFailed.connect(self.onAnnotationSaveFailed)
+        # Image of each annotation file being saved, marked dirty again if its save fails
+        self.savingImages = {}
 
         # Whether we need to save or not.
         self.dirty = False
@@ -148,8 +211,11 @@ class MainWindow(QMainWindow, WindowMixin):
         self.loadPredefinedClasses(defaultPrefdefClassFile)
 
         # Main widgets and related state.
-        self.labelDialog = LabelDialog(parent=self, listItem=self.labelHist)
-        self.windowLevelDialog = AdjustWindowLevelDialog(parent=self)
+        # Dialogs are built on first use, see `labelDialog` and `windowLevelDialog`
+        self._labelDialog = None
+        self._windowLevelDialog = None
+        # Slider ticks are coalesced into at most one render per display frame
+        self.dicomRenderScheduler = RenderScheduler(self.renderDialogWindowLevel, parent=self)
 
         self.itemsToShapes = {}
         self.shapesToItems = {}
@@ -593,6 +659,39 @@ class MainWindow(QMainWindow, WindowMixin):
         )
         self.autoAdjustWindowLevelOption.triggered.connect(self.autoAdjustDicomWindow)
 
+        # Use one automatic window/level for every slice of a series
+        self.seriesWindowLevelOption = QAction("Series Auto Window/Level", self)
+        self.seriesWindowLevelOption.setStatusTip(
+            "Compute the automatic window/level once per series from sampled slices."
+        )
+        self.seriesWindowLevelOption.setCheckable(True)
+        self.seriesWindowLevelOption.setChecked(
+            settings.get(SETTING_DICOM_SERIES_WINDOW, False)
+        )
+        self.seriesWindowLevelOption.triggered.connect(self.toggleSeriesWindowLevel)
+
+        # Cache the selected series as one memory-mapped volume
+        self.seriesVolumeOption = QAction("Cache Series Volumes", self)
+        self.seriesVolumeOption.setStatusTip(
+            "Keep a memory-mapped copy of each opened series to browse it without decoding."
+        )
+        self.seriesVolumeOption.setCheckable(True)
+        self.seriesVolumeOption.setChecked(
+            settings.get(SETTING_DICOM_VOLUME_CACHE, False)
+        )
+        self.seriesVolumeOption.triggered.connect(self.toggleSeriesVolume)
+
+        # Time the stages of loading and showing images
+        self.stageTimingOption = QAction("Show Stage Timings", self)
+        self.stageTimingOption.setStatusTip(
+            "Time the stages of loading an image and show their p50/p95/p99 in the status bar."
+        )
+        self.stageTimingOption.setCheckable(True)
+        self.stageTimingOption.setChecked(
+            stageTimer.enabled or settings.get(SETTING_TIMING, False)
+        )
+        self.stageTimingOption.triggered.connect(self.toggleStageTiming)
+
         # Auto saving : Enable auto saving if pressing next
         self.autoSaving = QAction("Auto Saving", self)
         self.autoSaving.setCheckable(True)
@@ -633,6 +732,9 @@ class MainWindow(QMainWindow, WindowMixin):
             (
                 self.adjustWindowLevelOption,
                 self.autoAdjustWindowLevelOption,
+                self.seriesWindowLevelOption,
+                self.seriesVolumeOption,
+                self.stageTimingOption,
                 self.autoSaving,
                 self.singleClassMode,
                 self.paintLabelsOption,
@@ -786,18 +888,46 @@ class MainWindow(QMainWindow, WindowMixin):
         # Display cursor coordinates at the right of status bar
         self.labelCoordinates = QLabel("")
         self.statusBar().addPermanentWidget(self.labelCoordinates)
+        # Display stage timings at the left of the cursor coordinates
+        self.labelTiming = QLabel("")
+        self.statusBar().insertPermanentWidget(0, self.labelTiming)
+        if self.stageTimingOption.isChecked() and not stageTimer.enabled:
+            stageTimer.enable(settings.get(SETTING_TIMING_LOG))
+        self.labelTiming.setVisible(stageTimer.enabled)
 
         # Open Dir if default file
         if self.filePath and os.path.isdir(self.filePath):
             self.openImagesDirDialog(dirpath=self.filePath)
 
     ## Support Functions ##
-    def adjustWindowLevelDialog(self):
-        # Connect the real-time signal for immediate updates
-        self.windowLevelDialog.windowLevelChanged.connect(
-            self.onDialogWindowLevelChanged
-        )
+    @property
+    def labelDialog(self):
+        if self._labelDialog is None:
+            self._labelDialog = LabelDialog(parent=self, listItem=self.labelHist)
+        return self._labelDialog
+
+    @property
+    def windowLevelDialog(self):
+        if self._windowLevelDialog is None:
+            self._windowLevelDialog = AdjustWindowLevelDialog(parent=self)
+            self._windowLevelDialog.windowLevelChanged.connect(
+                self.onDialogWindowLevelChanged
+            )
+            if self.filePath and DICOMReader.isDICOMFile(self.filePath):
+                self._windowLevelDialog.updatePhotometricInfo(self.filePath)
+        return self._windowLevelDialog
 
+    def dicomDisplayMode(self):
+        """Get the photometric display mode of the window/level dialog.
+
+        Returns:
+            None (apply photometric interpretation, the dialog default) or False.
+        """
+        if self._windowLevelDialog is None:
+            return None
+        return self._windowLevelDialog.getDisplayMode()
+
+    def adjustWindowLevelDialog(self):
         # Show the enhanced dialog
         self.windowLevelDialog.popUp(
             w_width=self.settings.get(SETTING_DICOM_WWIDTH, 1000),
@@ -813,14 +943,24 @@ class MainWindow(QMainWindow, WindowMixin):
         self.settings[SETTING_DICOM_WWIDTH] = self.dicomWindowWidth
         self.settings[SETTING_DICOM_WLEVEL] = self.dicomWindowLevel
 
-        # Reload current DICOM image with new settings
+        # Re-render with the latest values once per frame, not on every tick
+        self.dicomRenderScheduler.schedule()
+
+    def renderDialogWindowLevel(self):
+        """Render the current DICOM image with the latest window/level from the dialog."""
         self.reloadCurrentDicomImage()
+        scheduler = self.dicomRenderScheduler
+        if scheduler.dropped:
+            self.statusBar().showMessage(
+                f"DICOM window adjusted: Width={self.dicomWindowWidth}, Level={self.dicomWindowLevel}"
+                f" ({scheduler.renders} renders, {scheduler.dropped} updates coalesced)"
+            )
 
     def reloadCurrentDicomImage(self):
         """Reload current DICOM image with updated window/level settings."""
         if self.filePath and DICOMReader.isDICOMFile(self.filePath):
             # Get display mode setting from dialog
-            display_mode = self.windowLevelDialog.getDisplayMode()
+            display_mode = self.dicomDisplayMode()
 
             # Reload the current DICOM file with new window/level settings
             image = DICOMReader.getQImage(
@@ -828,11 +968,14 @@ class MainWindow(QMainWindow, WindowMixin):
                 w_width=self.dicomWindowWidth,
                 w_level=self.dicomWindowLevel,
                 force_invert=display_mode,
+                frame=self.dicomFrame,
             )
             if not image.isNull():
                 self.image = image
-                self.canvas.loadPixmap(QPixmap.fromImage(image))
+                with stageTimer.span("pixmap"):
+                    self.canvas.loadPixmap(QPixmap.fromImage(image))
                 self.paintCanvas()
+                self.updateStageTimings()
                 self.statusBar().showMessage(
                     f"DICOM window adjusted: Width={self.dicomWindowWidth}, Level={self.dicomWindowLevel}"
                 )
@@ -845,23 +988,10 @@ class MainWindow(QMainWindow, WindowMixin):
 
         try:
             # Read raw DICOM data
-            dcm = DICOMReader.readRawDICOM(self.filePath)
-            pixels = DICOMReader._dicomToRaw(dcm)
+            dicom_slice = DICOMReader.readSlice(self.filePath)
 
             # Calculate optimal window/level
-            # Use percentiles for robust statistics
-            p1 = float(np.percentile(pixels, 1))
-            p99 = float(np.percentile(pixels, 99))
-
-            # Set level to middle of range, width to full range
-            auto_level = int((p1 + p99) / 2)
-            auto_width = int(p99 - p1)
-
-            # Apply limits to prevent extreme values
-            auto_width = max(1, min(auto_width, 20000))  # Width between 1 and 20000
-            auto_level = max(
-                -10000, min(auto_level, 10000)
-            )  # Level between -10000 and 10000
+            auto_width, auto_level = dicom_slice.autoWindow(self.dicomAutoPercentiles)
 
             self.dicomWindowWidth = auto_width
             self.dicomWindowLevel = auto_level
@@ -876,6 +1006,124 @@ class MainWindow(QMainWindow, WindowMixin):
         except Exception as e:
             self.statusBar().showMessage(f"Auto-adjust failed: {str(e)}")
 
+    def startSeriesAutoWindow(self):
+        """Get the series-level automatic window, computing it in the background if needed.
+
+        Until it is ready, slices are auto-windowed one by one.
+        """
+        series = self.dicomSeries
+        self.dicomSeriesWindow = None
+        if series is None or not self.seriesWindowLevelOption.isChecked():
+            return
+
+        self.dicomSeriesWindow = series.autoWindow(self.dicomAutoPercentiles)
+        if self.dicomSeriesWindow is not None:
+            return
+
+        future = self.dicomWindowExecutor.submit(
+            DICOMReader.seriesAutoWindow,
+            series.sorted_paths(),
+            self.settings.get(SETTING_DICOM_WINDOW_SAMPLES, DEFAULT_WINDOW_SAMPLES),
+            self.dicomAutoPercentiles,
+            self.dicomSeriesCancel,
+        )
+        self.addSeriesFuture(future)
+        future.add_done_callback(lambda f: self.seriesWindowReady.emit(series, f))
+
+    def onSeriesWindowReady(self, series, future):
+        """Store and apply a series window computed in the background."""
+        if series is not self.dicomSeries or future.cancelled():
+            return
+        try:
+            series_window = future.result()
+        except Exception as e:
+            self.statusBar().showMessage(f"Series auto-adjust failed: {str(e)}")
+            return
+        if series_window is None:
+            return
+
+        series.setAutoWindow(self.dicomAutoPercentiles, *series_window)
+        if not self.seriesWindowLevelOption.isChecked():
+            return
+        self.dicomSeriesWindow = series_window
+        self.dicomWindowWidth, self.dicomWindowLevel = series_window
+        self.settings[SETTING_DICOM_WWIDTH] = self.dicomWindowWidth
+        self.settings[SETTING_DICOM_WLEVEL] = self.dicomWindowLevel
+        if self.filePath in self.mImgList:
+            self.reloadCurrentDicomImage()
+
+    def toggleSeriesWindowLevel(self):
+        self.settings[SETTING_DICOM_SERIES_WINDOW] = (
+            self.seriesWindowLevelOption.isChecked()
+        )
+        self.startSeriesAutoWindow()
+
+    def startSeriesVolume(self):
+        """Open the cached volume of the series, building it in the background if needed.
+
+        Until it is ready, slices are read from the index or the files.
+        """
+        series = self.dicomSeries
+        self.dicomVolume = None
+        if series is not None and self.seriesVolumeOption.isChecked():
+            self.dicomVolume = self.dicomVolumeCache.open(series.sorted_paths())
+            if self.dicomVolume is None:
+                future = self.dicomVolumeExecutor.submit(
+                    self.dicomVolumeCache.build, series.sorted_paths(), self.dicomSeriesCancel
+                )
+                self.addSeriesFuture(future)
+                future.add_done_callback(lambda f: self.seriesVolumeReady.emit(series, f))
+        self.updateSliceSource()
+
+    def onSeriesVolumeReady(self, series, future):
+        """Read slices from a series volume built in the background."""
+        if series is not self.dicomSeries or future.cancelled():
+            return
+        if not self.seriesVolumeOption.isChecked():
+            return
+        try:
+            self.dicomVolume = future.result()
+        except Exception as e:
+            self.statusBar().showMessage(f"Caching series volume failed: {str(e)}")
+            return
+        self.updateSliceSource()
+
+    def addSeriesFuture(self, future):
+        self.dicomSeriesFutures = [f for f in self.dicomSeriesFutures if not f.done()]
+        self.dicomSeriesFutures.append(future)
+
+    def cancelSeriesTasks(self):
+        """Stop computing the window and volume of the series being left."""
+        self.dicomSeriesCancel.set()
+        # Running tasks stop at their next slice, queued ones never start
+        for future in self.dicomSeriesFutures:
+            future.cancel()
+        self.dicomSeriesFutures = []
+        self.dicomSeriesCancel = threading.Event()
+
+    def updateSliceSource(self):
+        # The series volume serves its slices before the folder index
+        DICOMReader.sliceSource = SliceSources(self.dicomVolume, self.dicomIndex)
+
+    def toggleSeriesVolume(self):
+        self.settings[SETTING_DICOM_VOLUME_CACHE] = self.seriesVolumeOption.isChecked()
+        self.startSeriesVolume()
+
+    def toggleStageTiming(self):
+        enabled = self.stageTimingOption.isChecked()
+        self.settings[SETTING_TIMING] = enabled
+        if enabled and not stageTimer.enabled:
+            stageTimer.enable(self.settings.get(SETTING_TIMING_LOG))
+        elif not enabled and stageTimer.enabled:
+            stageTimer.disable()
+        self.labelTiming.setVisible(enabled)
+        self.updateStageTimings()
+
+    def updateStageTimings(self):
+        """Show the p50/p95/p99 in ms of the main load stages in the status bar."""
+        if stageTimer.enabled:
+            self.labelTiming.setText(stageTimer.summary(TIMING_READOUT_STAGES))
+
     def set_format(self, save_format):
         if save_format == FORMAT_PASCALVOC:
             self.actions.save_format.setText(FORMAT_PASCALVOC)
@@ -1184,42 +1432,68 @@ class MainWindow(QMainWindow, WindowMixin):
             )
 
         shapes = [format_shape(shape) for shape in self.canvas.shapes]
+        # Written in the background from a snapshot of the current state
+        labelFile = copy.copy(self.labelFile)
+        imageShape = None if self.imageShape is None else list(self.imageShape)
         # Can add differrent annotation formats here
-        try:
-            if self.usingPascalVocFormat is True:
-                if ustr(annotationFilePath[-4:]) != ".xml":
-                    annotationFilePath += XML_EXT
-                print("Img: " + self.filePath + " -> Its xml: " + annotationFilePath)
-                self.labelFile.savePascalVocFormat(
-                    annotationFilePath, shapes, self.filePath, self.imageShape
-                )
-            elif self.usingYoloFormat is True:
-                if annotationFilePath[-4:] != ".txt":
-                    annotationFilePath += TXT_EXT
-                print("Img: " + self.filePath + " -> Its txt: " + annotationFilePath)
-                self.labelFile.saveYoloFormat(
-                    annotationFilePath,
-                    shapes,
-                    self.filePath,
-                    self.imageData,
-                    self.labelHist,
-                    self.lineColor.getRgb(),
-                    self.fillColor.getRgb(),
-                    imageShape=self.imageShape,
-                )
-            else:
-                self.labelFile.save(
-                    annotationFilePath,
-                    shapes,
-                    self.filePath,
-                    self.imageData,
-                    self.lineColor.getRgb(),
-                    self.fillColor.getRgb(),
-                )
-            return True
-        except LabelFileError as e:
-            self.errorMessage("Error saving label data", "<b>%s</b>" % e)
-            return False
+        if self.usingPascalVocFormat is True:
+            if ustr(annotationFilePath[-4:]) != ".xml":
+                annotationFilePath += XML_EXT
+            print("Img: " + self.filePath + " -> Its xml: " + annotationFilePath)
+            save = partial(
+                labelFile.savePascalVocFormat,
+                annotationFilePath, shapes, self.filePath, imageShape
+            )
+        elif self.usingYoloFormat is True:
+            if annotationFilePath[-4:] != ".txt":
+                annotationFilePath += TXT_EXT
+            print("Img: " + self.filePath + " -> Its txt: " + annotationFilePath)
+            save = partial(
+                labelFile.saveYoloFormat,
+                annotationFilePath,
+                shapes,
+                self.filePath,
+                self.imageData,
+                list(self.labelHist),
+                self.lineColor.getRgb(),
+                self.fillColor.getRgb(),
+                imageShape=imageShape,
+            )
+        else:
+            save = partial(
+                labelFile.save,
+                annotationFilePath,
+                shapes,
+                self.filePath,
+                self.imageData,
+                self.lineColor.getRgb(),
+                self.fillColor.getRgb(),
+            )
+        self.savingImages[os.path.normpath(annotationFilePath)] = self.filePath
+        self.saveQueue.submit(annotationFilePath, save)
+        return True
+
+    def savedImage(self, annotationFilePath):
+        """Get the image an annotation file was saved for, forgetting it once no save is left."""
+        key = os.path.normpath(annotationFilePath)
+        imagePath = self.savingImages.get(key)
+        if not self.saveQueue.isPending(annotationFilePath):
+            self.savingImages.pop(key, None)
+        return imagePath
+
+    def onAnnotationSaved(self, annotationFilePath):
+        self.savedImage(annotationFilePath)
+        self.statusBar().showMessage("Saved to  %s" % annotationFilePath)
+        self.statusBar().show()
+
+    def onAnnotationSaveFailed(self, annotationFilePath, message):
+        # The edits are not on disk: prompt again before they are discarded
+        if self.savedImage(annotationFilePath) == self.filePath:
+            self.setDirty()
+        self.errorMessage(
+            "Error saving label data",
+            "<b>%s</b><p>%s</p>" % (message, annotationFilePath),
+        )
 
     def copySelectedShape(self):
         self.addLabel(self.canvas.copySelectedShape())
@@ -1266,7 +1540,8 @@ class MainWindow(QMainWindow, WindowMixin):
             or not self.defaultLabelTextLine.text()
         ):
             if len(self.labelHist) > 0:
-                self.labelDialog = LabelDialog(parent=self, listItem=self.labelHist)
+                # Rebuilt on use, to complete the labels added since
+                self._labelDialog = None
 
             # Sync single class mode from PR#106
             if self.singleClassMode.isChecked() and self.lastLabel:
@@ -1391,22 +1666,30 @@ class MainWindow(QMainWindow, WindowMixin):
             item.setCheckState(Qt.Checked if value else Qt.Unchecked)
 
     def loadFile(self, filePath=None):
-        """Load the specified file, or the last opened file if None."""
-        self.resetState()
-        self.canvas.setEnabled(False)
+        """Load the specified file, or the last opened file if None.
+
+        DICOM slices are loaded in the background by `requestDicomLoad`.
+        """
         if filePath is None:
             filePath = self.settings.get(SETTING_FILENAME)
 
         # Make sure that filePath is a regular python string, rather than QString
         filePath = ustr(filePath)
+        self.loadStartTime = time.perf_counter()
 
         unicodeFilePath = ustr(filePath)
-        # Tzutalin 20160906 : Add file list and dock to move faster
-        # Highlight the file item
-        if unicodeFilePath and self.fileListWidget.count() > 0:
-            index = self.mImgList.index(unicodeFilePath)
-            fileWidgetItem = self.fileListWidget.item(index)
-            fileWidgetItem.setSelected(True)
+        if (
+            unicodeFilePath
+            and DICOMReader.isDICOMFile(unicodeFilePath)
+            and os.path.exists(unicodeFilePath)
+        ):
+            return self.requestDicomLoad(unicodeFilePath)
+
+        # A DICOM slice still loading must not replace this file when it arrives
+        self.dicomLoader.cancel()
+        self.resetState()
+        self.canvas.setEnabled(False)
+        self.highlightFileItem(unicodeFilePath)
 
         if unicodeFilePath and os.path.exists(unicodeFilePath):
             if LabelFile.isLabelFile(unicodeFilePath):
@@ -1428,124 +1711,165 @@ class MainWindow(QMainWindow, WindowMixin):
                 self.fillColor = QColor(*self.labelFile.fillColor)
                 self.canvas.verified = self.labelFile.verified
                 image = QImage.fromData(self.imageData)
-            elif DICOMReader.isDICOMFile(unicodeFilePath):
-                # Auto-adjust DICOM window/level on initial load
-                try:
-                    # Read raw DICOM data for auto-adjustment
-                    dcm = DICOMReader.readRawDICOM(unicodeFilePath)
-                    pixels = DICOMReader._dicomToRaw(dcm)
+            else:
+                # Load image:
+                # read data first and store for saving into label file.
+                self.imageData = read(unicodeFilePath, None)
+                self.labelFile = None
+                self.canvas.verified = False
+                image = QImage.fromData(self.imageData)
 
-                    # Calculate optimal window/level
-                    p1 = float(np.percentile(pixels, 1))
-                    p99 = float(np.percentile(pixels, 99))
+            return self.showLoadedImage(unicodeFilePath, image)
+        return False
 
-                    # Set level to middle of range, width to full range
-                    auto_level = int((p1 + p99) / 2)
-                    auto_width = int(p99 - p1)
+    def highlightFileItem(self, filePath):
+        # Tzutalin 20160906 : Add file list and dock to move faster
+        # Highlight the file item
+        if filePath and self.fileListWidget.count() > 0:
+            index = self.mImgList.index(filePath)
+            fileWidgetItem = self.fileListWidget.item(index)
+            fileWidgetItem.setSelected(True)
 
-                    # Apply limits to prevent extreme values
-                    auto_width = max(1, min(auto_width, 20000))
-                    auto_level = max(-10000, min(auto_level, 10000))
+    def requestDicomLoad(self, filePath):
+        """Load a DICOM slice in the background, superseding slices still loading.
 
-                    # Update current values with auto-adjusted ones
-                    self.dicomWindowWidth = auto_width
-                    self.dicomWindowLevel = auto_level
+        The current image stays on the canvas, with editing disabled, until
+        the slice is shown by `onDicomSliceLoaded`.
+        """
+        self.canvas.setEnabled(False)
+        self.highlightFileItem(filePath)
+
+        # Auto-adjust DICOM window/level on initial load
+        series_window = None
+        if self.dicomSeriesWindow is not None and filePath in self.mImgList:
+            series_window = self.dicomSeriesWindow
+        # Get display mode setting from dialog (default to ON for photometric interpretation)
+        display_mode = self.dicomDisplayMode()
+        self.dicomLoader.request(
+            filePath,
+            window=series_window,
+            percentiles=self.dicomAutoPercentiles,
+            force_invert=display_mode,
+            fallback_window=(self.dicomWindowWidth, self.dicomWindowLevel),
+        )
 
-                    # Save settings
-                    self.settings[SETTING_DICOM_WWIDTH] = self.dicomWindowWidth
-                    self.settings[SETTING_DICOM_WLEVEL] = self.dicomWindowLevel
+        # Decode the next slices in the direction of navigation
+        if filePath in self.mImgList:
+            self.dicomPrefetcher.update(self.mImgList, self.mImgList.index(filePath))
+        return True
 
-                    self.statusBar().showMessage(
-                        f"DICOM auto-adjusted: Width={self.dicomWindowWidth}, Level={self.dicomWindowLevel}"
-                    )
-                except Exception as e:
-                    # If auto-adjust fails, use default values
-                    self.statusBar().showMessage(
-                        f"Auto-adjust failed, using defaults: {str(e)}"
-                    )
+    def onDicomSliceLoaded(self, result):
+        """Show the DICOM slice of the latest load request."""
+        self.resetState()
+        if result.window_error is None:
+            # Update current values with auto-adjusted ones
+            self.dicomWindowWidth, self.dicomWindowLevel = result.window
 
-                # Load DICOM file as windowed PNG with auto-adjusted values
-                # Get display mode setting from dialog (default to ON for photometric interpretation)
-                display_mode = None  # Default to photometric interpretation mode ON
-                if hasattr(self.windowLevelDialog, "getDisplayMode"):
-                    display_mode = self.windowLevelDialog.getDisplayMode()
-
-                image = DICOMReader.getQImage(
-                    unicodeFilePath,
-                    w_width=self.dicomWindowWidth,
-                    w_level=self.dicomWindowLevel,
-                    force_invert=display_mode,
-                )
+            # Save settings
+            self.settings[SETTING_DICOM_WWIDTH] = self.dicomWindowWidth
+            self.settings[SETTING_DICOM_WLEVEL] = self.dicomWindowLevel
 
-                # Update photometric interpretation info in dialog
-                if hasattr(self.windowLevelDialog, "updatePhotometricInfo"):
-                    self.windowLevelDialog.updatePhotometricInfo(unicodeFilePath)
-                self.imageShape = [image.height(), image.width(), 1]
-                self.labelFile = None
-                self.canvas.verified = False
+            self.statusBar().showMessage(
+                f"DICOM auto-adjusted: Width={self.dicomWindowWidth}, Level={self.dicomWindowLevel}"
+            )
+        else:
+            # If auto-adjust fails, use default values
+            self.statusBar().showMessage(
+                f"Auto-adjust failed, using defaults: {result.window_error}"
+            )
 
-            else:
-                # Load image:
-                # read data first and store for saving into label file.
-                self.imageData = read(unicodeFilePath, None)
-                self.labelFile = None
-                self.canvas.verified = False
-                image = QImage.fromData(self.imageData)
+        # Update photometric interpretation info in dialog, if it was opened
+        if self._windowLevelDialog is not None:
+            self._windowLevelDialog.updatePhotometricInfo(
+                result.path, photometric=result.dicom_slice.photometric
+            )
+        self.imageShape = [result.image.height(), result.image.width(), 1]
+        self.labelFile = None
+        self.canvas.verified = False
+        self.showLoadedImage(result.path, result.image)
 
-            if image.isNull():
-                self.errorMessage(
-                    "Error opening file",
-                    "<p>Make sure <i>%s</i> is a valid image file." % unicodeFilePath,
-                )
-                self.status("Error reading %s" % unicodeFilePath)
-                return False
-            self.status("Loaded %s" % os.path.basename(unicodeFilePath))
-            self.image = image
-            self.filePath = unicodeFilePath
-            self.canvas.loadPixmap(QPixmap.fromImage(image))
-            if self.labelFile:
-                self.loadLabels(self.labelFile.shapes)
-            self.setClean()
+    def onDicomLoadFailed(self, generation, filePath, message):
+        """Report a failed load, keeping the image that is shown."""
+        self.errorMessage("Error opening file", "<p>%s</p>" % message)
+        self.status("Error reading %s" % filePath)
+        if self.filePath is not None:
             self.canvas.setEnabled(True)
-            self.adjustScale(initial=True)
-            self.paintCanvas()
-            self.addRecentFile(self.filePath)
-            self.toggleActions(True)
 
-            # Label xml file and show bound box according to its filename
-            # if self.usingPascalVocFormat is True:
-            if self.defaultSaveDir is not None:
-                basename = os.path.basename(os.path.splitext(self.filePath)[0])
-                xmlPath = os.path.join(self.defaultSaveDir, basename + XML_EXT)
-                txtPath = os.path.join(self.defaultSaveDir, basename + TXT_EXT)
-
-                """Annotation file priority:
-                PascalXML > YOLO
-                """
-                if os.path.isfile(xmlPath):
-                    self.loadPascalXMLByFilename(xmlPath)
-                elif os.path.isfile(txtPath):
-                    self.loadYOLOTXTByFilename(txtPath)
-            else:
-                xmlPath = os.path.splitext(filePath)[0] + XML_EXT
-                txtPath = os.path.splitext(filePath)[0] + TXT_EXT
-                if os.path.isfile(xmlPath):
-                    self.loadPascalXMLByFilename(xmlPath)
-                elif os.path.isfile(txtPath):
-                    self.loadYOLOTXTByFilename(txtPath)
-
-            self.setWindowTitle(__appname__ + " " + filePath)
-
-            # Default : select last item if there is at least one item
-            if self.labelList.count():
-                self.labelList.setCurrentItem(
-                    self.labelList.item(self.labelList.count() - 1)
-                )
-                self.labelList.item(self.labelList.count() - 1).setSelected(True)
+    def navigationPath(self):
+        """Path of the DICOM slice being loaded, or else of the file shown.
 
-            self.canvas.setFocus(True)
-            return True
-        return False
+        Next/previous navigation steps from it, so that holding the key
+        moves on while slices are still loading.
+        """
+        pending_path = self.dicomLoader.pendingPath()
+        return pending_path if pending_path is not None else self.filePath
+
+    def showLoadedImage(self, filePath, image):
+        """Show a loaded image on the canvas with the labels saved for it."""
+        if image.isNull():
+            self.errorMessage(
+                "Error opening file",
+                "<p>Make sure <i>%s</i> is a valid image file." % filePath,
+            )
+            self.status("Error reading %s" % filePath)
+            return False
+        self.status("Loaded %s" % os.path.basename(filePath))
+        self.image = image
+        self.filePath = filePath
+        with stageTimer.span("pixmap"):
+            self.canvas.loadPixmap(QPixmap.fromImage(image))
+        if self.labelFile:
+            self.loadLabels(self.labelFile.shapes)
+        self.setClean()
+        self.canvas.setEnabled(True)
+        self.adjustScale(initial=True)
+        self.paintCanvas()
+        self.addRecentFile(self.filePath)
+        self.toggleActions(True)
+
+        # Label xml file and show bound box according to its filename
+        # if self.usingPascalVocFormat is True:
+        with stageTimer.span("annotations"):
+            self.loadAnnotationsFor(filePath)
+
+        self.setWindowTitle(__appname__ + " " + filePath)
+
+        # Default : select last item if there is at least one item
+        if self.labelList.count():
+            self.labelList.setCurrentItem(
+                self.labelList.item(self.labelList.count() - 1)
+            )
+            self.labelList.item(self.labelList.count() - 1).setSelected(True)
+
+        self.canvas.setFocus(True)
+        if self.loadStartTime is not None:
+            stageTimer.record("load", time.perf_counter() - self.loadStartTime)
+            self.loadStartTime = None
+        self.updateStageTimings()
+        return True
+
+    def loadAnnotationsFor(self, filePath):
+        """Load the annotation file saved for an image, if there is one."""
+        if self.defaultSaveDir is not None:
+            basename = os.path.basename(os.path.splitext(self.filePath)[0])
+            xmlPath = os.path.join(self.defaultSaveDir, basename + XML_EXT)
+            txtPath = os.path.join(self.defaultSaveDir, basename + TXT_EXT)
+        else:
+            xmlPath = os.path.splitext(filePath)[0] + XML_EXT
+            txtPath = os.path.splitext(filePath)[0] + TXT_EXT
+
+        # Read what was saved last, e.g. when going back to the previous image.
+        # Saves of other images are left to finish in the background.
+        self.saveQueue.flush(xmlPath)
+        self.saveQueue.flush(txtPath)
+
+        """Annotation file priority:
+        PascalXML > YOLO
+        """
+        if os.path.isfile(xmlPath):
+            self.loadPascalXMLByFilename(xmlPath)
+        elif os.path.isfile(txtPath):
+            self.loadYOLOTXTByFilename(txtPath)
 
     def resizeEvent(self, event):
         if (
@@ -1586,6 +1910,7 @@ class MainWindow(QMainWindow, WindowMixin):
     def closeEvent(self, event):
         if not self.mayContinue():
             event.ignore()
+            return
         settings = self.settings
         # If it loads images from dir, don't load it at the begining
         if self.dirname is None:
@@ -1616,6 +1941,21 @@ class MainWindow(QMainWindow, WindowMixin):
         settings[SETTING_DICOM_WWIDTH] = self.dicomWindowWidth
         settings[SETTING_DICOM_WLEVEL] = self.dicomWindowLevel
         settings.save()
+        # Every annotation is on disk before the window closes
+        self.saveQueue.flush()
+        # Slices still decoding are dropped instead of delivered to the closed window
+        self.dicomLoader.shutdown()
+        self.dicomPrefetcher.shutdown()
+        # Stop series windows and volumes still being computed
+        self.cancelSeriesTasks()
+        self.dicomWindowExecutor.shutdown(wait=False)
+        self.dicomVolumeExecutor.shutdown(wait=False)
+        self.dicomSeries = None
+        self.dicomVolume = None
+        if self.dicomIndex is not None:
+            self.dicomIndex.close()
+            self.dicomIndex = None
+        self.updateSliceSource()
 
     ## User Dialogs ##
 
@@ -1720,10 +2060,31 @@ class MainWindow(QMainWindow, WindowMixin):
         self.dirname = dirpath
         self.filePath = None
         self.fileListWidget.clear()
-
-        # Collect all DICOMs and ask user to select series
-        print("Scanning for dicoms at {}".format(dirpath))
-        series_infos = DICOMReader.scanAllDICOMs(dirpath)
+        self.dicomLoader.cancel()
+        self.dicomPrefetcher.reset()
+        self.cancelSeriesTasks()
+        self.dicomSeries = None
+        self.dicomSeriesWindow = None
+        self.dicomVolume = None
+
+        # Collect all DICOMs and ask user to select series, from the index if there is one
+        series_infos = []
+        if self.dicomIndex is not None:
+            self.dicomIndex.close()
+        self.dicomIndex = DICOMIndex.find(dirpath)
+        # Slices of indexed files are read without parsing their headers
+        self.updateSliceSource()
+        if self.dicomIndex is not None:
+            print("Loading series from index at {}".format(self.dicomIndex.path))
+            series_infos = self.dicomIndex.seriesInfos(dirpath)
+        if len(series_infos) == 0:
+            print("Scanning for dicoms at {}".format(dirpath))
+            series_infos = DICOMReader.scanAllDICOMs(
+                dirpath,
+                num_workers=self.settings.get(
+                    SETTING_DICOM_SCAN_WORKERS, DEFAULT_SCAN_WORKERS
+                ),
+            )
         if len(series_infos) == 0:
             return
 
@@ -1736,6 +2097,9 @@ class MainWindow(QMainWindow, WindowMixin):
             return
         selected_series = series_infos[selected_idx]
         self.mImgList = selected_series.sorted_paths()
+        self.dicomSeries = selected_series
+        self.startSeriesAutoWindow()
+        self.startSeriesVolume()
 
         self.openNextImg()
         for imgPath in self.mImgList:
@@ -1772,6 +2136,7 @@ class MainWindow(QMainWindow, WindowMixin):
         self.dirname = dirpath
         self.filePath = None
         self.fileListWidget.clear()
+        self.dicomLoader.cancel()
         self.mImgList = self.scanAllImages(dirpath)
         self.openNextImg()
         for imgPath in self.mImgList:
@@ -1812,10 +2177,11 @@ class MainWindow(QMainWindow, WindowMixin):
         if len(self.mImgList) <= 0:
             return
 
-        if self.filePath is None:
+        currPath = self.navigationPath()
+        if currPath is None:
             return
 
-        currIndex = self.mImgList.index(self.filePath)
+        currIndex = self.mImgList.index(currPath)
         if currIndex - 1 >= 0:
             filename = self.mImgList[currIndex - 1]
             if filename:
@@ -1841,12 +2207,13 @@ class MainWindow(QMainWindow, WindowMixin):
 
     def refreshImg(self):
         filename = None
-        if self.filePath is None:
+        currPath = self.navigationPath()
+        if currPath is None:
             if len(self.mImgList) > 0:
                 filename = self.mImgList[0]
         else:
             try:
-                currIndex = self.mImgList.index(self.filePath)
+                currIndex = self.mImgList.index(currPath)
                 if currIndex + 1 < len(self.mImgList):
                     filename = self.mImgList[currIndex + 1]
             except ValueError:
@@ -1913,7 +2280,7 @@ class MainWindow(QMainWindow, WindowMixin):
     def _saveFile(self, annotationFilePath):
         if annotationFilePath and self.saveLabels(annotationFilePath):
             self.setClean()
-            self.statusBar().showMessage("Saved to  %s" % annotationFilePath)
+            self.statusBar().showMessage("Saving to  %s" % annotationFilePath)
             self.statusBar().show()
 
     def closeFile(self, _value=False):
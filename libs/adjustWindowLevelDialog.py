@@ -6,6 +6,7 @@ except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
 
+from libs.constants import DICOM_WINDOW_PRESETS
 from libs.lib import newIcon, labelValidator
 
 BB = QDialogButtonBox
@@ -87,16 +88,7 @@ class AdjustWindowLevelDialog(QDialog):
         self.preset_combo = QComboBox()
 
         # Define medical presets (width, level)
-        self.medical_presets = {
-            "Lung": (1500, -600),  # Default: Lung cancer
-            "Soft Tissue": (400, 40),
-            "Bone": (1500, 400),
-            "Abdomen": (400, 50),
-            "Brain": (100, 50),
-            "Mediastinum": (500, 50),
-            "Liver": (160, 60),
-            "Custom": (1000, 200),
-        }
+        self.medical_presets = dict(DICOM_WINDOW_PRESETS)
 
         for preset_name in self.medical_presets.keys():
             self.preset_combo.addItem(preset_name)
@@ -424,8 +416,16 @@ class AdjustWindowLevelDialog(QDialog):
         level_value = self.level_slider.value()
         self.windowLevelChanged.emit(width_value, level_value)
 
-    def updatePhotometricInfo(self, dicom_path):
-        """Update photometric interpretation info from DICOM file"""
+    def updatePhotometricInfo(self, dicom_path, photometric=None):
+        """Update photometric interpretation info from DICOM file.
+
+        If `photometric` is already known (e.g. from a decoded slice), the
+        file is not read again.
+        """
+        if photometric is not None:
+            self.photo_info_label.setText(photometric)
+            return
+
         try:
             from libs.dicom_io import DICOMReader
 
@@ -0,0 +1,227 @@
+"""Bulk loading of every annotation saved under a directory tree.
+
+Pascal VOC and YOLO files are parsed by a pool of workers and the boxes of
+all files are returned as columns:
+
+    boxes        (M, 4) xmin, ymin, xmax, ymax of every box, in pixels
+    label_codes  (M,) index in `labels` of the label of each box
+    file_ids     (M,) index in `files` of the annotation file of each box
+    difficult    (M,) difficult flag of each box
+
+Labels are coded in order of first appearance over the files, and files
+keep the order they are given in, so the result is the same for any number
+of workers. Files that cannot be read are listed in `failures` instead of
+stopping the load.
+
+YOLO class lists are read once per folder and worker, and read again only
+when their `classes.txt` changes.
+"""
+import numpy as np
+import os
+import time
+
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from libs.constants import BBOX_DIR_NAME
+from libs.dicom_io import DICOMReader
+from libs.dicom_index import listSeriesInfos
+from libs.pascal_voc_io import XML_EXT
+from libs.yolo_io import TXT_EXT, YOLO_CLASSES_FILENAME, readClassList, yoloBoxToPixels
+
+# An annotation file, the image it annotates (None if unknown) and the image
+# size, needed to convert YOLO boxes to pixels (None if unknown)
+AnnotationFile = namedtuple("AnnotationFile", ["path", "image_path", "height", "width"])
+# Columns of the boxes of all files, see the module docstring
+AnnotationTable = namedtuple(
+    "AnnotationTable",
+    ["files", "boxes", "label_codes", "labels", "file_ids", "difficult", "failures", "seconds"],
+)
+
+# YOLO class lists of this process: folder -> ((size, mtime) of classes.txt, classes)
+_yoloClasses = {}
+
+
+def annotationPath(dicom_path):
+    """Get the annotation file saved for a slice, Pascal VOC before YOLO, or None."""
+    basename = os.path.splitext(os.path.basename(dicom_path))[0]
+    bbox_dir = os.path.join(os.path.dirname(dicom_path), BBOX_DIR_NAME)
+    for ext in (XML_EXT, TXT_EXT):
+        path = os.path.join(bbox_dir, basename + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def findAnnotationFiles(save_dir, image_size=None):
+    """Find the annotation files under a save directory.
+
+    A Pascal VOC file wins over a YOLO file of the same image, as when
+    labelImg opens an image.
+
+    Args:
+        save_dir: Root of the directory tree to search.
+        image_size: (height, width) of the images, needed for YOLO files.
+            YOLO files fail to load if None.
+
+    Returns:
+        List of AnnotationFile, sorted by path.
+    """
+    height, width = image_size if image_size is not None else (None, None)
+    files = []
+    for dirpath, dirnames, filenames in os.walk(save_dir):
+        dirnames.sort()
+        found = {}
+        for filename in filenames:
+            basename, ext = os.path.splitext(filename)
+            if ext == XML_EXT or (ext == TXT_EXT and filename != YOLO_CLASSES_FILENAME):
+                if found.get(basename, TXT_EXT) == TXT_EXT:
+                    found[basename] = ext
+        for basename in sorted(found):
+            path = os.path.join(dirpath, basename + found[basename])
+            files.append(AnnotationFile(path, None, height, width))
+    return files
+
+
+def seriesAnnotationFiles(dirpath, num_workers=0, use_processes=False):
+    """Find the annotation files of the slices of every series under `dirpath`.
+
+    Series are read from the series index if there is one, else found by
+    scanning headers (see `listSeriesInfos`). Slice sizes come from the
+    series, so YOLO files need no image size.
+
+    Returns:
+        List of AnnotationFile, in series and slice order.
+    """
+    files = []
+    for series_info in listSeriesInfos(dirpath, num_workers, use_processes):
+        paths = series_info.sorted_paths()
+        if not paths or not os.path.isdir(os.path.join(os.path.dirname(paths[0]), BBOX_DIR_NAME)):
+            continue
+        for dicom_path in paths:
+            path = annotationPath(dicom_path)
+            if path is not None:
+                files.append(AnnotationFile(path, dicom_path, series_info.height, series_info.width))
+    return files
+
+
+def yoloClasses(bbox_dir):
+    """Get the class names of the YOLO annotations in a folder, cached per process."""
+    classes_path = os.path.join(bbox_dir, YOLO_CLASSES_FILENAME)
+    st = os.stat(classes_path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = _yoloClasses.get(bbox_dir)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    classes = readClassList(classes_path)
+    _yoloClasses[bbox_dir] = (stamp, classes)
+    return classes
+
+
+def parseVocBoxes(path):
+    """Read the boxes of a Pascal VOC file.
+
+    Parses like PascalVocReader, without its lxml parser.
+
+    Returns:
+        List of (label, xmin, ymin, xmax, ymax, difficult).
+    """
+    boxes = []
+    for object_iter in ElementTree.parse(path).getroot().findall("object"):
+        bndbox = object_iter.find("bndbox")
+        difficult = object_iter.find("difficult")
+        boxes.append((
+            object_iter.find("name").text,
+            int(bndbox.find("xmin").text),
+            int(bndbox.find("ymin").text),
+            int(bndbox.find("xmax").text),
+            int(bndbox.find("ymax").text),
+            difficult is not None and bool(int(difficult.text)),
+        ))
+    return boxes
+
+
+def parseYoloBoxes(path, height, width):
+    """Read the boxes of a YOLO file, converted to pixels.
+
+    Returns:
+        List of (label, xmin, ymin, xmax, ymax, difficult).
+    """
+    if height is None or width is None:
+        raise ValueError("Image size unknown, needed to convert YOLO boxes")
+    classes = yoloClasses(os.path.dirname(path))
+    boxes = []
+    with open(path, "r") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            class_index, xcen, ycen, w, h = line.split()
+            xmin, ymin, xmax, ymax = yoloBoxToPixels(xcen, ycen, w, h, height, width)
+            boxes.append((classes[int(class_index)], xmin, ymin, xmax, ymax, False))
+    return boxes
+
+
+def readAnnotation(annotation_path, height, width):
+    """Read the boxes of a Pascal VOC (.xml) or YOLO (.txt) annotation file.
+
+    Args:
+        annotation_path: Annotation file.
+        height, width: Image size, to convert YOLO boxes to pixels.
+
+    Returns:
+        List of (label, xmin, ymin, xmax, ymax, difficult).
+    """
+    if annotation_path.endswith(XML_EXT):
+        return parseVocBoxes(annotation_path)
+    return parseYoloBoxes(annotation_path, height, width)
+
+
+def _readAnnotationFile(annotation_file):
+    """Read the boxes of one file. Runs in a worker.
+
+    Returns:
+        Tuple (list of boxes, None), or (None, error message) if the file cannot be read.
+    """
+    try:
+        return readAnnotation(annotation_file.path, annotation_file.height, annotation_file.width), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def loadAnnotations(files, num_workers=0, use_processes=True):
+    """Read the boxes of many annotation files into columns.
+
+    Args:
+        files: List of AnnotationFile, e.g. from `findAnnotationFiles` or
+            `seriesAnnotationFiles`.
+        num_workers: Number of workers. If 0, read serially.
+        use_processes: If true, use worker processes instead of threads.
+
+    Returns:
+        AnnotationTable.
+    """
+    start = time.time()
+    results = DICOMReader.mapFiles(_readAnnotationFile, files, num_workers, use_processes)
+
+    boxes, label_codes, file_ids, difficult, failures = [], [], [], [], []
+    codes = {}
+    for file_id, (annotation_file, (file_boxes, error)) in enumerate(zip(files, results)):
+        if error is not None:
+            failures.append((annotation_file.path, error))
+            continue
+        for label, xmin, ymin, xmax, ymax, box_difficult in file_boxes:
+            boxes.append((xmin, ymin, xmax, ymax))
+            label_codes.append(codes.setdefault(label, len(codes)))
+            file_ids.append(file_id)
+            difficult.append(box_difficult)
+
+    return AnnotationTable(
+        files=list(files),
+        boxes=np.array(boxes, dtype=np.int32).reshape(-1, 4),
+        label_codes=np.array(label_codes, dtype=np.int32),
+        labels=list(codes),
+        file_ids=np.array(file_ids, dtype=np.int32),
+        difficult=np.array(difficult, dtype=bool),
+        failures=failures,
+        seconds=time.time() - start,
+    )
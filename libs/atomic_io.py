@@ -0,0 +1,21 @@
+"""Replacement of files in one step, so readers never see a partial file."""
+import os
+
+
+def atomicWrite(path, data):
+    """Replace the file at `path` with `data` (bytes), all at once.
+
+    The data is written to a temporary file next to `path`, flushed to disk,
+    then renamed over `path`. If writing fails, `path` is left as it was.
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -10,6 +10,7 @@ except ImportError:
 
 from libs.shape import Shape
 from libs.lib import distance
+from libs.timing import stageTimer
 
 CURSOR_DEFAULT = Qt.ArrowCursor
 CURSOR_POINT = Qt.PointingHandCursor
@@ -418,6 +419,10 @@ class Canvas(QWidget):
         if not self.pixmap:
             return super(Canvas, self).paintEvent(event)
 
+        with stageTimer.span("paint"):
+            self.paintPixmap()
+
+    def paintPixmap(self):
         p = self._painter
         p.begin(self)
         p.setRenderHint(QPainter.Antialiasing)
@@ -14,8 +14,34 @@ SETTING_AUTO_SAVE = 'autosave'
 SETTING_SINGLE_CLASS = 'singleclass'
 SETTING_DICOM_WLEVEL = 'dicom/level'
 SETTING_DICOM_WWIDTH = 'dicom/width'
+SETTING_DICOM_CACHE_MB = 'dicom/cacheMB'
+SETTING_DICOM_PREFETCH = 'dicom/prefetch'
+SETTING_DICOM_SCAN_WORKERS = 'dicom/scanWorkers'
+SETTING_DICOM_AUTO_PERCENTILES = 'dicom/autoPercentiles'
+SETTING_DICOM_SERIES_WINDOW = 'dicom/seriesWindow'
+SETTING_DICOM_WINDOW_SAMPLES = 'dicom/windowSamples'
+SETTING_DICOM_VOLUME_CACHE = 'dicom/volumeCache'
+SETTING_DICOM_VOLUME_DIR = 'dicom/volumeDir'
+SETTING_TIMING = 'timing/enabled'
+SETTING_TIMING_LOG = 'timing/log'
 FORMAT_PASCALVOC='PascalVOC'
 FORMAT_YOLO='YOLO'
 BBOX_DIR_NAME = 'bbox'
 META_FILENAME = 'dicom_metadata.pkl'
+INDEX_FILENAME = 'dicom_index.sqlite'
 REPORT_FILENAME = 'report.txt'
+# Named DICOM window presets: name -> (width, level)
+DICOM_WINDOW_PRESETS = {
+    'Lung': (1500, -600),  # Default: Lung cancer
+    'Soft Tissue': (400, 40),
+    'Bone': (1500, 400),
+    'Abdomen': (400, 50),
+    'Brain': (100, 50),
+    'Mediastinum': (500, 50),
+    'Liver': (160, 60),
+    'Custom': (1000, 200),
+}
+# Preset name for the automatic window of each slice
+DICOM_AUTO_PRESET = 'Auto'
+# Stages shown in the status bar while stage timing is on
+TIMING_READOUT_STAGES = ('load', 'dicom.read', 'dicom.window', 'pixmap', 'annotations', 'paint')
@@ -0,0 +1,159 @@
+"""Histogram-based automatic window/level for DICOM slices.
+
+Percentiles of integer images are read off a single histogram of the pixel
+values instead of sorting the image, and the histogram of a slice can be
+kept so that re-windowing it never touches the pixels again.
+"""
+import numpy as np
+
+# Percentiles of the pixel values spanned by the automatic window
+DEFAULT_PERCENTILES = (1, 99)
+
+# Number of slices sampled for the automatic window of a whole series
+DEFAULT_WINDOW_SAMPLES = 16
+
+# Limits of the automatic window, to prevent extreme values
+MIN_WIDTH, MAX_WIDTH = 1, 20000
+MIN_LEVEL, MAX_LEVEL = -10000, 10000
+
+# Largest value range of wider integer images that is still counted in a histogram
+MAX_HISTOGRAM_BINS = 1 << 20
+
+_SMALL_INT_DTYPES = (np.dtype(np.int8), np.dtype(np.uint8), np.dtype(np.int16), np.dtype(np.uint16))
+
+
+class PixelHistogram(object):
+    """Counts of every integer pixel value between the image min and max.
+
+    `counts[i]` is the number of pixels with value `offset + i`.
+    """
+
+    def __init__(self, counts, offset):
+        self.counts = counts
+        self.offset = offset
+        self._cumsum = None
+
+    @classmethod
+    def fromPixels(cls, pixels):
+        """Count pixel values with one bincount pass over the image.
+
+        8- and 16-bit images are counted through their unsigned view. Wider
+        integer images are shifted by their minimum first.
+
+        Args:
+            pixels: Integer image.
+
+        Returns:
+            PixelHistogram trimmed to the range of values present, or None if
+            the image is not integer or its range is too wide.
+        """
+        dtype = pixels.dtype
+        if pixels.size == 0 or dtype.kind not in "iu":
+            return None
+
+        if dtype in _SMALL_INT_DTYPES:
+            num_values = 1 << (8 * dtype.itemsize)
+            unsigned = pixels.view(np.dtype("u%d" % dtype.itemsize))
+            counts = np.bincount(unsigned.ravel(), minlength=num_values)
+            offset = 0
+            if dtype.kind == "i":
+                # Negative values sit above the positive ones in the unsigned view
+                counts = np.roll(counts, num_values // 2)
+                offset = -(num_values // 2)
+        else:
+            offset, p_max = int(pixels.min()), int(pixels.max())
+            if p_max - offset >= MAX_HISTOGRAM_BINS:
+                return None
+            counts = np.bincount((pixels.ravel() - offset).astype(np.intp))
+
+        nonzero = np.flatnonzero(counts)
+        lo, hi = nonzero[0], nonzero[-1]
+        count_dtype = np.int32 if pixels.size <= np.iinfo(np.int32).max else np.int64
+        return cls(counts[lo:hi + 1].astype(count_dtype), offset + int(lo))
+
+    @classmethod
+    def merge(cls, histograms):
+        """Sum histograms of several images into one.
+
+        Args:
+            histograms: Non-empty sequence of PixelHistogram.
+        """
+        offset = min(h.offset for h in histograms)
+        end = max(h.offset + len(h.counts) for h in histograms)
+        counts = np.zeros(end - offset, dtype=np.int64)
+        for h in histograms:
+            counts[h.offset - offset:h.offset - offset + len(h.counts)] += h.counts
+        return cls(counts, offset)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes
+
+    def percentiles(self, percentiles):
+        """Get percentiles of the pixel values.
+
+        Matches `np.percentile` with its default linear interpolation.
+
+        Args:
+            percentiles: Sequence of percentiles in [0, 100].
+
+        Returns:
+            List of float percentile values.
+        """
+        cumsum = self._cumulative()
+        num_pixels = int(cumsum[-1])
+        ranks = np.asarray(percentiles, dtype=np.float64) / 100 * (num_pixels - 1)
+        below = np.floor(ranks)
+        # Value of the k-th smallest pixel is the first bin holding more than k pixels
+        lo = np.searchsorted(cumsum, below, side="right")
+        hi = np.searchsorted(cumsum, np.minimum(below + 1, num_pixels - 1), side="right")
+        values = self.offset + lo + (ranks - below) * (hi - lo)
+        return [float(v) for v in values]
+
+    def _cumulative(self):
+        if self._cumsum is None:
+            self._cumsum = np.cumsum(self.counts, dtype=np.int64)
+        return self._cumsum
+
+
+def sampleIndices(num_items, num_samples=DEFAULT_WINDOW_SAMPLES):
+    """Get up to `num_samples` evenly spaced indices into `num_items` items."""
+    if num_items <= 0 or num_samples <= 0:
+        return []
+    samples = np.linspace(0, num_items - 1, min(num_items, num_samples))
+    return sorted(set(int(i) for i in samples.round()))
+
+
+def windowFromPercentiles(p_low, p_high):
+    """Get the (w_width, w_level) spanning two pixel values, within sane limits."""
+    # Set level to middle of range, width to full range
+    auto_level = int((p_low + p_high) / 2)
+    auto_width = int(p_high - p_low)
+
+    auto_width = max(MIN_WIDTH, min(auto_width, MAX_WIDTH))
+    auto_level = max(MIN_LEVEL, min(auto_level, MAX_LEVEL))
+
+    return auto_width, auto_level
+
+
+def autoWindow(pixels, percentiles=DEFAULT_PERCENTILES, histogram=None):
+    """Compute a window width and level that covers the bulk of an image.
+
+    Args:
+        pixels: Raw Hounsfield Units for every pixel.
+        percentiles: (low, high) percentiles spanned by the window.
+        histogram: PixelHistogram of `pixels`, if already computed.
+            Images without a histogram fall back to `np.percentile`.
+
+    Returns:
+        Tuple (w_width, w_level) spanning the given percentiles.
+    """
+    if histogram is None:
+        histogram = PixelHistogram.fromPixels(pixels)
+
+    if histogram is not None:
+        p_low, p_high = histogram.percentiles(percentiles)
+    else:
+        p_low, p_high = (float(p) for p in np.percentile(pixels, percentiles))
+
+    return windowFromPercentiles(p_low, p_high)
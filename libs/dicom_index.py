@@ -0,0 +1,665 @@
+"""SQLite index of the DICOM files, series and studies under a root directory.
+
+One index file per root (`INDEX_FILENAME`) replaces the per-folder
+`META_FILENAME` pickles. Build it with scripts/preload_metadata.py.
+"""
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+from libs.constants import INDEX_FILENAME
+from libs.dicom_io import DICOMReader, DICOMSeriesInfo, DICOMSlice, DISCOVERY_TAGS
+from libs.dicom_rescale import rescaleToHU
+
+# Bump when the schema changes: an index with another version is rebuilt from scratch
+INDEX_SCHEMA_VERSION = 4
+
+# Header fields stored in the index
+INDEX_TAGS = DISCOVERY_TAGS + (
+    "AccessionNumber",
+    "PatientID",
+    "StudyDate",
+    "StudyDescription",
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "SOPInstanceUID",
+    "SamplesPerPixel",
+    "NumberOfFrames",
+    "BitsAllocated",
+    "BitsStored",
+    "PixelRepresentation",
+    "RescaleIntercept",
+    "RescaleSlope",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study_id INTEGER PRIMARY KEY,
+    study_uid TEXT NOT NULL UNIQUE,
+    accession TEXT,
+    patient_id TEXT,
+    study_date TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS studies_accession ON studies (accession);
+
+CREATE TABLE IF NOT EXISTS series (
+    series_id INTEGER PRIMARY KEY,
+    study_id INTEGER NOT NULL REFERENCES studies (study_id),
+    series_uid TEXT,
+    series_num INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    description TEXT,
+    window_percentiles TEXT,
+    window_width INTEGER,
+    window_level INTEGER,
+    pixel_dtype TEXT,
+    bits_stored INTEGER,
+    UNIQUE (study_id, series_num, height, width)
+);
+CREATE INDEX IF NOT EXISTS series_uid ON series (series_uid);
+
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    series_id INTEGER NOT NULL REFERENCES series (series_id),
+    instance_num INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    pixel_offset INTEGER,
+    pixel_length INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_series ON files (series_id, instance_num);
+
+CREATE TABLE IF NOT EXISTS headers (
+    file_id INTEGER PRIMARY KEY REFERENCES files (file_id),
+    sop_instance_uid TEXT,
+    photometric TEXT,
+    transfer_syntax TEXT,
+    slope REAL,
+    intercept REAL
+);
+"""
+
+TABLES = ("headers", "files", "series", "studies")
+
+# Outcome of DICOMIndex.update
+IndexUpdate = namedtuple(
+    "IndexUpdate", ["added", "changed", "removed", "unchanged", "unreadable", "seconds"]
+)
+
+
+def _getInt(dcm, keyword):
+    try:
+        return int(dcm.get(keyword))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _getFloat(dcm, keyword, default):
+    try:
+        return float(dcm.get(keyword))
+    except (TypeError, ValueError):
+        return default
+
+
+def _getStr(dcm, keyword, default=""):
+    value = dcm.get(keyword)
+    return default if value is None else str(value)
+
+
+def _fileStamp(st):
+    """Get the (size, mtime_ns, inode) that tells whether a file changed."""
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _percentilesKey(percentiles):
+    return ",".join("%g" % p for p in percentiles)
+
+
+def _readIndexRecord(dicom_path):
+    """Read the header fields stored in the index for one file.
+
+    Module-level so that it can be sent to worker processes.
+
+    Returns:
+        Dict of index fields, or None if the file cannot be read.
+    """
+    try:
+        st = os.stat(dicom_path)
+        dcm = DICOMReader.probeHeader(dicom_path, tags=INDEX_TAGS)
+        with open(dicom_path, "rb") as dicom_fh:
+            layout = DICOMReader.locateTrailingPixelData(dcm, dicom_fh, st.st_size)
+    except Exception:
+        return None
+
+    file_meta = getattr(dcm, "file_meta", {})
+    pixel_len = None
+    if layout is not None:
+        pixel_len = int(np.prod(layout.shape)) * np.dtype(layout.dtype).itemsize
+    return dict(
+        stamp=_fileStamp(st),
+        study_uid=_getStr(dcm, "StudyInstanceUID"),
+        accession=_getStr(dcm, "AccessionNumber"),
+        patient_id=_getStr(dcm, "PatientID"),
+        study_date=_getStr(dcm, "StudyDate"),
+        study_description=_getStr(dcm, "StudyDescription"),
+        series_uid=_getStr(dcm, "SeriesInstanceUID"),
+        series_num=_getInt(dcm, "SeriesNumber"),
+        height=_getInt(dcm, "Rows"),
+        width=_getInt(dcm, "Columns"),
+        description=_getStr(dcm, "SeriesDescription", "None"),
+        instance_num=_getInt(dcm, "InstanceNumber"),
+        sop_instance_uid=_getStr(dcm, "SOPInstanceUID"),
+        photometric=_getStr(dcm, "PhotometricInterpretation", "MONOCHROME2"),
+        transfer_syntax=str(file_meta.get("TransferSyntaxUID", "")),
+        slope=_getFloat(dcm, "RescaleSlope", 1.0),
+        intercept=_getFloat(dcm, "RescaleIntercept", 0.0),
+        pixel_format=None if layout is None else (layout.dtype, _getInt(dcm, "BitsStored")),
+        pixel_offset=None if layout is None else layout.offset,
+        pixel_length=pixel_len,
+    )
+
+
+class DICOMIndex(object):
+    """SQLite index of the DICOM files, series and studies under a root.
+
+    Paths are stored relative to the root. Series are grouped by
+    (study, SeriesNumber, Rows, Columns).
+    """
+
+    def __init__(self, root):
+        """Open the index of a root, without writing to it.
+
+        The tables are only created, or replaced if they have another
+        layout, by `build` and `update`, so opening an index on a read-only
+        mount or with an older version of labelImg never changes it.
+        """
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, INDEX_FILENAME)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # Layout of the stored tables, 0 if none were created yet
+        self.version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+
+    @classmethod
+    def find(cls, path):
+        """Open the index covering `path`, stored at `path` or its closest ancestor.
+
+        Indexes that cannot be read or have another layout are skipped.
+
+        Returns:
+            DICOMIndex, or None if no index covers `path`.
+        """
+        path = os.path.abspath(path)
+        while True:
+            if os.path.isfile(os.path.join(path, INDEX_FILENAME)):
+                try:
+                    index = cls(path)
+                except sqlite3.Error:
+                    index = None
+                if index is not None:
+                    if index.version == INDEX_SCHEMA_VERSION:
+                        return index
+                    index.close()
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def build(self, num_workers=0, use_processes=False):
+        """Scan the whole root and replace the contents of the index.
+
+        Args:
+            num_workers: Number of workers reading headers. If 0, read serially.
+            use_processes: If true, use worker processes instead of threads.
+
+        Returns:
+            IndexUpdate with the number of files in each state.
+        """
+        self._createSchema()
+        with self._lock, self._conn:
+            for table in TABLES:
+                self._conn.execute(f"DELETE FROM {table}")
+        return self.update(num_workers, use_processes)
+
+    def update(self, num_workers=0, use_processes=False):
+        """Bring the index in line with the files under the root.
+
+        Only headers of files that are new, or whose size, mtime or inode
+        changed, are read. Records of deleted files are dropped.
+
+        Args:
+            num_workers: Number of workers reading headers. If 0, read serially.
+            use_processes: If true, use worker processes instead of threads.
+
+        Returns:
+            IndexUpdate with the number of files in each state. Unreadable
+            files are not indexed, so they are retried on the next update.
+        """
+        start = time.perf_counter()
+        self._createSchema()
+        with self._lock:
+            indexed = {
+                path: (file_id, (size, mtime_ns, inode))
+                for file_id, path, size, mtime_ns, inode in self._conn.execute(
+                    "SELECT file_id, path, size, mtime_ns, inode FROM files"
+                )
+            }
+
+        on_disk = set()
+        num_added, num_unchanged = 0, 0
+        to_read, stale_ids = [], []
+        for dcm_path in DICOMReader.listDICOMs(self.root):
+            rel_path = self._relPath(dcm_path)
+            on_disk.add(rel_path)
+            try:
+                stamp = _fileStamp(os.stat(dcm_path))
+            except OSError:
+                continue
+            if rel_path not in indexed:
+                num_added += 1
+                to_read.append(dcm_path)
+            elif indexed[rel_path][1] != stamp:
+                stale_ids.append(indexed[rel_path][0])
+                to_read.append(dcm_path)
+            else:
+                num_unchanged += 1
+        removed_ids = [file_id for path, (file_id, _) in indexed.items() if path not in on_disk]
+
+        records = DICOMReader.mapFiles(_readIndexRecord, to_read, num_workers, use_processes)
+
+        num_unreadable = 0
+        with self._lock, self._conn:
+            touched_ids = self._deleteFiles(stale_ids + removed_ids)
+            study_ids, series_ids = {}, {}
+            for dcm_path, record in zip(to_read, records):
+                if record is None:
+                    num_unreadable += 1
+                    continue
+                self._insert(self._relPath(dcm_path), record, study_ids, series_ids)
+            touched_ids.update(series_id for series_id, _ in series_ids.values())
+            self._deleteOrphans()
+
+            # Series windows were computed from the old files
+            self._conn.executemany(
+                "UPDATE series SET window_percentiles = NULL, window_width = NULL,"
+                " window_level = NULL WHERE series_id = ?",
+                [(series_id,) for series_id in touched_ids],
+            )
+
+        return IndexUpdate(
+            added=num_added,
+            changed=len(stale_ids),
+            removed=len(removed_ids),
+            unchanged=num_unchanged,
+            unreadable=num_unreadable,
+            seconds=time.perf_counter() - start,
+        )
+
+    def numFiles(self, dirpath=None):
+        """Get the number of indexed files under `dirpath` (default: the whole root)."""
+        where, params = self._pathRange(dirpath)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM files AS f WHERE {where}", params
+            ).fetchone()[0]
+
+    def seriesInfos(self, dirpath=None):
+        """Get the series with files under `dirpath` (default: the whole root).
+
+        Returns:
+            List of IndexedSeriesInfo sorted by (series_num, height, width).
+        """
+        where, params = self._pathRange(dirpath)
+        return self._querySeries(where, params)
+
+    def seriesByAccession(self, accession):
+        """Get all series of the studies with the given accession number."""
+        return self._querySeries("st.accession = ?", (str(accession),))
+
+    def seriesByUID(self, series_uid):
+        """Get the series with the given SeriesInstanceUID."""
+        return self._querySeries("s.series_uid = ?", (str(series_uid),))
+
+    def seriesPaths(self, series_id, where="1", params=()):
+        """Get the (instance_num, absolute path) rows of a series, sorted by instance."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.instance_num, f.path FROM files AS f"
+                f" WHERE f.series_id = ? AND {where}"
+                " ORDER BY f.instance_num, f.path",
+                (series_id,) + tuple(params),
+            ).fetchall()
+        return [(n, os.path.join(self.root, p)) for n, p in rows]
+
+    def loadSlice(self, dicom_path):
+        """Load a slice with one positioned read, using the pixel layout in the index.
+
+        The file header is not parsed: the slice header only holds the fields
+        stored in the index that display needs.
+
+        Returns:
+            DICOMSlice, or None if the file is not indexed, changed since it
+            was indexed (size or mtime), its pixels cannot be read raw, or
+            the index cannot be read (e.g. it was closed by another thread).
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT f.size, f.mtime_ns, f.pixel_offset, f.pixel_length, s.pixel_dtype,"
+                    " s.height, s.width, s.bits_stored, h.slope, h.intercept, h.photometric"
+                    " FROM files AS f"
+                    " JOIN series AS s ON s.series_id = f.series_id"
+                    " JOIN headers AS h ON h.file_id = f.file_id"
+                    " WHERE f.path = ?",
+                    (self._relPath(dicom_path),),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[2] is None:
+            return None
+        (size, mtime_ns, pixel_offset, pixel_length, pixel_dtype,
+         height, width, bits_stored, slope, intercept, photometric) = row
+
+        stored = np.empty((height, width), dtype=np.dtype(pixel_dtype))
+        if stored.nbytes != pixel_length:
+            return None
+        try:
+            with open(dicom_path, "rb") as dicom_fh:
+                st = os.fstat(dicom_fh.fileno())
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    return None
+                dicom_fh.seek(pixel_offset)
+                if dicom_fh.readinto(stored.reshape(-1).view(np.uint8)) != pixel_length:
+                    return None
+        except OSError:
+            return None
+
+        pixels = rescaleToHU(stored, slope, intercept, bits_stored, mask_unused_bits=True)
+        return DICOMSlice.fromPixels(dicom_path, pixels, photometric)
+
+    def seriesWindow(self, series_id, percentiles):
+        """Get the stored automatic window of a series.
+
+        Returns:
+            Tuple (w_width, w_level), or None if no window was stored for
+            these percentiles since the series last changed, or the index
+            cannot be read (e.g. it was closed).
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT window_width, window_level FROM series"
+                    " WHERE series_id = ? AND window_percentiles = ?",
+                    (series_id, _percentilesKey(percentiles)),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return None if row is None or row[0] is None else tuple(row)
+
+    def setSeriesWindow(self, series_id, percentiles, w_width, w_level):
+        """Store the automatic window of a series computed for `percentiles`.
+
+        Returns:
+            Whether the window was stored, False if the index cannot be written.
+        """
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE series SET window_percentiles = ?, window_width = ?, window_level = ?"
+                    " WHERE series_id = ?",
+                    (_percentilesKey(percentiles), int(w_width), int(w_level), series_id),
+                )
+        except sqlite3.Error:
+            return False
+        return True
+
+    def _createSchema(self):
+        """Create the tables, dropping those of another layout."""
+        with self._lock:
+            if self.version != INDEX_SCHEMA_VERSION:
+                # Older or newer layout: start over rather than misread it
+                with self._conn:
+                    for table in TABLES:
+                        self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.executescript(SCHEMA)
+            self._conn.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+            self.version = INDEX_SCHEMA_VERSION
+
+    def _querySeries(self, where, params):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.series_id, s.series_num, s.height, s.width, s.description,"
+                " s.series_uid, st.accession, COUNT(DISTINCT f.instance_num)"
+                " FROM files AS f"
+                " JOIN series AS s ON s.series_id = f.series_id"
+                " JOIN studies AS st ON st.study_id = s.study_id"
+                f" WHERE {where}"
+                " GROUP BY s.series_id"
+                " ORDER BY s.series_num, s.height, s.width, st.study_uid",
+                params,
+            ).fetchall()
+
+        return [
+            IndexedSeriesInfo(self, *row, path_where=where, path_params=params)
+            for row in rows
+        ]
+
+    def _insert(self, rel_path, record, study_ids, series_ids):
+        """Insert one file, creating its study and series rows if needed.
+
+        `study_ids` and `series_ids` cache row ids across calls in one transaction.
+        """
+        conn = self._conn
+        study_uid = record["study_uid"]
+        if study_uid not in study_ids:
+            conn.execute(
+                "INSERT OR IGNORE INTO studies"
+                " (study_uid, accession, patient_id, study_date, description)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    study_uid,
+                    record["accession"],
+                    record["patient_id"],
+                    record["study_date"],
+                    record["study_description"],
+                ),
+            )
+            study_ids[study_uid] = conn.execute(
+                "SELECT study_id FROM studies WHERE study_uid = ?", (study_uid,)
+            ).fetchone()[0]
+
+        series_key = (
+            study_ids[study_uid], record["series_num"], record["height"], record["width"]
+        )
+        if series_key not in series_ids:
+            # The first file of a series sets the pixel format shared by the series
+            pixel_format = record["pixel_format"] or (None, None)
+            conn.execute(
+                "INSERT OR IGNORE INTO series"
+                " (study_id, series_num, height, width, series_uid, description,"
+                " pixel_dtype, bits_stored)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                series_key + (record["series_uid"], record["description"]) + pixel_format,
+            )
+            row = conn.execute(
+                "SELECT series_id, pixel_dtype, bits_stored FROM series"
+                " WHERE study_id = ? AND series_num = ? AND height = ? AND width = ?",
+                series_key,
+            ).fetchone()
+            series_ids[series_key] = (row[0], tuple(row[1:]))
+        series_id, series_format = series_ids[series_key]
+
+        # Raw reads need the series pixel format; other files are parsed when loaded
+        pixel_offset, pixel_length = None, None
+        if record["pixel_format"] == series_format:
+            pixel_offset, pixel_length = record["pixel_offset"], record["pixel_length"]
+
+        file_id = conn.execute(
+            "INSERT INTO files (path, series_id, instance_num, size, mtime_ns, inode,"
+            " pixel_offset, pixel_length)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel_path, series_id, record["instance_num"])
+            + record["stamp"]
+            + (pixel_offset, pixel_length),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO headers"
+            " (file_id, sop_instance_uid, photometric, transfer_syntax, slope, intercept)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                file_id,
+                record["sop_instance_uid"],
+                record["photometric"],
+                record["transfer_syntax"],
+                record["slope"],
+                record["intercept"],
+            ),
+        )
+
+    def _deleteFiles(self, file_ids):
+        """Delete files and their headers.
+
+        Returns:
+            Set of ids of the series the files belonged to.
+        """
+        rows = [(file_id,) for file_id in file_ids]
+        series_ids = set()
+        for row in rows:
+            series_ids.update(
+                r[0] for r in self._conn.execute(
+                    "SELECT series_id FROM files WHERE file_id = ?", row
+                )
+            )
+        self._conn.executemany("DELETE FROM headers WHERE file_id = ?", rows)
+        self._conn.executemany("DELETE FROM files WHERE file_id = ?", rows)
+        return series_ids
+
+    def _deleteOrphans(self):
+        """Drop series and studies that no longer have any files."""
+        self._conn.execute(
+            "DELETE FROM series WHERE series_id NOT IN (SELECT series_id FROM files)"
+        )
+        self._conn.execute(
+            "DELETE FROM studies WHERE study_id NOT IN (SELECT study_id FROM series)"
+        )
+
+    def _relPath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def _pathRange(self, dirpath):
+        """Get a WHERE clause restricting files to those under `dirpath`.
+
+        Uses a range on the path column, so the lookup is served by its index.
+        """
+        if dirpath is None or os.path.abspath(dirpath) == self.root:
+            return "1", ()
+        prefix = self._relPath(dirpath) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        return "f.path >= ? AND f.path < ?", (prefix, upper)
+
+
+class IndexedSeriesInfo(DICOMSeriesInfo):
+    """DICOMSeriesInfo backed by a DICOMIndex.
+
+    Paths are only read from the index when the series is opened.
+    """
+
+    def __init__(self, index, series_id, series_num, height, width, description,
+                 series_uid, accession, num_images, path_where="1", path_params=()):
+        super(IndexedSeriesInfo, self).__init__(series_num, height, width, description)
+        self.index = index
+        self.series_id = series_id
+        self.series_uid = series_uid
+        self.accession = accession
+        self.num_images = num_images
+        self._path_where = path_where
+        self._path_params = path_params
+        self._paths_loaded = False
+
+    def autoWindow(self, percentiles):
+        """Get the automatic window stored for the series, or None."""
+        auto_window = self.index.seriesWindow(self.series_id, percentiles)
+        if auto_window is None:
+            auto_window = super(IndexedSeriesInfo, self).autoWindow(percentiles)
+        return auto_window
+
+    def setAutoWindow(self, percentiles, w_width, w_level):
+        """Store the automatic window of the series in the index.
+
+        Kept with the series instead if the index is read-only.
+        """
+        if not self.index.setSeriesWindow(self.series_id, percentiles, w_width, w_level):
+            super(IndexedSeriesInfo, self).setAutoWindow(percentiles, w_width, w_level)
+
+    def sorted_paths(self):
+        """Get list of DICOM paths sorted by instance number."""
+        if not self._paths_loaded:
+            instance_nums, dicom_paths = [], []
+            for instance_num, dicom_path in self.index.seriesPaths(
+                self.series_id, self._path_where, self._path_params
+            ):
+                # Keep the first path of a duplicate instance, as add_dicom does
+                if instance_nums and instance_nums[-1] == instance_num:
+                    continue
+                instance_nums.append(instance_num)
+                dicom_paths.append(dicom_path)
+            self.instance_nums = tuple(instance_nums)
+            self.dicom_paths = tuple(dicom_paths)
+            self._paths_loaded = True
+
+        return self.dicom_paths
+
+
+def listSeriesInfos(dirpath, num_workers=0, use_processes=False):
+    """Get every series under `dirpath`, with its slice paths loaded.
+
+    Series are read from the index covering `dirpath` if there is one, else
+    found by scanning headers. The index is closed before returning, so only
+    the sizes, descriptions and `sorted_paths()` of the series can be used.
+
+    Args:
+        dirpath: Root directory of the series.
+        num_workers: Number of workers reading headers when scanning.
+        use_processes: If true, scan with worker processes instead of threads.
+
+    Returns:
+        List of DICOMSeriesInfo.
+    """
+    index = DICOMIndex.find(dirpath)
+    if index is not None:
+        try:
+            series_infos = index.seriesInfos(dirpath)
+            for series_info in series_infos:
+                series_info.sorted_paths()
+        finally:
+            index.close()
+        if series_infos:
+            return series_infos
+
+    return DICOMReader.scanAllDICOMs(
+        dirpath, num_workers=num_workers, use_processes=use_processes
+    )
+
+
+def listSeriesPaths(dirpath, num_workers=0, use_processes=False):
+    """Get the sorted slice paths of every series under `dirpath`.
+
+    See `listSeriesInfos` for how series are found.
+
+    Returns:
+        List of tuples of slice paths, one per series.
+    """
+    series_infos = listSeriesInfos(dirpath, num_workers, use_processes)
+    return [tuple(s.sorted_paths()) for s in series_infos]
@@ -4,27 +4,181 @@
 import numpy as np
 import os
 import pickle
-import pydicom
+import struct
+import threading
 
-from libs.constants import META_FILENAME
-from tqdm import tqdm
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-try:
-    from PyQt5.QtGui import QImage, qRgb
-except ImportError:
-    from PyQt4.QtGui import QImage, qRgb
+from libs.constants import META_FILENAME
+from libs.dicom_autowindow import (
+    DEFAULT_PERCENTILES,
+    DEFAULT_WINDOW_SAMPLES,
+    PixelHistogram,
+    autoWindow,
+    sampleIndices,
+)
+from libs.dicom_rescale import rescaleToHU
+from libs.dicom_window import applyWindowLUT
+from libs.qimage_adapter import ndarrayToQImage
+from libs.timing import stageTimer
+
+# pydicom and tqdm are imported on first use: importing pydicom takes a large
+# share of the application startup time.
 
 DCM_EXT = "dcm"
+DEFAULT_CACHE_MB = 512
+DEFAULT_SCAN_WORKERS = 4
+SCAN_CHUNK_SIZE = 64
+
+# Header fields needed for series discovery and display
+DISCOVERY_TAGS = (
+    "SeriesDescription",
+    "SeriesNumber",
+    "InstanceNumber",
+    "PhotometricInterpretation",
+    "Rows",
+    "Columns",
+)
+# Bytes read per file by the first attempt of a header probe
+HEADER_PROBE_BYTES = 4096
+
+# Uncompressed little endian transfer syntaxes, mapped to whether their VR is implicit
+NATIVE_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2": True,  # Implicit VR Little Endian
+    "1.2.840.10008.1.2.1": False,  # Explicit VR Little Endian
+}
+PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Where the raw pixel values of an uncompressed single-frame slice are in its file
+PixelLayout = namedtuple("PixelLayout", ["offset", "dtype", "shape"])
+
+
+class DICOMSliceCache(object):
+    """LRU cache of decoded DICOM slices bounded by a memory budget.
+
+    Entries are keyed by (absolute path, mtime, size), so a file that changes
+    on disk is decoded again instead of being served stale.
+    """
+
+    def __init__(self, budget_mb=DEFAULT_CACHE_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._slices = OrderedDict()
+        self._path2key = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slices)
+
+    def __contains__(self, key):
+        # Membership test only: does not count as a hit or refresh recency
+        with self._lock:
+            return key in self._slices
+
+    @staticmethod
+    def key(dicom_path):
+        """Get the cache key for a file on disk.
+
+        Raises:
+            OSError: If the file cannot be stat'ed.
+        """
+        st = os.stat(dicom_path)
+        return os.path.abspath(dicom_path), st.st_mtime_ns, st.st_size
+
+    def get(self, key):
+        """Get a cached slice and mark it most recently used, or None on a miss."""
+        with self._lock:
+            dicom_slice = self._slices.get(key)
+            if dicom_slice is None:
+                self.misses += 1
+                return None
+            self._slices.move_to_end(key)
+            self.hits += 1
+            return dicom_slice
+
+    def put(self, key, dicom_slice):
+        """Add a decoded slice, evicting least recently used slices to stay in budget."""
+        with self._lock:
+            # Drop any entry for an older version of the same file
+            old_key = self._path2key.get(key[0])
+            if old_key is not None:
+                self._remove(old_key)
+
+            if dicom_slice.nbytes > self.budget_bytes:
+                return
+            self._slices[key] = dicom_slice
+            self._path2key[key[0]] = key
+            self.nbytes += dicom_slice.nbytes
+            self._evict()
+
+    def setBudget(self, budget_mb):
+        """Change the memory budget in MB, evicting slices if needed."""
+        with self._lock:
+            self.budget_bytes = int(budget_mb * 1024 * 1024)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self._path2key.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Get a dict of cache counters for display or logging."""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._slices),
+                nbytes=self.nbytes,
+                budget_bytes=self.budget_bytes,
+            )
+
+    def _remove(self, key):
+        dicom_slice = self._slices.pop(key)
+        del self._path2key[key[0]]
+        self.nbytes -= dicom_slice.nbytes
+
+    def _evict(self):
+        while self.nbytes > self.budget_bytes and self._slices:
+            self._remove(next(iter(self._slices)))
+            self.evictions += 1
+
+
+class SliceSources(object):
+    """Slice sources tried in order, e.g. a series volume before the folder index."""
+
+    def __init__(self, *sources):
+        self.sources = [source for source in sources if source is not None]
+
+    def loadSlice(self, dicom_path):
+        for source in self.sources:
+            dicom_slice = source.loadSlice(dicom_path)
+            if dicom_slice is not None:
+                return dicom_slice
+        return None
 
 
 class DICOMReader(object):
     suffix = DCM_EXT
+    sliceCache = DICOMSliceCache()
+    # Optional object whose loadSlice(path) returns a DICOMSlice without
+    # parsing the file, or None (e.g. the DICOMIndex of the open folder,
+    # or several of them chained in a SliceSources)
+    sliceSource = None
 
     def __init__(self):
         raise NotImplementedError("DICOMReader is a static class.")
 
     @classmethod
-    def getQImage(cls, dicom_path, w_width=None, w_level=None, force_invert=None):
+    def getQImage(cls, dicom_path, w_width=None, w_level=None, force_invert=None, frame=None):
         """Read a DICOM file from `file_path`.
 
         Args:
@@ -34,6 +188,7 @@ class DICOMReader(object):
             force_invert: Force inversion regardless of photometric interpretation.
                          None=auto (based on photometric interpretation),
                          True=force invert, False=no invert.
+            frame: Optional FrameBuffer to window the slice into in place.
 
         Returns:
             QImage image data for DICOM file, windowed if `w_center` and `w_width` are not None.
@@ -41,22 +196,182 @@ class DICOMReader(object):
         Raises:
             RuntimeWarning: If cannot find DICOM file at the given `dicom_path`.
         """
-        # Read DICOM from disk
-        dcm = cls.readRawDICOM(dicom_path)
+        dicom_slice = cls.readSlice(dicom_path)
 
-        # Convert to raw Hounsfield Units and apply window
-        pixels = cls._dicomToRaw(dcm)
-        if w_level is not None and w_width is not None:
-            pixels = cls._applyWindow(pixels, w_level, w_width)
+        return cls.sliceToQImage(dicom_slice, w_width, w_level, force_invert, frame)
 
-        # Apply photometric interpretation inversion
-        pixels = cls._applyPhotometricInterpretation(dcm, pixels, force_invert)
+    @classmethod
+    def sliceToQImage(cls, dicom_slice, w_width=None, w_level=None, force_invert=None,
+                      frame=None):
+        """Render an already decoded DICOM slice to a QImage.
+
+        Args:
+            dicom_slice: DICOMSlice returned by `readSlice`.
+            w_width: Width for window to apply. If None, don't apply window.
+            w_level: Center for window to apply. If None, don't apply window.
+            force_invert: Force inversion regardless of photometric interpretation.
+                         None=auto, True=force invert, False=no invert.
+            frame: Optional FrameBuffer to window the slice into in place.
+
+        Returns:
+            QImage image data for the slice, windowed if `w_level` and `w_width` are not None.
+        """
+        out = None
+        if frame is not None and w_level is not None and w_width is not None:
+            out = frame.get(dicom_slice.pixels.shape)
+        pixels = cls.renderSlice(dicom_slice, w_width, w_level, force_invert, out=out)
 
         # Convert to QImage
         q_image = cls._toQImage(pixels)
 
         return q_image
 
+    @classmethod
+    def renderSlice(cls, dicom_slice, w_width=None, w_level=None, force_invert=None,
+                    out=None):
+        """Render an already decoded DICOM slice to a NumPy image, without Qt.
+
+        Args:
+            dicom_slice: DICOMSlice returned by `readSlice`.
+            w_width: Width for window to apply. If None, don't apply window.
+            w_level: Center for window to apply. If None, don't apply window.
+            force_invert: Force inversion regardless of photometric interpretation.
+                         None=auto, True=force invert, False=no invert.
+            out: Optional uint8 array of the slice shape to window into.
+
+        Returns:
+            uint8 greyscale image if windowed, else the (possibly inverted) Hounsfield Units.
+        """
+        pixels = dicom_slice.pixels
+        if w_level is not None and w_width is not None:
+            # The lookup table also applies photometric interpretation inversion
+            invert = cls._shouldInvert(dicom_slice.dcm, force_invert)
+            return cls._applyWindow(pixels, w_level, w_width, invert, out=out)
+
+        # Apply photometric interpretation inversion
+        return cls._applyPhotometricInterpretation(dicom_slice.dcm, pixels, force_invert)
+
+    @classmethod
+    def readSlice(cls, dicom_path, use_cache=True):
+        """Read and decode a DICOM slice from disk exactly once.
+
+        The returned slice holds everything needed to auto-window and render
+        the image, so callers never have to go back to the file. Decoded
+        slices are kept in `DICOMReader.sliceCache`, so reading the same
+        unchanged file again skips disk and decode entirely. On a cache miss
+        `DICOMReader.sliceSource` is tried before parsing the file.
+
+        Args:
+            dicom_path: Path to DICOM file to read.
+            use_cache: If true, look up and store the slice in the shared cache.
+
+        Returns:
+            DICOMSlice with the header, raw Hounsfield Units and photometric interpretation.
+
+        Raises:
+            RuntimeWarning: If cannot find DICOM file at the given `dicom_path`.
+        """
+        with stageTimer.span("dicom.read"):
+            return cls._readSlice(dicom_path, use_cache)
+
+    @classmethod
+    def _readSlice(cls, dicom_path, use_cache):
+        key = None
+        if use_cache:
+            try:
+                key = cls.sliceCache.key(dicom_path)
+            except OSError:
+                raise RuntimeWarning(f"Could not load DICOM at path {dicom_path}")
+            dicom_slice = cls.sliceCache.get(key)
+            if dicom_slice is not None:
+                return dicom_slice
+
+        source = cls.sliceSource
+        dicom_slice = None if source is None else source.loadSlice(dicom_path)
+        if dicom_slice is None:
+            dicom_slice = cls._decodeSlice(dicom_path)
+        if key is not None:
+            cls.sliceCache.put(key, dicom_slice)
+
+        return dicom_slice
+
+    @classmethod
+    def _decodeSlice(cls, dicom_path):
+        """Parse a DICOM file and convert its pixels to Hounsfield Units."""
+        import pydicom
+
+        try:
+            with stageTimer.span("dicom.parse"), open(dicom_path, "rb") as dicom_fh:
+                dcm = pydicom.dcmread(dicom_fh, stop_before_pixels=True)
+                layout = cls.locatePixelData(dcm, dicom_fh)
+                if layout is None:
+                    # Compressed or unusual pixel data: let pydicom decode it
+                    dicom_fh.seek(0)
+                    dcm = pydicom.dcmread(dicom_fh)
+        except IOError:
+            raise RuntimeWarning(f"Could not load DICOM at path {dicom_path}")
+
+        stored = None if layout is None else cls.pixelView(dicom_path, layout)
+        # The decoded pixel array is dropped with PixelData below, so reuse it
+        pixels = cls._dicomToRaw(dcm, stored=stored, reuse=True)
+        del stored
+
+        # Keep only the header: the decoded pixels live in `pixels` now.
+        if "PixelData" in dcm:
+            del dcm.PixelData
+
+        return DICOMSlice(dicom_path, dcm, pixels)
+
+    @staticmethod
+    def autoWindow(pixels, percentiles=DEFAULT_PERCENTILES):
+        """Compute a window width and level that covers the bulk of an image.
+
+        Args:
+            pixels: Raw Hounsfield Units for every pixel.
+            percentiles: (low, high) percentiles spanned by the window.
+
+        Returns:
+            Tuple (w_width, w_level) spanning the given percentiles.
+        """
+        return autoWindow(pixels, percentiles)
+
+    @classmethod
+    def seriesAutoWindow(cls, dicom_paths, num_samples=DEFAULT_WINDOW_SAMPLES,
+                         percentiles=DEFAULT_PERCENTILES, cancel=None):
+        """Compute one window width and level for a whole series.
+
+        Histograms of evenly spaced slices are merged, so every slice of the
+        series is shown with the same contrast. Slices already in the slice
+        cache are reused; others are decoded without being cached.
+
+        Args:
+            dicom_paths: Paths of the series, sorted by instance number.
+            num_samples: Number of slices to sample.
+            percentiles: (low, high) percentiles spanned by the window.
+            cancel: Optional threading.Event, checked before each sampled slice.
+
+        Returns:
+            Tuple (w_width, w_level), or None if no sampled slice could be
+            read or the computation was cancelled.
+        """
+        histograms = []
+        for i in sampleIndices(len(dicom_paths), num_samples):
+            if cancel is not None and cancel.is_set():
+                return None
+            try:
+                use_cache = cls.sliceCache.key(dicom_paths[i]) in cls.sliceCache
+                dicom_slice = cls.readSlice(dicom_paths[i], use_cache=use_cache)
+            except Exception:
+                # Unreadable slices are left out of the sample
+                continue
+            if dicom_slice.histogram is not None:
+                histograms.append(dicom_slice.histogram)
+
+        if not histograms:
+            return None
+        histogram = PixelHistogram.merge(histograms)
+        return autoWindow(None, percentiles, histogram=histogram)
+
     @classmethod
     def isDICOMFile(cls, file_name):
         """Check if file is a DICOM file.
@@ -83,6 +398,8 @@ class DICOMReader(object):
         Raises:
             RuntimeWarning: If cannot find DICOM file at the given `dicom_path`.
         """
+        import pydicom
+
         try:
             with open(dicom_path, "rb") as dicom_fh:
                 dcm = pydicom.dcmread(dicom_fh, stop_before_pixels=stop_before_pixels)
@@ -92,13 +409,199 @@ class DICOMReader(object):
         return dcm
 
     @staticmethod
-    def scanAllDICOMs(folderPath, check_preloaded=True):
+    def locatePixelData(dcm, dicom_fh):
+        """Find the raw pixel values of an uncompressed slice in its file.
+
+        Args:
+            dcm: Header read from `dicom_fh` with `stop_before_pixels=True`.
+            dicom_fh: File positioned at the start of the PixelData element,
+                as left by the header read. Its position is advanced.
+
+        Returns:
+            PixelLayout, or None if the pixels must be decoded by pydicom
+            (compressed or big endian syntaxes, multi-frame or color images).
+        """
+        pixel_format = _nativePixelFormat(dcm)
+        if pixel_format is None:
+            return None
+        is_implicit, dtype, shape = pixel_format
+
+        start = dicom_fh.tell()
+        header = dicom_fh.read(8 if is_implicit else 12)
+        if not _isPixelDataHeader(header, shape[0] * shape[1] * dtype.itemsize):
+            return None
+
+        return PixelLayout(start + len(header), dtype.str, shape)
+
+    @staticmethod
+    def locateTrailingPixelData(dcm, dicom_fh, file_size):
+        """Find the raw pixel values of an uncompressed slice from the end of its file.
+
+        Pixel data is nearly always the last element, so its offset is the
+        file size minus its length. The element header just before that
+        offset is checked, so only a few bytes are read.
+
+        Args:
+            dcm: Header with the pixel format fields (see `locatePixelData`).
+            dicom_fh: Open file.
+            file_size: Size of the file in bytes.
+
+        Returns:
+            PixelLayout, or None if the pixels are not uncompressed and last.
+        """
+        pixel_format = _nativePixelFormat(dcm)
+        if pixel_format is None:
+            return None
+        is_implicit, dtype, shape = pixel_format
+
+        pixel_len = shape[0] * shape[1] * dtype.itemsize
+        # Element values have even length
+        offset = file_size - (pixel_len + pixel_len % 2)
+        header_len = 8 if is_implicit else 12
+        if offset < header_len:
+            return None
+        dicom_fh.seek(offset - header_len)
+        if not _isPixelDataHeader(dicom_fh.read(header_len), pixel_len):
+            return None
+
+        return PixelLayout(offset, dtype.str, shape)
+
+    @staticmethod
+    def pixelView(dicom_path, layout):
+        """Map the stored pixel values of a slice without reading them into memory.
+
+        Args:
+            dicom_path: Path to DICOM file.
+            layout: PixelLayout returned by `locatePixelData`.
+
+        Returns:
+            Read-only `numpy.memmap` of the stored (not rescaled) values.
+        """
+        return np.memmap(
+            dicom_path, dtype=np.dtype(layout.dtype), mode="r",
+            offset=layout.offset, shape=tuple(layout.shape),
+        )
+
+    @staticmethod
+    def probeHeader(dicom_path, tags=DISCOVERY_TAGS, prefix_bytes=HEADER_PROBE_BYTES):
+        """Read only the given tags from the start of a DICOM file.
+
+        Only a prefix of the file is read and only `tags` are parsed: parsing
+        stops at the first element past the last requested tag, so large
+        private sequences and pixel data are never read. If the prefix ends
+        before that point, the prefix is doubled and parsing is retried.
+
+        Args:
+            dicom_path: Path to DICOM file to read.
+            tags: DICOM keywords or tags to parse.
+            prefix_bytes: Number of bytes read on the first attempt.
+
+        Returns:
+            DICOM object containing the requested tags that are present.
+
+        Raises:
+            RuntimeWarning: If cannot find DICOM file at the given `dicom_path`.
+        """
+        from pydicom.filereader import read_partial
+        from pydicom.tag import Tag
+
+        specific_tags = [Tag(t) for t in tags]
+        last_tag = max(specific_tags)
+        past_last_tag = []
+
+        def stop_when(tag, VR, length):
+            if tag > last_tag:
+                past_last_tag.append(tag)
+                return True
+            return False
+
+        try:
+            # Unbuffered, so only the bytes asked for are read from storage
+            with open(dicom_path, "rb", buffering=0) as dicom_fh:
+                num_requested = prefix_bytes
+                data = dicom_fh.read(num_requested)
+                while True:
+                    at_eof = len(data) < num_requested
+                    del past_last_tag[:]
+                    try:
+                        dcm = read_partial(
+                            BytesIO(data),
+                            stop_when=stop_when,
+                            specific_tags=specific_tags,
+                        )
+                        if past_last_tag or at_eof:
+                            return dcm
+                    except Exception:
+                        # A truncated prefix can fail to parse; the whole file must not
+                        if at_eof:
+                            raise
+                    num_requested = 2 * len(data)
+                    data += dicom_fh.read(len(data))
+        except IOError:
+            raise RuntimeWarning(f"Could not load DICOM at path {dicom_path}")
+
+    @staticmethod
+    def listDICOMs(folderPath):
+        """List DICOM files under a directory tree in a deterministic order.
+
+        Directories and files are visited in sorted order.
+
+        Returns:
+            List of absolute paths.
+        """
+        dcm_paths = []
+        for base_path, dir_names, file_names in os.walk(folderPath):
+            dir_names.sort()
+            dcm_paths += [
+                os.path.abspath(os.path.join(base_path, f))
+                for f in sorted(file_names)
+                if f.endswith(f".{DICOMReader.suffix}")
+            ]
+
+        return dcm_paths
+
+    @staticmethod
+    def mapFiles(read_fn, paths, num_workers=0, use_processes=False):
+        """Apply `read_fn` to every path, optionally on a pool of workers.
+
+        Args:
+            read_fn: Module-level function taking a path (picklable for processes).
+            paths: List of paths.
+            num_workers: Number of workers. If 0, run serially.
+            use_processes: If true, use worker processes instead of threads.
+
+        Returns:
+            List of results in the order of `paths`, whichever worker finishes first.
+        """
+        from tqdm import tqdm
+
+        if num_workers <= 0:
+            return [read_fn(p) for p in tqdm(paths)]
+
+        pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_cls(max_workers=num_workers) as pool:
+            return list(
+                tqdm(
+                    pool.map(read_fn, paths, chunksize=SCAN_CHUNK_SIZE),
+                    total=len(paths),
+                )
+            )
+
+    @staticmethod
+    def scanAllDICOMs(folderPath, check_preloaded=True, num_workers=0, use_processes=False):
         """Scan a directory tree for DICOMs.
 
+        Headers can be read by a pool of workers. Files are visited in sorted
+        order and results are merged in that order, so the output (including
+        which file wins for a duplicate instance) is the same for any number
+        of workers.
+
         Args:
             folderPath: Root of directory tree to scan for DICOMs.
             check_preloaded: If true, check for preloaded metadata files to speed loading.
             See scripts/preload_dicoms.py for more info.
+            num_workers: Number of workers reading headers. If 0, read serially.
+            use_processes: If true, use worker processes instead of threads.
 
         Returns:
             List of tuples each of format (series_number, description, num_images, height, width, path_list).
@@ -120,100 +623,98 @@ class DICOMReader(object):
                 return series_infos
 
         # No preloaded info
+        dcm_paths = DICOMReader.listDICOMs(folderPath)
+        headers = DICOMReader.mapFiles(
+            _readSeriesHeader, dcm_paths, num_workers, use_processes
+        )
+
         series2info = {}
-        for base_path, _, file_names in os.walk(folderPath):
-            dcm_names = set(
-                f for f in file_names if f.endswith(f".{DICOMReader.suffix}")
-            )
-            for dcm_name in tqdm(dcm_names):
-                # Check if DICOM matches a series already seen
-                dcm = DICOMReader.readRawDICOM(
-                    os.path.join(base_path, dcm_name), stop_before_pixels=True
-                )
-                series_key = (
-                    int(dcm.SeriesNumber),
-                    int(dcm.Rows) if "Rows" in dcm else 0,
-                    int(dcm.Columns) if "Columns" in dcm else 0,
-                )
-                if series_key not in series2info:
-                    # Add new series
-                    series_num, height, width = series_key
-                    description = (
-                        dcm.SeriesDescription if "SeriesDescription" in dcm else "None"
-                    )
-                    series2info[series_key] = DICOMSeriesInfo(
-                        series_num, height, width, description
-                    )
-
-                # Add DICOM to series
-                series_info = series2info[series_key]
-                instance_num = dcm.InstanceNumber if "InstanceNumber" in dcm else 0
-                series_info.add_dicom(
-                    instance_num, os.path.abspath(os.path.join(base_path, dcm_name))
+        for dcm_path, (series_key, description, instance_num) in zip(dcm_paths, headers):
+            # Check if DICOM matches a series already seen
+            if series_key not in series2info:
+                # Add new series
+                series_num, height, width = series_key
+                series2info[series_key] = DICOMSeriesInfo(
+                    series_num, height, width, description
                 )
 
+            # Add DICOM to series
+            series2info[series_key].add_dicom(instance_num, dcm_path)
+
         # Construct list of DICOMSeriesInfo objects
         series_infos = [series2info[k] for k in sorted(series2info.keys())]
 
         return series_infos
 
     @staticmethod
-    def _dicomToRaw(dcm, dtype=np.int16):
+    def _dicomToRaw(dcm, dtype=None, stored=None, reuse=False):
         """Convert a DICOM object to a Numpy array of raw Hounsfield Units.
         Scale by the RescaleSlope, then add the RescaleIntercept (both DICOM header fields).
         Args:
             dcm: DICOM object.
-            dtype: Type of elements in output array.
+            dtype: Type of elements in output array. If None, chosen from the
+                stored pixel range and the rescale slope/intercept.
+            stored: Stored pixel values read straight from the file (see
+                `pixelView`). If None, decode `dcm.pixel_array`.
+            reuse: If true, rescale the pixel array in place when possible.
+                pydicom caches `dcm.pixel_array`, so only pass true if the
+                dataset's pixels are dropped afterwards.
         Returns:
-            ndarray of shape (height, width). Pixels are `int16` raw Hounsfield Units.
+            ndarray of shape (height, width). Pixels are raw Hounsfield Units,
+            `int16` unless the rescaled range needs `int32`.
         See Also:
             https://www.kaggle.com/gzuidhof/full-preprocessing-tutorial
+            libs.dicom_rescale for the single-pass conversion.
         """
-        img_np = dcm.pixel_array.astype(dtype)
-
-        # Set outside-of-scan pixels to 0
-        img_np[img_np == -2000] = 0
-
-        intercept = dcm.RescaleIntercept
-        slope = dcm.RescaleSlope
-
-        if slope != 1:
-            img_np = slope * img_np.astype(np.float64)
-            img_np = img_np.astype(dtype)
-
-        img_np += int(intercept)
-        img_np = img_np.astype(np.int16)
-
-        return img_np
+        with stageTimer.span("dicom.rescale"):
+            return rescaleToHU(
+                dcm.pixel_array if stored is None else np.asarray(stored),
+                slope=getattr(dcm, "RescaleSlope", 1),
+                intercept=getattr(dcm, "RescaleIntercept", 0),
+                bits_stored=getattr(dcm, "BitsStored", None),
+                dtype=dtype,
+                mask_unused_bits=stored is not None,
+                reuse=reuse,
+            )
 
     @staticmethod
-    def _applyWindow(img, w_center, w_width):
+    def _applyWindow(img, w_center, w_width, invert=False, out=None):
         """Apply a window to raw Hounsfield Units to get a PNG.
 
         Args:
             img: Raw Hounsfield Units for every pixel.
             w_center: Center of window to apply (e.g. 40 Hounsfield Units).
             w_width: Total width of window to apply (e.g. 400 Hounsfield Units).
+            invert: If true, invert the windowed image (MONOCHROME1).
+            out: Optional uint8 array of the same shape to write the result into.
 
         Returns:
             Single-byte pixel values for the Hounsfield Units image as a windowed greyscale image.
+
+        See Also:
+            libs.dicom_window for the lookup-table engine.
         """
+        with stageTimer.span("dicom.window"):
+            return applyWindowLUT(img, w_center, w_width, invert, out=out)
 
-        # Convert to float
-        img = np.copy(img).astype(np.float64)
+    @staticmethod
+    def _shouldInvert(dcm, force_invert=None):
+        """Decide whether to invert an image for display.
 
-        # Clip to min and max values
-        w_max = w_center + w_width / 2
-        w_min = w_center - w_width / 2
-        img = np.clip(img, w_min, w_max)
+        Args:
+            dcm: DICOM object containing photometric interpretation.
+            force_invert: Force inversion regardless of photometric interpretation.
+                         None=auto, True=force invert, False=no invert.
 
-        # Normalize to uint8
-        img -= w_min
-        img /= w_width
-        img *= np.iinfo(np.uint8).max
-        img = img.astype(np.uint8)
+        Returns:
+            True if the image should be inverted.
+        """
+        if force_invert is not None:
+            return force_invert
 
-        return img
+        # Auto-detect based on photometric interpretation
+        photometric = getattr(dcm, "PhotometricInterpretation", "MONOCHROME2")
+        return photometric == "MONOCHROME1"
 
     @staticmethod
     def _applyPhotometricInterpretation(dcm, img, force_invert=None):
@@ -231,18 +732,7 @@ class DICOMReader(object):
         if img is None:
             return img
 
-        # Get photometric interpretation from DICOM header
-        photometric = getattr(dcm, "PhotometricInterpretation", "MONOCHROME2")
-
-        # Determine if inversion should be applied
-        should_invert = False
-        if force_invert is not None:
-            should_invert = force_invert
-        else:
-            # Auto-detect based on photometric interpretation
-            should_invert = photometric == "MONOCHROME1"
-
-        if should_invert:
+        if DICOMReader._shouldInvert(dcm, force_invert):
             # Invert the image: 0 becomes max value, max becomes 0
             if img.dtype == np.uint8:
                 img = 255 - img
@@ -264,7 +754,7 @@ class DICOMReader(object):
             String indicating photometric interpretation ('MONOCHROME1', 'MONOCHROME2', etc.)
         """
         try:
-            dcm = DICOMReader.readRawDICOM(dicom_path, stop_before_pixels=True)
+            dcm = DICOMReader.probeHeader(dicom_path, tags=("PhotometricInterpretation",))
             return getattr(dcm, "PhotometricInterpretation", "MONOCHROME2")
         except Exception:
             return "MONOCHROME2"  # Default fallback
@@ -273,54 +763,128 @@ class DICOMReader(object):
     def _toQImage(arr, do_copy=False):
         """Convert NumPy ndarray to QImage format.
 
-        Taken from:
-            https://gist.github.com/smex/5287589
-
         Args:
             arr: NumPy array to convert.
             do_copy: If true, copy the QImage file before returning.
 
         Returns:
-            QImage formatted image.
+            QImage formatted image, which keeps `arr` alive unless copied.
         """
-        if arr is None:
-            return QImage()
-
-        gray_color_table = [qRgb(i, i, i) for i in range(256)]
-
-        if arr.dtype == np.uint8:
-            if len(arr.shape) == 2:
-                qim = QImage(
-                    arr.data,
-                    arr.shape[1],
-                    arr.shape[0],
-                    arr.strides[0],
-                    QImage.Format_Indexed8,
-                )
-                qim.setColorTable(gray_color_table)
-                return qim.copy() if do_copy else qim
-
-            elif len(arr.shape) == 3:
-                if arr.shape[2] == 3:
-                    qim = QImage(
-                        arr.data,
-                        arr.shape[1],
-                        arr.shape[0],
-                        arr.strides[0],
-                        QImage.Format_RGB888,
-                    )
-                    return qim.copy() if do_copy else qim
-                elif arr.shape[2] == 4:
-                    qim = QImage(
-                        arr.data,
-                        arr.shape[1],
-                        arr.shape[0],
-                        arr.strides[0],
-                        QImage.Format_ARGB32,
-                    )
-                    return qim.copy() if do_copy else qim
-
-        raise NotImplementedError("Unsupported image format.")
+        with stageTimer.span("dicom.qimage"):
+            return ndarrayToQImage(arr, do_copy)
+
+
+def _nativePixelFormat(dcm):
+    """Get (is_implicit_vr, dtype, shape) of uncompressed single-frame greyscale pixels.
+
+    Returns:
+        Tuple, or None if the pixels must be decoded by pydicom.
+    """
+    file_meta = getattr(dcm, "file_meta", None)
+    if file_meta is None:
+        return None
+    is_implicit = NATIVE_TRANSFER_SYNTAXES.get(str(file_meta.get("TransferSyntaxUID", "")))
+    bits_allocated = dcm.get("BitsAllocated")
+    if (
+        is_implicit is None
+        or bits_allocated not in (8, 16, 32)
+        or int(dcm.get("SamplesPerPixel") or 1) != 1
+        or int(dcm.get("NumberOfFrames") or 1) != 1
+        or not dcm.get("Rows")
+        or not dcm.get("Columns")
+    ):
+        return None
+
+    kind = "i" if dcm.get("PixelRepresentation") == 1 else "u"
+    dtype = np.dtype("<%s%d" % (kind, bits_allocated // 8))
+    return is_implicit, dtype, (int(dcm.Rows), int(dcm.Columns))
+
+
+def _isPixelDataHeader(header, min_length):
+    """Check an element header is PixelData with a defined length of at least `min_length`.
+
+    Header layout: tag, then (explicit VR only) VR and 2 reserved bytes, then length.
+    """
+    if len(header) < 8 or struct.unpack("<HH", header[:4]) != PIXEL_DATA_TAG:
+        return False
+    length = struct.unpack("<I", header[-4:])[0]
+    return length != UNDEFINED_LENGTH and length >= min_length
+
+
+def _readSeriesHeader(dicom_path):
+    """Read the header fields series discovery needs from one DICOM file.
+
+    Module-level so that it can be sent to worker processes.
+
+    Returns:
+        Tuple (series_key, description, instance_num), where series_key is
+        (series_number, height, width).
+    """
+    dcm = DICOMReader.probeHeader(dicom_path)
+    series_key = (
+        int(dcm.SeriesNumber),
+        int(dcm.Rows) if "Rows" in dcm else 0,
+        int(dcm.Columns) if "Columns" in dcm else 0,
+    )
+    description = dcm.SeriesDescription if "SeriesDescription" in dcm else "None"
+    instance_num = dcm.InstanceNumber if "InstanceNumber" in dcm else 0
+
+    return series_key, description, instance_num
+
+
+class DICOMSlice(object):
+    """A DICOM slice decoded from disk.
+
+    Holds the DICOM header (without the pixel data element), the raw
+    Hounsfield Units and the photometric interpretation of one file.
+    """
+
+    def __init__(self, path, dcm, pixels):
+        self.path = path
+        self.dcm = dcm
+        self.pixels = pixels
+        self.photometric = getattr(dcm, "PhotometricInterpretation", "MONOCHROME2")
+        self._histogram = None
+
+    @classmethod
+    def fromPixels(cls, path, pixels, photometric):
+        """Build a slice from Hounsfield Units read without parsing the file.
+
+        The header only holds the fields display needs.
+        """
+        import pydicom
+
+        dcm = pydicom.Dataset()
+        dcm.PhotometricInterpretation = photometric
+        dcm.Rows, dcm.Columns = pixels.shape[:2]
+        return cls(path, dcm, pixels)
+
+    @property
+    def histogram(self):
+        """PixelHistogram of the slice, computed on first use and kept with it.
+
+        None if the pixels cannot be counted in a histogram.
+        """
+        if self._histogram is None:
+            self._histogram = PixelHistogram.fromPixels(self.pixels)
+        return self._histogram
+
+    def autoWindow(self, percentiles=DEFAULT_PERCENTILES):
+        """Compute the automatic (w_width, w_level) from the slice histogram."""
+        with stageTimer.span("dicom.autoWindow"):
+            return autoWindow(self.pixels, percentiles, histogram=self.histogram)
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes
 
 
 class DICOMSeriesInfo(object):
@@ -363,6 +927,18 @@ class DICOMSeriesInfo(object):
 
         return self.dicom_paths
 
+    def autoWindow(self, percentiles):
+        """Get the automatic window computed for the series, or None."""
+        # Series unpickled from older metadata files have no stored window
+        auto_window = getattr(self, "_auto_window", None)
+        if auto_window is not None and auto_window[0] == tuple(percentiles):
+            return auto_window[1:]
+        return None
+
+    def setAutoWindow(self, percentiles, w_width, w_level):
+        """Keep the automatic window of the series computed for `percentiles`."""
+        self._auto_window = (tuple(percentiles), w_width, w_level)
+
     def to_str(self):
         """Get a string that can be displayed in a QT dialog window."""
         s = f'(Series {self.series_num}) "{self.description}" [{self.height} x {self.width} x {self.num_images}]'
@@ -0,0 +1,164 @@
+"""Loading of DICOM slices for display off the GUI thread.
+
+Every request to show a slice gets a new generation number and supersedes
+all older requests: older requests still queued are skipped, and results
+of older requests that were already running are dropped when they arrive.
+Only the result of the latest request is delivered, on the GUI thread,
+through the `sliceLoaded` or `loadFailed` signal.
+"""
+import threading
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PyQt5.QtCore import QObject, pyqtSignal
+except ImportError:
+    from PyQt4.QtCore import QObject, pyqtSignal
+
+from libs.dicom_autowindow import DEFAULT_PERCENTILES
+from libs.dicom_io import DICOMReader
+
+DEFAULT_LOADER_WORKERS = 2
+
+# Slice decoded and rendered in the background. `window` is the (w_width,
+# w_level) it was rendered with, and `window_error` why the automatic window
+# could not be computed (the fallback window was used instead), or None.
+LoadedSlice = namedtuple(
+    "LoadedSlice", ["generation", "path", "dicom_slice", "image", "window", "window_error"]
+)
+
+
+class DICOMSliceLoader(QObject):
+    """Decode, window and render DICOM slices on a worker pool, latest request wins."""
+
+    # LoadedSlice of the latest request
+    sliceLoaded = pyqtSignal(object)
+    # Generation, path and error message of the latest request
+    loadFailed = pyqtSignal(int, str, str)
+
+    # Emitted from the workers, delivered to the loader on the GUI thread
+    _loaded = pyqtSignal(object)
+    _failed = pyqtSignal(int, str, str)
+
+    def __init__(self, num_workers=DEFAULT_LOADER_WORKERS, prefetcher=None, parent=None):
+        """
+        Args:
+            num_workers: Number of slices loaded at the same time. More than
+                one lets the latest request start while a superseded one is
+                still decoding.
+            prefetcher: Optional DICOMPrefetcher, waited for so that a slice
+                being prefetched is not decoded twice.
+            parent: Parent QObject.
+        """
+        super(DICOMSliceLoader, self).__init__(parent)
+        self.prefetcher = prefetcher
+        # Results dropped because a newer request superseded them
+        self.superseded = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="dicom-load"
+        )
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = None
+        self._loaded.connect(self._onLoaded)
+        self._failed.connect(self._onFailed)
+
+    @property
+    def generation(self):
+        """Generation of the latest request."""
+        return self._generation
+
+    def pendingPath(self):
+        """Path of the latest request until its result is delivered, else None."""
+        with self._lock:
+            return None if self._pending is None else self._pending[1]
+
+    def request(self, path, window=None, percentiles=DEFAULT_PERCENTILES,
+                force_invert=None, fallback_window=None):
+        """Load a slice in the background, superseding all older requests.
+
+        Args:
+            path: Path of the DICOM file to load.
+            window: (w_width, w_level) to render with. If None, use the
+                automatic window of the slice.
+            percentiles: Percentiles spanned by the automatic window.
+            force_invert: Force inversion regardless of photometric interpretation.
+            fallback_window: (w_width, w_level) used if the automatic window
+                cannot be computed.
+
+        Returns:
+            Generation number of the request.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._cancelPending()
+            future = self._executor.submit(
+                self._load, generation, path, window, percentiles, force_invert, fallback_window
+            )
+            self._pending = (generation, path, future)
+        return generation
+
+    def cancel(self):
+        """Supersede all requests without making a new one."""
+        with self._lock:
+            self._generation += 1
+            self._cancelPending()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _cancelPending(self):
+        if self._pending is not None:
+            self._pending[2].cancel()
+            self._pending = None
+
+    def _isCurrent(self, generation):
+        return generation == self._generation
+
+    def _load(self, generation, path, window, percentiles, force_invert, fallback_window):
+        # Superseded while queued, e.g. by holding down the next-image key
+        if not self._isCurrent(generation):
+            return
+        try:
+            if self.prefetcher is not None:
+                self.prefetcher.waitFor(path)
+            dicom_slice = DICOMReader.readSlice(path)
+            if not self._isCurrent(generation):
+                # The decoded slice stays in the cache for when it is shown again
+                return
+
+            window_error = None
+            if window is None:
+                try:
+                    window = dicom_slice.autoWindow(percentiles)
+                except Exception as e:
+                    window, window_error = fallback_window, str(e)
+            w_width, w_level = window if window is not None else (None, None)
+            image = DICOMReader.sliceToQImage(dicom_slice, w_width, w_level, force_invert)
+        except Exception as e:
+            self._failed.emit(generation, path, str(e))
+            return
+
+        self._loaded.emit(
+            LoadedSlice(generation, path, dicom_slice, image, window, window_error)
+        )
+
+    def _finish(self, generation):
+        """Clear the latest request once it is delivered, or count a superseded one."""
+        with self._lock:
+            if not self._isCurrent(generation):
+                self.superseded += 1
+                return False
+            self._pending = None
+        return True
+
+    def _onLoaded(self, result):
+        if self._finish(result.generation):
+            self.sliceLoaded.emit(result)
+
+    def _onFailed(self, generation, path, message):
+        if self._finish(generation):
+            self.loadFailed.emit(generation, path, message)
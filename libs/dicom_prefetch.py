@@ -0,0 +1,112 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from libs.dicom_io import DICOMReader
+
+DEFAULT_PREFETCH = 4
+DEFAULT_PREFETCH_WORKERS = 2
+
+
+class DICOMPrefetcher(object):
+    """Decode the neighbours of the current slice ahead of navigation.
+
+    Slices are decoded on a thread pool into `DICOMReader.sliceCache`, so
+    stepping through a series with next/prev hits the cache instead of disk.
+    Prefetching follows the direction of navigation, and queued work for
+    slices that are no longer near the current one is cancelled.
+    """
+
+    def __init__(self, num_ahead=DEFAULT_PREFETCH, num_workers=DEFAULT_PREFETCH_WORKERS):
+        self.num_ahead = num_ahead
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="dicom-prefetch"
+        )
+        self._pending = {}
+        self._last_index = None
+        self._direction = 1
+        # Re-entrant: a future that finishes immediately runs _onDone under the lock
+        self._lock = threading.RLock()
+
+    def update(self, paths, index):
+        """Prefetch around the slice being displayed.
+
+        Args:
+            paths: Ordered list of slice paths of the series.
+            index: Index in `paths` of the slice being displayed.
+        """
+        if self.num_ahead <= 0:
+            return
+
+        if self._last_index is not None and index != self._last_index:
+            self._direction = 1 if index > self._last_index else -1
+        self._last_index = index
+
+        # Most of the budget goes ahead, one slice behind in case the user turns back
+        offsets = [self._direction * k for k in range(1, self.num_ahead + 1)]
+        offsets.append(-self._direction)
+        wanted = [paths[index + o] for o in offsets if 0 <= index + o < len(paths)]
+
+        with self._lock:
+            # Cancel queued work that is no longer near the current slice
+            for path, future in list(self._pending.items()):
+                if path not in wanted and future.cancel():
+                    self._pending.pop(path, None)
+
+            for path in wanted:
+                if path in self._pending or self._isCached(path):
+                    continue
+                future = self._executor.submit(self._prefetch, path)
+                self._pending[path] = future
+                future.add_done_callback(lambda f, p=path: self._onDone(p, f))
+
+    def waitFor(self, path):
+        """Wait for an in-flight prefetch of `path` so it is not decoded twice.
+
+        A prefetch that has not started yet is cancelled instead, since the
+        caller is about to decode the file itself.
+        """
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None and not future.cancel():
+            wait([future])
+
+    def wait(self, timeout=None):
+        """Wait for all pending prefetches to finish."""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout=timeout)
+
+    def reset(self):
+        """Cancel all queued work and forget the navigation direction."""
+        with self._lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+        for future in futures:
+            future.cancel()
+        self._last_index = None
+        self._direction = 1
+
+    def shutdown(self):
+        self.reset()
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _isCached(path):
+        try:
+            return DICOMReader.sliceCache.key(path) in DICOMReader.sliceCache
+        except OSError:
+            return False
+
+    @staticmethod
+    def _prefetch(path):
+        try:
+            DICOMReader.readSlice(path)
+        except Exception:
+            # Errors are reported when the slice is actually opened
+            pass
+
+    def _onDone(self, path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
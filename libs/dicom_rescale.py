@@ -0,0 +1,101 @@
+"""Single-pass conversion of stored DICOM pixel values to Hounsfield Units.
+
+The output dtype is chosen from the stored value range and the rescale
+slope/intercept, so unsigned 16-bit data is not wrapped into int16. Padding
+replacement and rescaling then run in place over blocks of pixels, so the
+only full-size allocation is the output array itself, and none at all when
+the decoded array already has the output dtype.
+"""
+import numpy as np
+
+# Stored value some scanners use for pixels outside of the scan
+PADDING_VALUE = -2000
+
+# Pixels rescaled per block: bounds the padding mask and float temporaries
+RESCALE_BLOCK_PIXELS = 1 << 18
+
+_OUTPUT_DTYPES = (np.dtype(np.int16), np.dtype(np.int32), np.dtype(np.int64))
+
+
+def storedRange(stored_dtype, bits_stored=None):
+    """Get the (min, max) stored value allowed by the pixel dtype and BitsStored."""
+    num_bits = 8 * stored_dtype.itemsize
+    if bits_stored:
+        num_bits = min(num_bits, int(bits_stored))
+    if stored_dtype.kind == "i":
+        return -(1 << (num_bits - 1)), (1 << (num_bits - 1)) - 1
+    return 0, (1 << num_bits) - 1
+
+
+def rescaleDtype(p_min, p_max, slope=1, intercept=0):
+    """Get the smallest integer dtype holding rescaled values of [p_min, p_max]."""
+    ends = [int(slope * p) + int(intercept) for p in (p_min, p_max)]
+    for dtype in _OUTPUT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min(ends) and max(ends) <= info.max:
+            return dtype
+    raise OverflowError("Rescaled pixel values do not fit in int64")
+
+
+def rescaleToHU(stored, slope=1, intercept=0, bits_stored=None, dtype=None,
+                mask_unused_bits=False, reuse=True):
+    """Convert stored pixel values to raw Hounsfield Units.
+
+    Scale by the slope, truncating toward zero, then add the integer part of
+    the intercept. Signed pixels equal to `PADDING_VALUE` are set to 0 first.
+
+    Args:
+        stored: Decoded pixel array. Reused as the output when `reuse` is
+            true and it already has the output dtype and is writeable.
+        slope: RescaleSlope.
+        intercept: RescaleIntercept.
+        bits_stored: BitsStored, used to bound the stored values.
+        dtype: Output dtype. If None, int16 unless the rescaled values need more.
+        mask_unused_bits: If true, clear the bits above `bits_stored` (or
+            sign-extend signed values from them), as pydicom does when it
+            decodes pixels. Needed for pixels read straight from the file.
+        reuse: If false, never write to `stored`.
+
+    Returns:
+        ndarray of the same shape as `stored` with Hounsfield Units.
+    """
+    slope = float(slope)
+    intercept = int(intercept)
+    p_min, p_max = storedRange(stored.dtype, bits_stored)
+    if dtype is None:
+        dtype = rescaleDtype(p_min, p_max, slope, intercept)
+        if dtype != np.int16 and stored.size > 0:
+            # Declared range is too wide: most data still fits int16
+            p_min, p_max = int(stored.min()), int(stored.max())
+            dtype = rescaleDtype(p_min, p_max, slope, intercept)
+    dtype = np.dtype(dtype)
+
+    if reuse and stored.dtype == dtype and stored.flags.writeable and stored.flags.c_contiguous:
+        out = stored
+    else:
+        out = stored.astype(dtype, order="C")
+
+    num_bits = int(bits_stored or 0)
+    if not mask_unused_bits or not 0 < num_bits < 8 * stored.dtype.itemsize:
+        num_bits = 0
+    # Shift that sign-extends values from `num_bits` bits in the output dtype
+    sign_shift = 8 * out.dtype.itemsize - num_bits
+
+    replace_padding = stored.dtype.kind == "i" and p_min <= PADDING_VALUE <= p_max
+    flat = out.reshape(-1)
+    for start in range(0, flat.size, RESCALE_BLOCK_PIXELS):
+        block = flat[start:start + RESCALE_BLOCK_PIXELS]
+        if num_bits and stored.dtype.kind == "u":
+            block &= (1 << num_bits) - 1
+        elif num_bits:
+            block <<= sign_shift
+            block >>= sign_shift
+        if replace_padding:
+            # Set outside-of-scan pixels to 0
+            block[block == PADDING_VALUE] = 0
+        if slope != 1:
+            np.copyto(block, block * slope, casting="unsafe")
+        if intercept != 0:
+            block += intercept
+
+    return out
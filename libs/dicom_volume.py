@@ -0,0 +1,207 @@
+"""Memory-mapped cache of the Hounsfield Units of whole DICOM series.
+
+The slices of a series are stacked, in `sorted_paths()` order, into one
+`.npy` file with a JSON sidecar recording the source files, their size and
+mtime, and the per-slice photometric interpretation. Opening the volume in a
+later session maps the file and serves every slice as a view into it, so
+browsing never reads or decodes the DICOM files again. A volume is not used
+once any of its source files has changed.
+"""
+import hashlib
+import json
+import numpy as np
+import os
+
+from libs.dicom_io import DICOMReader, DICOMSlice
+
+DEFAULT_VOLUME_DIR = os.path.join(os.path.expanduser("~"), ".labelImgVolumes")
+
+# Bump when the volume or sidecar layout changes: older volumes are rebuilt
+VOLUME_FORMAT_VERSION = 1
+
+
+def _fileStamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class SeriesVolume(object):
+    """Stacked Hounsfield Units of a series, mapped read-only from its cache file.
+
+    Can be set as (or chained into) `DICOMReader.sliceSource`.
+    """
+
+    def __init__(self, dicom_paths, stamps, photometrics, volume):
+        self.dicom_paths = list(dicom_paths)
+        self.stamps = stamps
+        self.photometrics = photometrics
+        self.volume = volume
+        self._indices = {path: i for i, path in enumerate(self.dicom_paths)}
+
+    def __len__(self):
+        return len(self.dicom_paths)
+
+    def loadSlice(self, dicom_path):
+        """Get a slice as a view into the volume, without copying its pixels.
+
+        Returns:
+            DICOMSlice, or None if the file is not in the volume or changed
+            since the volume was built.
+        """
+        i = self._indices.get(os.path.abspath(dicom_path))
+        if i is None:
+            return None
+        try:
+            if _fileStamp(dicom_path) != self.stamps[i]:
+                return None
+        except OSError:
+            return None
+
+        return DICOMSlice.fromPixels(dicom_path, np.asarray(self.volume[i]), self.photometrics[i])
+
+
+class SeriesVolumeCache(object):
+    """Directory of series volumes, keyed by the ordered paths of their slices."""
+
+    def __init__(self, cache_dir=DEFAULT_VOLUME_DIR):
+        self.cache_dir = cache_dir
+
+    def volumePaths(self, dicom_paths):
+        """Get the (volume, sidecar) file paths of a series."""
+        key = hashlib.sha1("\n".join(dicom_paths).encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".npy", base + ".json"
+
+    def open(self, dicom_paths):
+        """Map the cached volume of a series.
+
+        Args:
+            dicom_paths: Paths of the series slices, in `sorted_paths()` order.
+
+        Returns:
+            SeriesVolume, or None if the series has no volume or any of its
+            files changed since the volume was built.
+        """
+        dicom_paths = [os.path.abspath(p) for p in dicom_paths]
+        volume_path, sidecar_path = self.volumePaths(dicom_paths)
+        try:
+            with open(sidecar_path, "r") as fh:
+                header = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if header.get("version") != VOLUME_FORMAT_VERSION or header.get("paths") != dicom_paths:
+            return None
+
+        try:
+            stamps = [_fileStamp(p) for p in dicom_paths]
+        except OSError:
+            return None
+        if stamps != header["stamps"]:
+            return None
+
+        try:
+            volume = np.load(volume_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if volume.shape != tuple(header["shape"]) or volume.dtype.str != header["dtype"]:
+            return None
+
+        return SeriesVolume(dicom_paths, stamps, header["photometrics"], volume)
+
+    def build(self, dicom_paths, cancel=None):
+        """Decode every slice of a series into its volume file.
+
+        The volume is written to a temporary file and moved into place, and
+        the sidecar is written last, so a partly written volume is never
+        opened. Slices are stored in the dtype common to all of them (e.g.
+        int32 if one slice of an int16 series needs it). File stamps are taken before decoding: a file changing while
+        the volume is built invalidates it.
+
+        Args:
+            dicom_paths: Paths of the series slices, in `sorted_paths()` order.
+            cancel: Optional threading.Event, checked before each slice.
+                Once set, the build stops and nothing is written.
+
+        Returns:
+            SeriesVolume over the new file, or None if the series is empty,
+            its slices differ in size, or the build was cancelled.
+
+        Raises:
+            RuntimeWarning: If a slice cannot be read.
+        """
+        dicom_paths = [os.path.abspath(p) for p in dicom_paths]
+        if len(dicom_paths) == 0:
+            return None
+        volume_path, sidecar_path = self.volumePaths(dicom_paths)
+        try:
+            stamps = [_fileStamp(p) for p in dicom_paths]
+        except OSError:
+            raise RuntimeWarning(f"Could not load DICOM series {os.path.dirname(dicom_paths[0])}")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Never leave an old sidecar next to a volume that is being replaced
+        self._remove(sidecar_path)
+        tmp_path = "{}.{}.tmp".format(volume_path, os.getpid())
+        photometrics = []
+        volume = None
+        try:
+            for i, dicom_path in enumerate(dicom_paths):
+                if cancel is not None and cancel.is_set():
+                    return None
+                # Bypass the cache: the whole series would evict the slices being browsed
+                dicom_slice = DICOMReader.readSlice(dicom_path, use_cache=False)
+                pixels = dicom_slice.pixels
+                if volume is None:
+                    volume = np.lib.format.open_memmap(
+                        tmp_path, mode="w+", dtype=pixels.dtype,
+                        shape=(len(dicom_paths),) + pixels.shape,
+                    )
+                elif pixels.shape != volume.shape[1:]:
+                    return None
+                elif not np.can_cast(pixels.dtype, volume.dtype):
+                    volume = self._widen(tmp_path, volume, np.result_type(volume.dtype, pixels.dtype), i)
+                volume[i] = pixels
+                photometrics.append(dicom_slice.photometric)
+            volume.flush()
+            shape, dtype = volume.shape, volume.dtype.str
+            # Unmap before moving the file into place
+            volume = None
+            os.replace(tmp_path, volume_path)
+        finally:
+            volume = None
+            self._remove(tmp_path)
+
+        header = {
+            "version": VOLUME_FORMAT_VERSION,
+            "paths": dicom_paths,
+            "stamps": stamps,
+            "shape": list(shape),
+            "dtype": dtype,
+            "photometrics": photometrics,
+        }
+        tmp_path = "{}.{}.tmp".format(sidecar_path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump(header, fh)
+        os.replace(tmp_path, sidecar_path)
+
+        return self.open(dicom_paths)
+
+    @classmethod
+    def _widen(cls, tmp_path, volume, dtype, count):
+        """Replace the volume being built by one of a wider dtype, holding its first `count` slices."""
+        wide_path = "{}.wide".format(tmp_path)
+        try:
+            wider = np.lib.format.open_memmap(wide_path, mode="w+", dtype=dtype, shape=volume.shape)
+            wider[:count] = volume[:count]
+            # The new map follows its file to `tmp_path`
+            os.replace(wide_path, tmp_path)
+        finally:
+            cls._remove(wide_path)
+        return wider
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
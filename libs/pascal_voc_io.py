@@ -3,12 +3,52 @@
 import sys
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
-from lxml import etree
 import codecs
 
+from libs.atomic_io import atomicWrite
+
 XML_EXT = '.xml'
 ENCODE_METHOD = 'utf-8'
 
+
+def _escapeText(text):
+    if '&' in text or '<' in text or '>' in text or '\r' in text:
+        # Line ends are normalized to \n, as an XML parser does
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text
+
+
+def _escapeAttribute(value):
+    value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+    return value.replace('\r', '&#13;').replace('\n', '&#10;').replace('\t', '&#9;')
+
+
+def xmlLines(elem, depth=0, lines=None):
+    """Serialize an Element to a list of lines indented with one tab per level.
+
+    An element holds either text or child elements. Elements without text
+    are written as `<tag/>`, the same as lxml pretty printing.
+    """
+    if lines is None:
+        lines = []
+    indent = '\t' * depth
+    tag = elem.tag
+    start = indent + '<' + tag
+    if elem.attrib:
+        start += ''.join(' {}="{}"'.format(key, _escapeAttribute(value)) for key, value in elem.items())
+    if len(elem):
+        lines.append(start + '>\n')
+        for child in elem:
+            xmlLines(child, depth + 1, lines)
+        lines.append(indent + '</' + tag + '>\n')
+    elif elem.text:
+        lines.append(start + '>' + _escapeText(elem.text) + '</' + tag + '>\n')
+    else:
+        lines.append(start + '/>\n')
+    return lines
+
+
 class PascalVocWriter:
 
     def __init__(self, foldername, filename, imgSize, databaseSrc='Unknown', localImgPath=None):
@@ -22,14 +62,10 @@ class PascalVocWriter:
 
     def prettify(self, elem):
         """
-            Return a pretty-printed XML string for the Element.
+            Return a pretty-printed XML string for the Element, indented with tabs.
         """
-        rough_string = ElementTree.tostring(elem, 'utf8')
-        root = etree.fromstring(rough_string)
-        return etree.tostring(root, pretty_print=True, encoding=ENCODE_METHOD).replace("  ".encode(), "\t".encode())
-        # minidom does not support UTF-8
-        '''reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="\t", encoding=ENCODE_METHOD)'''
+        # Serialized in one pass: no round trip through a second XML library
+        return ''.join(xmlLines(elem)).encode(ENCODE_METHOD)
 
     def genXML(self):
         """
@@ -113,16 +149,11 @@ class PascalVocWriter:
     def save(self, targetFile=None):
         root = self.genXML()
         self.appendObjects(root)
-        out_file = None
         if targetFile is None:
-            out_file = codecs.open(
-                self.filename + XML_EXT, 'w', encoding=ENCODE_METHOD)
-        else:
-            out_file = codecs.open(targetFile, 'w', encoding=ENCODE_METHOD)
+            targetFile = self.filename + XML_EXT
 
         prettifyResult = self.prettify(root)
-        out_file.write(prettifyResult.decode('utf8'))
-        out_file.close()
+        atomicWrite(targetFile, prettifyResult)
 
 
 class PascalVocReader:
@@ -151,6 +182,8 @@ class PascalVocReader:
 
     def parseXML(self):
         assert self.filepath.endswith(XML_EXT), "Unsupport file format"
+        from lxml import etree
+
         parser = etree.XMLParser(encoding=ENCODE_METHOD)
         xmltree = ElementTree.parse(self.filepath, parser=parser).getroot()
         filename = xmltree.find('filename').text
@@ -0,0 +1,90 @@
+"""Zero-copy conversion of NumPy images to QImage.
+
+A QImage built over a NumPy buffer does not own its pixels, so the array is
+attached to the returned image and lives as long as the image does. Frames
+that are redrawn often (e.g. while dragging a window/level slider) can be
+rendered in place into a reusable FrameBuffer.
+"""
+import numpy as np
+
+try:
+    from PyQt5.QtGui import QImage, qRgb
+except ImportError:
+    from PyQt4.QtGui import QImage, qRgb
+
+# Setting a color table detaches (copies) a QImage built over external memory,
+# so greyscale uses Format_Grayscale8 (Qt >= 5.5) and needs no table
+GRAY_FORMAT = getattr(QImage, "Format_Grayscale8", QImage.Format_Indexed8)
+
+# Color table for Format_Indexed8 on older Qt: built once instead of per frame
+GRAY_COLOR_TABLE = [qRgb(i, i, i) for i in range(256)]
+
+_FORMATS = {
+    2: GRAY_FORMAT,
+    3: QImage.Format_RGB888,
+    4: QImage.Format_ARGB32,
+}
+
+
+def ndarrayToQImage(arr, do_copy=False):
+    """Convert a uint8 NumPy image to a QImage without copying its pixels.
+
+    Args:
+        arr: uint8 array of shape (height, width) for greyscale, or
+            (height, width, 3 or 4) for RGB888 / ARGB32.
+        do_copy: If true, return a QImage that owns a copy of the pixels.
+
+    Returns:
+        QImage over the pixels of `arr` (or of a contiguous copy of it if its
+        rows are not contiguous). The array is kept alive by the image.
+
+    Raises:
+        NotImplementedError: If the dtype or shape is not supported.
+    """
+    if arr is None:
+        return QImage()
+
+    if arr.dtype != np.uint8:
+        raise NotImplementedError("Unsupported image format.")
+    if arr.ndim == 2:
+        fmt = _FORMATS[2]
+    elif arr.ndim == 3 and arr.shape[2] in (3, 4):
+        fmt = _FORMATS[arr.shape[2]]
+    else:
+        raise NotImplementedError("Unsupported image format.")
+
+    # QImage needs packed pixels within a row; rows may be padded
+    if arr.strides[-1] != 1 or (arr.ndim == 3 and arr.strides[1] != arr.shape[2]):
+        arr = np.ascontiguousarray(arr)
+
+    qim = QImage(arr.data, arr.shape[1], arr.shape[0], arr.strides[0], fmt)
+    if fmt == QImage.Format_Indexed8:
+        qim.setColorTable(GRAY_COLOR_TABLE)
+    if do_copy:
+        return qim.copy()
+
+    # QImage does not own the buffer: keep the array alive with the image
+    qim.ndarray = arr
+    return qim
+
+
+class FrameBuffer(object):
+    """Reusable uint8 frame that images are rendered into in place.
+
+    Rendering into the same buffer again changes the pixels of QImages
+    previously built over it, so use one FrameBuffer per view and hand
+    the images to something that copies them (e.g. QPixmap.fromImage).
+    """
+
+    def __init__(self):
+        self._frame = None
+
+    def get(self, shape):
+        """Get the frame for an image of `shape`, reallocated only when the shape changes."""
+        shape = tuple(shape)
+        if self._frame is None or self._frame.shape != shape:
+            self._frame = np.empty(shape, dtype=np.uint8)
+        return self._frame
+
+    def release(self):
+        self._frame = None
@@ -0,0 +1,64 @@
+"""Coalescing of bursts of render requests into one render per display frame.
+
+Sliders emit a value change on every tick, much faster than an image can be
+re-rendered. A RenderScheduler keeps only the latest requested arguments and
+renders them once the current frame interval has elapsed, so the display
+always ends on the latest values without rendering every tick in between.
+"""
+try:
+    from PyQt5.QtCore import QObject, QTimer
+except ImportError:
+    from PyQt4.QtCore import QObject, QTimer
+
+# Minimum time between two renders: one frame at 60 Hz
+FRAME_INTERVAL_MS = 16
+
+
+class RenderScheduler(QObject):
+    """Call `render` with the latest scheduled arguments, at most once per frame."""
+
+    def __init__(self, render, interval_ms=FRAME_INTERVAL_MS, parent=None):
+        """
+        Args:
+            render: Callable run on the GUI thread with the latest arguments.
+            interval_ms: Minimum time between two renders.
+            parent: Parent QObject.
+        """
+        super(RenderScheduler, self).__init__(parent)
+        self.render = render
+        self.requests = 0
+        self.renders = 0
+        self._args = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def dropped(self):
+        """Number of requests not rendered: replaced by a later one, or cancelled."""
+        return self.requests - self.renders - (self._args is not None)
+
+    def isPending(self):
+        return self._args is not None
+
+    def schedule(self, *args):
+        """Request a render with `args`, replacing any request not rendered yet."""
+        self.requests += 1
+        self._args = args
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """Render the pending request now, if there is one."""
+        self._timer.stop()
+        if self._args is None:
+            return
+        args, self._args = self._args, None
+        self.renders += 1
+        self.render(*args)
+
+    def cancel(self):
+        """Drop the pending request without rendering it."""
+        self._timer.stop()
+        self._args = None
@@ -0,0 +1,97 @@
+"""Saving of annotation files off the GUI thread.
+
+The GUI takes a snapshot of the shapes to save and submits a function
+writing it. Saves are written one at a time by a background worker, so
+navigating to the next image does not wait for the disk. A save submitted
+for a file that already has a save waiting replaces it: only the latest
+snapshot of a file is written. Reading a file back only waits for the
+saves of that file.
+
+Writers replace files with `libs.atomic_io.atomicWrite`, so a crash
+mid-save leaves the previous version of the file, never a truncated one.
+"""
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+try:
+    from PyQt5.QtCore import QObject, pyqtSignal
+except ImportError:
+    from PyQt4.QtCore import QObject, pyqtSignal
+
+
+class AnnotationSaveQueue(QObject):
+    """Write annotation files in the background, latest snapshot per file wins."""
+
+    # Path of a file written
+    saved = pyqtSignal(str)
+    # Path and error message of a file that could not be written
+    saveFailed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super(AnnotationSaveQueue, self).__init__(parent)
+        # Saves replaced by a later save of the same file before being written
+        self.merged = 0
+        # One worker: saves of a file are written in the order submitted
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="annotation-save")
+        self._lock = threading.Lock()
+        # Saves waiting, and futures of saves not finished, per normalized path
+        self._pending = OrderedDict()
+        self._futures = {}
+
+    def submit(self, path, save_fn):
+        """Write `path` in the background by calling `save_fn()`.
+
+        Args:
+            path: Path of the annotation file, identifying saves to merge.
+            save_fn: Callable writing a snapshot of the annotations to `path`.
+        """
+        key = os.path.normpath(path)
+        with self._lock:
+            if key in self._pending:
+                self.merged += 1
+                self._pending[key] = (path, save_fn)
+                return
+            self._pending[key] = (path, save_fn)
+            future = self._executor.submit(self._write, key)
+            self._futures.setdefault(key, set()).add(future)
+        future.add_done_callback(partial(self._discard, key))
+
+    def isPending(self, path=None):
+        """Whether some saves, or saves of `path` if given, are not written yet."""
+        return any(not future.done() for future in self._unfinished(path))
+
+    def flush(self, path=None, timeout=None):
+        """Wait until every save submitted so far, or every save of `path` if given, is written."""
+        wait(self._unfinished(path), timeout=timeout)
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _unfinished(self, path):
+        with self._lock:
+            if path is None:
+                return [f for futures in self._futures.values() for f in futures]
+            return list(self._futures.get(os.path.normpath(path), ()))
+
+    def _discard(self, key, future):
+        with self._lock:
+            futures = self._futures.get(key)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._futures[key]
+
+    def _write(self, key):
+        with self._lock:
+            path, save_fn = self._pending.pop(key)
+        try:
+            save_fn()
+        except Exception as e:
+            self.saveFailed.emit(path, str(e))
+            return
+        self.saved.emit(path)
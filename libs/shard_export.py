@@ -0,0 +1,253 @@
+"""Export of annotated DICOM series to fixed-size training shards.
+
+Slices are joined to the Pascal VOC or YOLO annotations that labelImg saves
+in the `BBOX_DIR_NAME` folder next to each series, and written in series
+order to `.npz` shards of `shard_size` slices. Each shard holds:
+
+    pixels        1-D concatenation of the slice images (HU, or windowed uint8)
+    offsets       (N + 1,) start of each slice in `pixels`
+    shapes        (N, 2) height and width of each slice
+    paths         (N,) slice paths relative to the export root
+    boxes         (M, 4) xmin, ymin, xmax, ymax of every box, in pixels
+    box_slices    (M,) index in the shard of the slice of each box
+    box_labels    (M,) label of each box
+    box_difficult (M,) difficult flag of each box
+
+The shard plan only depends on the series and the export options, and a
+manifest records the key of every finished shard, so re-running an export
+skips the shards that are still up to date. Slices whose annotation file
+cannot be read are left out and listed in the result's `failures`.
+"""
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from libs.annotation_loader import annotationPath, readAnnotation
+from libs.constants import BBOX_DIR_NAME
+from libs.dicom_io import DICOMReader
+
+DEFAULT_SHARD_SIZE = 256
+MANIFEST_FILENAME = "manifest.json"
+# Bump when the shard layout changes: shards of older versions are rewritten
+SHARD_FORMAT_VERSION = 1
+
+# A slice to export and its annotation file (None if it has none)
+ExportSlice = namedtuple("ExportSlice", ["dicom_path", "rel_path", "annotation_path"])
+# Shards written and up to date, slices in all shards and in written ones, boxes in all shards,
+# and (annotation path, error message) of the slices left out of all shards
+ExportResult = namedtuple(
+    "ExportResult", ["written", "skipped", "num_slices", "slices_written", "num_boxes", "failures", "seconds"]
+)
+
+
+def planShards(root, series_paths, shard_size=DEFAULT_SHARD_SIZE, annotated_only=False):
+    """Split the slices of annotated series into shards.
+
+    Args:
+        root: Export root, that slice paths are stored relative to.
+        series_paths: Sorted slice paths of each series, e.g. from `listSeriesPaths`.
+        shard_size: Number of slices per shard (the last shard may be smaller).
+        annotated_only: If true, only export slices that have an annotation
+            file. Else export every slice of a series with a `BBOX_DIR_NAME`
+            folder, so unannotated slices serve as negatives.
+
+    Returns:
+        List of shards, each a list of ExportSlice.
+    """
+    slices = []
+    for paths in series_paths:
+        if not paths or not os.path.isdir(os.path.join(os.path.dirname(paths[0]), BBOX_DIR_NAME)):
+            continue
+        for dicom_path in paths:
+            annotation_path = annotationPath(dicom_path)
+            if annotated_only and annotation_path is None:
+                continue
+            slices.append(ExportSlice(dicom_path, os.path.relpath(dicom_path, root), annotation_path))
+
+    return [slices[i:i + shard_size] for i in range(0, len(slices), shard_size)]
+
+
+def shardKey(shard, window):
+    """Hash of the slices of a shard, their annotations and the export window.
+
+    Changes when any slice or annotation file is added, removed or modified.
+    """
+    key = hashlib.sha1(json.dumps([SHARD_FORMAT_VERSION, window]).encode("utf-8"))
+    for export_slice in shard:
+        stamps = []
+        for path in (export_slice.dicom_path, export_slice.annotation_path):
+            if path is not None:
+                st = os.stat(path)
+                stamps.append([st.st_size, st.st_mtime_ns])
+        key.update(json.dumps([export_slice.rel_path, stamps]).encode("utf-8"))
+    return key.hexdigest()
+
+
+def writeShard(shard_path, shard, window=None):
+    """Read, join and write the slices of one shard. Runs in a worker process.
+
+    Args:
+        shard_path: Path of the `.npz` file to write.
+        shard: List of ExportSlice.
+        window: None to export Hounsfield Units, "auto" for the automatic
+            window of each slice, or (w_width, w_level) to export uint8
+            windowed images.
+
+    Slices whose annotation file cannot be read are left out of the shard,
+    rather than exported as if they had no boxes.
+
+    Returns:
+        Tuple (number of slices, number of boxes, list of (annotation path,
+        error message) of the slices left out).
+    """
+    images, paths, boxes, box_slices, box_labels, box_difficult = [], [], [], [], [], []
+    failures = []
+    for export_slice in shard:
+        dicom_slice = DICOMReader.readSlice(export_slice.dicom_path, use_cache=False)
+        slice_boxes = []
+        if export_slice.annotation_path is not None:
+            try:
+                slice_boxes = readAnnotation(export_slice.annotation_path, dicom_slice.height, dicom_slice.width)
+            except Exception as e:
+                failures.append((export_slice.annotation_path, "{}: {}".format(type(e).__name__, e)))
+                continue
+
+        if window is None:
+            image = dicom_slice.pixels
+        else:
+            w_width, w_level = dicom_slice.autoWindow() if window == "auto" else window
+            image = DICOMReader.renderSlice(dicom_slice, w_width, w_level)
+        for label, xmin, ymin, xmax, ymax, difficult in slice_boxes:
+            boxes.append((xmin, ymin, xmax, ymax))
+            box_slices.append(len(images))
+            box_labels.append(label)
+            box_difficult.append(difficult)
+        images.append(image)
+        paths.append(export_slice.rel_path)
+
+    offsets = np.cumsum([0] + [image.size for image in images], dtype=np.int64)
+    if images:
+        pixels = np.concatenate([image.ravel() for image in images])
+    else:
+        pixels = np.zeros(0, dtype=np.int16 if window is None else np.uint8)
+    arrays = {
+        "pixels": pixels,
+        "offsets": offsets,
+        "shapes": np.array([image.shape for image in images], dtype=np.int32).reshape(-1, 2),
+        "paths": np.array(paths, dtype=np.str_),
+        "boxes": np.array(boxes, dtype=np.int32).reshape(-1, 4),
+        "box_slices": np.array(box_slices, dtype=np.int32),
+        "box_labels": np.array(box_labels, dtype=np.str_),
+        "box_difficult": np.array(box_difficult, dtype=bool),
+    }
+    # Write then rename, so an interrupted export never leaves a partial shard
+    tmp_path = "{}.{}.tmp.npz".format(os.path.splitext(shard_path)[0], os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, shard_path)
+
+    return len(images), len(boxes), failures
+
+
+def readShard(shard_path):
+    """Iterate over the slices of a shard.
+
+    Yields:
+        Tuple (relative path, image, list of (label, xmin, ymin, xmax, ymax, difficult)).
+    """
+    with np.load(shard_path) as shard:
+        pixels, offsets, shapes = shard["pixels"], shard["offsets"], shard["shapes"]
+        boxes, box_slices = shard["boxes"], shard["box_slices"]
+        box_labels, box_difficult = shard["box_labels"], shard["box_difficult"]
+        for i, rel_path in enumerate(shard["paths"]):
+            image = pixels[offsets[i]:offsets[i + 1]].reshape(shapes[i])
+            slice_boxes = [
+                (str(box_labels[j]),) + tuple(int(v) for v in boxes[j]) + (bool(box_difficult[j]),)
+                for j in np.flatnonzero(box_slices == i)
+            ]
+            yield str(rel_path), image, slice_boxes
+
+
+def exportShards(root, output_dir, series_paths, shard_size=DEFAULT_SHARD_SIZE, window=None,
+                 annotated_only=False, num_workers=0):
+    """Export annotated series to shards, skipping shards already up to date.
+
+    At most `num_workers` shards are in memory at a time, one per worker.
+
+    Args:
+        root: Export root, that slice paths are stored relative to.
+        output_dir: Directory of the shards and their manifest.
+        series_paths: Sorted slice paths of each series.
+        shard_size: Number of slices per shard.
+        window: Export window, see `writeShard`.
+        annotated_only: If true, only export slices that have an annotation file.
+        num_workers: Number of worker processes. If 0, export in this process.
+
+    Returns:
+        ExportResult.
+    """
+    start = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+    done = manifest.get("shards", {})
+
+    window_key = list(window) if isinstance(window, tuple) else window
+    todo = []
+    shards = {}
+    num_slices = 0
+    for i, shard in enumerate(planShards(root, series_paths, shard_size, annotated_only)):
+        name = "shard-{:05d}.npz".format(i)
+        key = shardKey(shard, window_key)
+        entry = done.get(name)
+        if entry is not None and entry["key"] == key and os.path.isfile(os.path.join(output_dir, name)):
+            shards[name] = entry
+        else:
+            todo.append((name, key, shard))
+        num_slices += len(shard)
+
+    def record(name, key, result):
+        num_slices, num_boxes, failures = result
+        shards[name] = {"key": key, "num_slices": num_slices, "num_boxes": num_boxes, "failures": failures}
+        # Rewrite the manifest after every shard, so an interrupted export resumes from it
+        _writeManifest(manifest_path, shards)
+
+    if num_workers > 0:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            pending = OrderedDict()
+            for name, key, shard in todo:
+                shard_path = os.path.join(output_dir, name)
+                pending[name] = (key, executor.submit(writeShard, shard_path, shard, window))
+                # Bound the shards submitted at a time: one running and one queued per worker
+                while len(pending) >= 2 * num_workers:
+                    done_name, (done_key, future) = pending.popitem(last=False)
+                    record(done_name, done_key, future.result())
+            for done_name, (done_key, future) in pending.items():
+                record(done_name, done_key, future.result())
+    else:
+        for name, key, shard in todo:
+            record(name, key, writeShard(os.path.join(output_dir, name), shard, window))
+    # Also drops shards that are no longer in the plan
+    _writeManifest(manifest_path, shards)
+
+    num_boxes = sum(entry["num_boxes"] for entry in shards.values())
+    # Failures of up to date shards are kept in the manifest, until their annotation files change
+    failures = [tuple(failure) for name in sorted(shards) for failure in shards[name].get("failures", [])]
+    slices_written = sum(len(shard) for _, _, shard in todo)
+    return ExportResult(len(todo), len(shards) - len(todo), num_slices, slices_written, num_boxes, failures,
+                        time.time() - start)
+
+
+def _writeManifest(manifest_path, shards):
+    tmp_path = "{}.{}.tmp".format(manifest_path, os.getpid())
+    with open(tmp_path, "w") as fh:
+        json.dump({"version": SHARD_FORMAT_VERSION, "shards": shards}, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
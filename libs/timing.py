@@ -0,0 +1,144 @@
+"""Stage timing of the image load pipeline.
+
+Each stage of loading and showing an image is wrapped in a span::
+
+    with stageTimer.span("dicom.rescale"):
+        pixels = ...
+
+While timing is off, `span` returns one shared no-op context manager, so an
+instrumented stage only costs a method call and a flag check. While it is
+on, the durations of the latest spans of every stage are kept to report
+rolling p50/p95/p99, and each span can also be appended as one JSON line to
+a log file.
+
+Timing is turned on at import by the LABELIMG_TIMING environment variable,
+with LABELIMG_TIMING_LOG naming the JSON-lines log, or from the app settings.
+"""
+import json
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+# Environment variables turning timing on, and naming the JSON-lines log
+ENV_TIMING = "LABELIMG_TIMING"
+ENV_TIMING_LOG = "LABELIMG_TIMING_LOG"
+# Number of latest spans of a stage that percentiles are computed over
+DEFAULT_TIMING_WINDOW = 200
+TIMING_PERCENTILES = (50, 95, 99)
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span(object):
+    __slots__ = ("timer", "stage", "start")
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer(object):
+    """Rolling timing statistics of named stages, shared by all threads."""
+
+    def __init__(self, window=DEFAULT_TIMING_WINDOW):
+        """
+        Args:
+            window: Number of latest spans per stage kept for percentiles.
+        """
+        self.window = window
+        self.enabled = False
+        self._samples = {}
+        self._sink = None
+        self._lock = threading.Lock()
+
+    @property
+    def logPath(self):
+        """Path of the JSON-lines log, or None if spans are not logged."""
+        return None if self._sink is None else self._sink.name
+
+    def enable(self, log_path=None):
+        """Start timing spans, appending them to `log_path` if it is given."""
+        with self._lock:
+            self._closeSink()
+            if log_path:
+                self._sink = open(log_path, "a", buffering=1)
+            self.enabled = True
+
+    def disable(self):
+        """Stop timing spans. Statistics collected so far are kept."""
+        with self._lock:
+            self.enabled = False
+            self._closeSink()
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def span(self, stage):
+        """Context manager timing the stage `stage`, a no-op while disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def record(self, stage, seconds):
+        """Record a duration of `stage` measured by the caller."""
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+            if self._sink is not None:
+                self._sink.write(json.dumps({
+                    "time": time.time(),
+                    "stage": stage,
+                    "ms": 1000 * seconds,
+                    "thread": threading.current_thread().name,
+                }) + "\n")
+
+    def stats(self):
+        """Get {stage: {"n": count, "p50": ms, "p95": ms, "p99": ms}} over the rolling window."""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        stats = {}
+        for stage, values in samples.items():
+            ms = np.percentile(1000 * np.asarray(values), TIMING_PERCENTILES)
+            stats[stage] = dict(n=len(values))
+            stats[stage].update(("p%d" % p, float(v)) for p, v in zip(TIMING_PERCENTILES, ms))
+        return stats
+
+    def summary(self, stages=None):
+        """Get a one-line readout of p50/p95/p99 in ms of `stages` (all if None)."""
+        stats = self.stats()
+        parts = []
+        for stage in (sorted(stats) if stages is None else stages):
+            s = stats.get(stage)
+            if s is not None:
+                parts.append("{} {:.1f}/{:.1f}/{:.1f}".format(stage, s["p50"], s["p95"], s["p99"]))
+        return " | ".join(parts)
+
+    def _closeSink(self):
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+# Timer shared by the whole load pipeline
+stageTimer = StageTimer()
+if os.environ.get(ENV_TIMING, "") not in ("", "0"):
+    stageTimer.enable(os.environ.get(ENV_TIMING_LOG))
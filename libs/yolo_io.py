@@ -4,11 +4,29 @@ import sys
 import os
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
-from lxml import etree
 import codecs
 
+from libs.atomic_io import atomicWrite
+
 TXT_EXT = ".txt"
 ENCODE_METHOD = "utf-8"
+YOLO_CLASSES_FILENAME = "classes.txt"
+
+
+def readClassList(classListPath):
+    """Get the class names listed in a YOLO `classes.txt` file."""
+    with open(classListPath, "r") as classesFile:
+        return classesFile.read().strip("\n").split("\n")
+
+
+def yoloBoxToPixels(xcen, ycen, w, h, height, width):
+    """Convert a relative YOLO box to (xmin, ymin, xmax, ymax) pixels in an image."""
+    xmin = max(float(xcen) - float(w) / 2, 0)
+    xmax = min(float(xcen) + float(w) / 2, 1)
+    ymin = max(float(ycen) - float(h) / 2, 0)
+    ymax = min(float(ycen) + float(h) / 2, 1)
+
+    return int(width * xmin), int(height * ymin), int(width * xmax), int(height * ymax)
 
 
 class YOLOWriter:
@@ -52,39 +70,24 @@ class YOLOWriter:
         return classIndex, xcen, ycen, w, h
 
     def save(self, classList=[], targetFile=None):
-        out_file = None  # Update yolo .txt
-        out_class_file = None  # Update class list .txt
-
         if targetFile is None:
-            # Ensure directory exists
-            filename_dir = os.path.dirname(os.path.abspath(self.filename))
-            os.makedirs(filename_dir, exist_ok=True)
-
-            out_file = open(self.filename + TXT_EXT, "w", encoding=ENCODE_METHOD)
-            classesFile = os.path.join(filename_dir, "classes.txt")
-            out_class_file = open(classesFile, "w")
-
-        else:
-            # Ensure directory exists for target file
-            target_dir = os.path.dirname(os.path.abspath(targetFile))
-            os.makedirs(target_dir, exist_ok=True)
-
-            out_file = codecs.open(targetFile, "w", encoding=ENCODE_METHOD)
-            classesFile = os.path.join(target_dir, "classes.txt")
-            out_class_file = open(classesFile, "w")
-
+            targetFile = self.filename + TXT_EXT
+        # Ensure directory exists for target file
+        target_dir = os.path.dirname(os.path.abspath(targetFile))
+        os.makedirs(target_dir, exist_ok=True)
+        classesFile = os.path.join(target_dir, YOLO_CLASSES_FILENAME)
+
+        # Update yolo .txt
+        lines = []
         for box in self.boxlist:
             classIndex, xcen, ycen, w, h = self.BndBox2YoloLine(box, classList)
             print(classIndex, xcen, ycen, w, h)
-            out_file.write(f"{classIndex} {xcen:.6f} {ycen:.6f} {w:.6f} {h:.6f}\n")
+            lines.append(f"{classIndex} {xcen:.6f} {ycen:.6f} {w:.6f} {h:.6f}\n")
+        atomicWrite(targetFile, "".join(lines).encode(ENCODE_METHOD))
 
+        # Update class list .txt
         print(classList)
-        print(out_class_file)
-        for c in classList:
-            out_class_file.write(c + "\n")
-
-        out_class_file.close()
-        out_file.close()
+        atomicWrite(classesFile, "".join(c + "\n" for c in classList).encode(ENCODE_METHOD))
 
 
 class YoloReader:
@@ -96,16 +99,11 @@ class YoloReader:
 
         if classListPath is None:
             dir_path = os.path.dirname(os.path.realpath(self.filepath))
-            self.classListPath = os.path.join(dir_path, "classes.txt")
+            self.classListPath = os.path.join(dir_path, YOLO_CLASSES_FILENAME)
         else:
             self.classListPath = classListPath
 
-        print(filepath, self.classListPath)
-
-        classesFile = open(self.classListPath, "r")
-        self.classes = classesFile.read().strip("\n").split("\n")
-
-        print(self.classes)
+        self.classes = readClassList(self.classListPath)
 
         imgSize = [image.height(), image.width(), 1 if image.isGrayscale() else 3]
 
@@ -126,16 +124,9 @@ class YoloReader:
 
     def yoloLine2Shape(self, classIndex, xcen, ycen, w, h):
         label = self.classes[int(classIndex)]
-
-        xmin = max(float(xcen) - float(w) / 2, 0)
-        xmax = min(float(xcen) + float(w) / 2, 1)
-        ymin = max(float(ycen) - float(h) / 2, 0)
-        ymax = min(float(ycen) + float(h) / 2, 1)
-
-        xmin = int(self.imgSize[1] * xmin)
-        xmax = int(self.imgSize[1] * xmax)
-        ymin = int(self.imgSize[0] * ymin)
-        ymax = int(self.imgSize[0] * ymax)
+        xmin, ymin, xmax, ymax = yoloBoxToPixels(
+            xcen, ycen, w, h, self.imgSize[0], self.imgSize[1]
+        )
 
         return label, xmin, ymin, xmax, ymax
 
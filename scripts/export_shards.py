@@ -0,0 +1,67 @@
+"""
+Script to export annotated DICOM series to fixed-size `.npz` training shards.
+
+Every series under the input directory with a bbox folder (where labelImg
+saves Pascal VOC or YOLO annotations) is exported in series order, each
+slice joined to its boxes. See libs/shard_export.py for the shard layout.
+
+Series are read from the series index if the directory has one (see
+scripts/preload_metadata.py), else found by scanning headers. Re-running
+the same command only writes shards whose slices or annotations changed.
+"""
+
+import argparse
+import os
+
+from libs.constants import DICOM_AUTO_PRESET, DICOM_WINDOW_PRESETS
+from libs.dicom_index import listSeriesPaths
+from libs.shard_export import DEFAULT_SHARD_SIZE, exportShards
+
+# Window name to export Hounsfield Units instead of windowed images
+HU_WINDOW = 'HU'
+
+
+def main(args):
+    if args.window == HU_WINDOW:
+        window = None
+    elif args.window == DICOM_AUTO_PRESET:
+        window = 'auto'
+    elif args.window in DICOM_WINDOW_PRESETS:
+        window = DICOM_WINDOW_PRESETS[args.window]
+    else:
+        raise ValueError('Unknown window {}, expected one of: {}'.format(
+            args.window, ', '.join([HU_WINDOW, DICOM_AUTO_PRESET] + list(DICOM_WINDOW_PRESETS))))
+    output_dir = args.output_dir or os.path.join(args.input_dir, 'shards')
+
+    print('Finding DICOM series under: {}'.format(args.input_dir))
+    series_paths = listSeriesPaths(args.input_dir, args.num_workers, use_processes=True)
+    print('Exporting {} series to: {}'.format(len(series_paths), output_dir))
+    result = exportShards(args.input_dir, output_dir, series_paths, shard_size=args.shard_size,
+                          window=window, annotated_only=args.annotated_only,
+                          num_workers=args.num_workers)
+
+    for path, message in result.failures:
+        print('Failed to load {}, slice left out: {}'.format(path, message))
+
+    print('Shards written: {}, up to date: {}, slices: {}, boxes: {}, failures: {}'.format(
+        result.written, result.skipped, result.num_slices, result.num_boxes, len(result.failures)))
+    print('Exported {} slices in {:.1f}s ({:.0f} slices/sec)'.format(
+        result.slices_written, result.seconds, result.slices_written / max(result.seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input_dir', type=str, required=True, help='Base directory of the DICOM series.')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Directory to write shards to. Defaults to <input_dir>/shards.')
+    parser.add_argument('--window', type=str, default=HU_WINDOW,
+                        help='{} for Hounsfield Units, or a window preset: {}, {}.'.format(
+                            HU_WINDOW, DICOM_AUTO_PRESET, ', '.join(DICOM_WINDOW_PRESETS)))
+    parser.add_argument('--shard_size', type=int, default=DEFAULT_SHARD_SIZE, help='Number of slices per shard.')
+    parser.add_argument('--annotated_only', action='store_true',
+                        help='Only export slices with annotations, not every slice of annotated series.')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes. If 0, export in this process.')
+
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+"""
+Script to load every annotation of a cohort at once, e.g. for QA.
+
+Annotations are found either for the slices of every series under
+--input_dir (series read from the series index if there is one, else found
+by scanning headers), or as all Pascal VOC and YOLO files under --save_dir.
+They are parsed by a pool of workers and optionally written to a `.npz`
+file of columns, see libs/annotation_loader.py for the layout.
+
+Usage:
+    python -m scripts.load_annotations --input_dir /data/cohort --output annotations.npz
+    python -m scripts.load_annotations --save_dir /data/labels --image_size 512 512
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from libs.annotation_loader import findAnnotationFiles, loadAnnotations, seriesAnnotationFiles
+
+
+def main(args):
+    if args.input_dir is not None:
+        print('Finding annotations of the DICOM series under: {}'.format(args.input_dir))
+        files = seriesAnnotationFiles(args.input_dir, args.num_workers, use_processes=True)
+    else:
+        print('Finding annotations under: {}'.format(args.save_dir))
+        files = findAnnotationFiles(args.save_dir, args.image_size)
+
+    table = loadAnnotations(files, args.num_workers)
+    for path, message in table.failures:
+        print('Failed to load {}: {}'.format(path, message))
+
+    counts = np.bincount(table.label_codes, minlength=len(table.labels))
+    for label, count in sorted(zip(table.labels, counts), key=lambda item: -item[1]):
+        print('{:>8} {}'.format(count, label))
+    print('Files: {}, boxes: {}, failures: {}'.format(len(table.files), len(table.boxes), len(table.failures)))
+    print('Loaded {} files in {:.1f}s ({:.0f} files/sec)'.format(
+        len(table.files), table.seconds, len(table.files) / max(table.seconds, 1e-9)))
+
+    if args.output is not None:
+        np.savez(args.output,
+                 paths=np.array([f.path for f in table.files], dtype=np.str_),
+                 image_paths=np.array([f.image_path or '' for f in table.files], dtype=np.str_),
+                 boxes=table.boxes,
+                 label_codes=table.label_codes,
+                 labels=np.array(table.labels, dtype=np.str_),
+                 file_ids=table.file_ids,
+                 difficult=table.difficult)
+        print('Annotations written to: {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input_dir', type=str, help='Base directory of the DICOM series.')
+    source.add_argument('--save_dir', type=str, help='Directory tree of annotation files.')
+    parser.add_argument('--image_size', type=int, nargs=2, default=None, metavar=('HEIGHT', 'WIDTH'),
+                        help='Image size of YOLO files under --save_dir.')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes. If 0, load in this process.')
+    parser.add_argument('--output', type=str, default=None, help='.npz file to write the annotations to.')
+
+    main(parser.parse_args())
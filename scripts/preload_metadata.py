@@ -1,32 +1,44 @@
 """
-Script to preload DICOM series info. Run this script overnight, then
-loading a folder of DICOMs should take milliseconds instead of minutes
-on a spinning disk hard drive.
+Script to preload DICOM series info into a series index. Run this script
+overnight, then loading a folder of DICOMs under the input directory should
+take milliseconds instead of minutes on a spinning disk hard drive.
+
+Re-running it only reads headers of files added or modified since the last
+run, and drops files that were deleted.
 """
 
 import argparse
 import os
-import pickle
 
-from libs.constants import META_FILENAME
-from libs.dicom_io import DICOMReader
+from libs.constants import INDEX_FILENAME
+from libs.dicom_index import DICOMIndex
 
 
 def main(args):
-    for base_path, _, file_names in os.walk(args.input_dir):
-        dicom_names = [f for f in file_names if f.endswith(DICOMReader.suffix)]
-        dicom_metadata = os.path.join(base_path, META_FILENAME)
-        if len(dicom_names) > 0 and not os.path.exists(dicom_metadata):
-            print('Collecting DICOMs in folder: {}'.format(base_path))
-            series_infos = DICOMReader.scanAllDICOMs(base_path, check_preloaded=not args.do_overwrite)
-            with open(dicom_metadata, 'wb') as pkl_fh:
-                pickle.dump(series_infos, pkl_fh)
+    index_path = os.path.join(args.input_dir, INDEX_FILENAME)
+    is_incremental = os.path.exists(index_path) and not args.do_overwrite
+
+    print('{} DICOMs under: {}'.format('Updating' if is_incremental else 'Indexing', args.input_dir))
+    index = DICOMIndex(args.input_dir)
+    if is_incremental:
+        result = index.update(num_workers=args.num_workers, use_processes=args.use_processes)
+    else:
+        result = index.build(num_workers=args.num_workers, use_processes=args.use_processes)
+    index.close()
+
+    num_files = result.added + result.changed + result.unchanged
+    print('Added: {}, changed: {}, removed: {}, unchanged: {}, unreadable: {}'.format(
+        result.added, result.changed, result.removed, result.unchanged, result.unreadable))
+    print('Checked {} files in {:.1f}s ({:.0f} files/sec)'.format(
+        num_files, result.seconds, num_files / max(result.seconds, 1e-9)))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--input_dir', type=str, required=True, help='Base directory to preload.')
-    parser.add_argument('--do_overwrite', action='store_true', help='Overwrite previous metadata.')
+    parser.add_argument('--do_overwrite', action='store_true', help='Rebuild the index from scratch.')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of workers reading headers.')
+    parser.add_argument('--use_processes', action='store_true', help='Use worker processes instead of threads.')
 
     main(parser.parse_args())
@@ -6,7 +6,8 @@ import argparse
 import os
 import pandas as pd
 
-from libs.constants import META_FILENAME, REPORT_FILENAME
+from libs.constants import REPORT_FILENAME
+from libs.dicom_index import DICOMIndex
 from libs.dicom_io import DICOMReader
 
 
@@ -31,11 +32,11 @@ def main(args):
     print('Total missing: {}'.format(num_missing))
 
     # Verify every dir present in the cohort is preloaded
+    index = DICOMIndex.find(args.input_dir)
     num_unloaded = 0
     for base_path, _, file_names in os.walk(args.input_dir):
         dicom_names = [f for f in file_names if f.endswith(DICOMReader.suffix)]
-        dicom_metadata = os.path.join(base_path, META_FILENAME)
-        if len(dicom_names) > 0 and not os.path.exists(dicom_metadata):
+        if len(dicom_names) > 0 and (index is None or index.numFiles(base_path) == 0):
             num_unloaded += 1
             print('Not preloaded: {}'.format(base_path))
     print('Total unloaded: {}'.format(num_unloaded))
@@ -0,0 +1,133 @@
+"""
+Script to render every slice of the DICOM series under a directory to 8-bit
+PNG or JPEG images, one folder per window preset, without a Qt application.
+
+Series are read from the series index if the directory has one (see
+scripts/preload_metadata.py), else found by scanning headers. Slices are
+rendered by a pool of worker processes, each decoding a slice once for all
+presets. Images that already exist are skipped, so an interrupted run can
+be resumed by running the same command again.
+"""
+
+import argparse
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from libs.constants import DICOM_AUTO_PRESET, DICOM_WINDOW_PRESETS
+from libs.dicom_index import listSeriesPaths
+from libs.dicom_io import DICOMReader, SCAN_CHUNK_SIZE
+
+IMAGE_FORMATS = {'png': 'PNG', 'jpg': 'JPEG'}
+
+
+def outputPath(output_dir, input_dir, dicom_path, preset_name, image_ext):
+    """Get the image path of a slice: `<output_dir>/<preset>/<path under input_dir>.<ext>`."""
+    rel_path = os.path.splitext(os.path.relpath(dicom_path, input_dir))[0]
+    return os.path.join(output_dir, preset_name.replace(' ', '_'), '{}.{}'.format(rel_path, image_ext))
+
+
+def renderSlices(tasks, image_ext, quality):
+    """Render slices to images. Runs in a worker process.
+
+    Args:
+        tasks: List of (dicom_path, [(window, image_path), ...]). A window is
+            (w_width, w_level), or None for the automatic window of the slice.
+        image_ext: Key of IMAGE_FORMATS.
+        quality: JPEG quality.
+
+    Returns:
+        Tuple (number of images written, list of (dicom_path, error message)).
+    """
+    num_written = 0
+    failures = []
+    for dicom_path, outputs in tasks:
+        try:
+            dicom_slice = DICOMReader.readSlice(dicom_path, use_cache=False)
+            for window, image_path in outputs:
+                w_width, w_level = window if window is not None else dicom_slice.autoWindow()
+                pixels = DICOMReader.renderSlice(dicom_slice, w_width, w_level)
+                os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                # Write then rename, so an interrupted run never leaves a partial image
+                tmp_path = '{}.{}.tmp'.format(image_path, os.getpid())
+                Image.fromarray(pixels).save(tmp_path, format=IMAGE_FORMATS[image_ext], quality=quality)
+                os.replace(tmp_path, image_path)
+                num_written += 1
+        except Exception as e:
+            failures.append((dicom_path, str(e)))
+
+    return num_written, failures
+
+
+def main(args):
+    presets = {}
+    for preset_name in args.presets:
+        if preset_name == DICOM_AUTO_PRESET:
+            presets[preset_name] = None
+        elif preset_name in DICOM_WINDOW_PRESETS:
+            presets[preset_name] = DICOM_WINDOW_PRESETS[preset_name]
+        else:
+            raise ValueError('Unknown preset {}, expected one of: {}'.format(
+                preset_name, ', '.join(list(DICOM_WINDOW_PRESETS) + [DICOM_AUTO_PRESET])))
+    output_dir = args.output_dir or os.path.join(args.input_dir, 'rendered')
+
+    print('Finding DICOM series under: {}'.format(args.input_dir))
+    tasks = []
+    num_skipped = 0
+    for series_paths in listSeriesPaths(args.input_dir, args.num_workers, use_processes=True):
+        for dicom_path in series_paths:
+            outputs = []
+            for preset_name, window in presets.items():
+                image_path = outputPath(output_dir, args.input_dir, dicom_path, preset_name, args.format)
+                if args.do_overwrite or not os.path.exists(image_path):
+                    outputs.append((window, image_path))
+                else:
+                    num_skipped += 1
+            if outputs:
+                tasks.append((dicom_path, outputs))
+    print('Rendering {} slices to: {} ({} images already rendered)'.format(len(tasks), output_dir, num_skipped))
+
+    start = time.time()
+    num_written = 0
+    failures = []
+    chunks = [tasks[i:i + SCAN_CHUNK_SIZE] for i in range(0, len(tasks), SCAN_CHUNK_SIZE)]
+    if args.num_workers > 0:
+        with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+            futures = [executor.submit(renderSlices, chunk, args.format, args.quality) for chunk in chunks]
+            results = (future.result() for future in futures)
+            for chunk_written, chunk_failures in results:
+                num_written += chunk_written
+                failures += chunk_failures
+    else:
+        for chunk in chunks:
+            chunk_written, chunk_failures = renderSlices(chunk, args.format, args.quality)
+            num_written += chunk_written
+            failures += chunk_failures
+    seconds = time.time() - start
+
+    for dicom_path, message in failures:
+        print('Failed to render {}: {}'.format(dicom_path, message))
+    num_slices = len(tasks) - len(failures)
+    print('Rendered {} slices ({} images) in {:.1f}s ({:.0f} slices/sec, {:.0f} images/sec), {} failed'.format(
+        num_slices, num_written, seconds, num_slices / max(seconds, 1e-9),
+        num_written / max(seconds, 1e-9), len(failures)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input_dir', type=str, required=True, help='Base directory of the DICOM series.')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Directory to write images to. Defaults to <input_dir>/rendered.')
+    parser.add_argument('--presets', type=str, nargs='+', default=[DICOM_AUTO_PRESET],
+                        help='Window presets to render: {} or {}.'.format(
+                            ', '.join(DICOM_WINDOW_PRESETS), DICOM_AUTO_PRESET))
+    parser.add_argument('--format', type=str, default='png', choices=sorted(IMAGE_FORMATS), help='Image format.')
+    parser.add_argument('--quality', type=int, default=95, help='JPEG quality.')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes. If 0, render in this process.')
+    parser.add_argument('--do_overwrite', action='store_true', help='Render images that already exist again.')
+
+    main(parser.parse_args())
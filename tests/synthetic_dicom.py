@@ -0,0 +1,66 @@
+"""Helpers for writing small synthetic DICOM files in tests."""
+import numpy as np
+
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+
+def writeSyntheticDICOM(path, pixels=None, rows=64, columns=64, series_number=1,
+                        instance_number=1, description='Synthetic',
+                        photometric='MONOCHROME2', slope=1, intercept=-1024,
+                        transfer_syntax=ExplicitVRLittleEndian, **extra):
+    """Write a single-frame greyscale DICOM file to `path`.
+
+    Args:
+        path: Destination file path.
+        pixels: Stored pixel values as an int16/uint16 array. Random if None.
+        rows, columns: Image size used when `pixels` is None.
+        series_number, instance_number, description: Series discovery fields.
+        photometric: PhotometricInterpretation to record.
+        slope, intercept: RescaleSlope and RescaleIntercept.
+        transfer_syntax: Transfer syntax UID of the file.
+        extra: Additional DICOM keywords to set on the dataset.
+
+    Returns:
+        The stored pixel array that was written.
+    """
+    if pixels is None:
+        rng = np.random.RandomState(instance_number)
+        pixels = rng.randint(0, 2500, size=(rows, columns)).astype(np.int16)
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = transfer_syntax
+
+    ds = FileDataset(path, {}, file_meta=file_meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = CT_IMAGE_STORAGE
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'CT'
+    ds.SeriesNumber = series_number
+    ds.InstanceNumber = instance_number
+    ds.SeriesDescription = description
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = photometric
+    ds.Rows, ds.Columns = pixels.shape
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1 if pixels.dtype.kind == 'i' else 0
+    ds.RescaleSlope = slope
+    ds.RescaleIntercept = intercept
+    for keyword, value in extra.items():
+        setattr(ds, keyword, value)
+    ds.PixelData = pixels.astype(pixels.dtype.newbyteorder('<')).tobytes()
+
+    try:
+        ds.save_as(path, enforce_file_format=True)
+    except TypeError:
+        # pydicom < 3.0
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(path, write_like_original=False)
+
+    return pixels
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from libs.annotation_loader import (
+    AnnotationFile, findAnnotationFiles, loadAnnotations, seriesAnnotationFiles, yoloClasses
+)
+from libs.constants import BBOX_DIR_NAME
+from libs.pascal_voc_io import PascalVocReader, PascalVocWriter
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestAnnotationLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # Series a: Pascal VOC boxes on slices 0 and 1, series b: YOLO boxes on slice 1
+        for series_dir, size, series_number in (('a', 16, 1), ('b', 24, 2)):
+            os.makedirs(os.path.join(self.tmp_dir, series_dir, BBOX_DIR_NAME))
+            for i in range(3):
+                writeSyntheticDICOM(os.path.join(self.tmp_dir, series_dir, '%d.dcm' % i),
+                                    rows=size, columns=size, series_number=series_number,
+                                    instance_number=i + 1)
+
+        self.bbox_a = os.path.join(self.tmp_dir, 'a', BBOX_DIR_NAME)
+        for i, boxes in ((0, [(1, 2, 5, 6, 'nodule', 0)]),
+                         (1, [(0, 0, 4, 4, 'vessel', 1), (8, 8, 15, 12, 'nodule', 0)])):
+            writer = PascalVocWriter('a', '%d.dcm' % i, (16, 16, 1))
+            for box in boxes:
+                writer.addBndBox(*box)
+            writer.save(os.path.join(self.bbox_a, '%d.xml' % i))
+
+        self.bbox_b = os.path.join(self.tmp_dir, 'b', BBOX_DIR_NAME)
+        with open(os.path.join(self.bbox_b, 'classes.txt'), 'w') as fh:
+            fh.write('nodule\nmass\n')
+        with open(os.path.join(self.bbox_b, '1.txt'), 'w') as fh:
+            fh.write('1 0.5 0.25 0.5 0.25\n0 0.1 0.1 0.2 0.2\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def rows(self, table):
+        return [(table.files[f].path, table.labels[c]) + tuple(int(v) for v in box) + (bool(d),)
+                for f, c, box, d in zip(table.file_ids, table.label_codes, table.boxes, table.difficult)]
+
+    def test_series(self):
+        files = seriesAnnotationFiles(self.tmp_dir)
+        self.assertEqual([os.path.relpath(f.path, self.tmp_dir) for f in files],
+                         ['a/bbox/0.xml', 'a/bbox/1.xml', 'b/bbox/1.txt'])
+        self.assertEqual(files[2].image_path, os.path.join(self.tmp_dir, 'b', '1.dcm'))
+
+        table = loadAnnotations(files)
+        self.assertEqual(table.failures, [])
+        self.assertEqual(table.labels, ['nodule', 'vessel', 'mass'])
+        self.assertEqual(table.boxes.shape, (5, 4))
+        self.assertEqual(table.file_ids.tolist(), [0, 1, 1, 2, 2])
+        # Same boxes as PascalVocReader, YOLO boxes converted to the 24x24 slices
+        expected = []
+        for f in files[:2]:
+            for label, points, _, _, difficult in PascalVocReader(f.path).getShapes():
+                xs, ys = [p[0] for p in points], [p[1] for p in points]
+                expected.append((f.path, label, min(xs), min(ys), max(xs), max(ys), difficult))
+        expected += [(files[2].path, 'mass', 6, 3, 18, 9, False), (files[2].path, 'nodule', 0, 0, 4, 4, False)]
+        self.assertEqual(self.rows(table), expected)
+
+    def test_save_dir(self):
+        # A Pascal VOC file wins over a YOLO file of the same image
+        with open(os.path.join(self.bbox_a, '1.txt'), 'w') as fh:
+            fh.write('0 0.5 0.5 0.5 0.5\n')
+        files = findAnnotationFiles(self.tmp_dir, image_size=(24, 24))
+        self.assertEqual([os.path.relpath(f.path, self.tmp_dir) for f in files],
+                         ['a/bbox/0.xml', 'a/bbox/1.xml', 'b/bbox/1.txt'])
+
+        # Without an image size, YOLO files fail and the others still load
+        table = loadAnnotations(findAnnotationFiles(self.tmp_dir))
+        self.assertEqual([path for path, _ in table.failures], [files[2].path])
+        self.assertEqual(len(table.boxes), 3)
+
+    def test_parallel(self):
+        files = seriesAnnotationFiles(self.tmp_dir)
+        serial = loadAnnotations(files)
+        for use_processes in (False, True):
+            table = loadAnnotations(files, num_workers=2, use_processes=use_processes)
+            self.assertEqual(self.rows(table), self.rows(serial))
+            self.assertEqual(table.labels, serial.labels)
+
+    def test_failures(self):
+        with open(os.path.join(self.bbox_a, '2.xml'), 'w') as fh:
+            fh.write('<annotation><object>')
+        files = seriesAnnotationFiles(self.tmp_dir)
+        files.append(AnnotationFile(os.path.join(self.bbox_a, 'missing.xml'), None, 16, 16))
+        table = loadAnnotations(files)
+        self.assertEqual([os.path.basename(path) for path, _ in table.failures], ['2.xml', 'missing.xml'])
+        self.assertEqual(len(table.boxes), 5)
+
+    def test_class_cache(self):
+        self.assertEqual(yoloClasses(self.bbox_b), ['nodule', 'mass'])
+        classes_path = os.path.join(self.bbox_b, 'classes.txt')
+        with open(classes_path, 'w') as fh:
+            fh.write('nodule\nvessel\ncyst\n')
+        # A changed classes.txt is read again
+        stamp = time.time() + 10
+        os.utime(classes_path, (stamp, stamp))
+        self.assertEqual(yoloClasses(self.bbox_b), ['nodule', 'vessel', 'cyst'])
+        self.assertIs(yoloClasses(self.bbox_b), yoloClasses(self.bbox_b))
+
+
+if __name__ == '__main__':
+    unittest.main()
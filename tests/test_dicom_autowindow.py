@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from libs.dicom_autowindow import PixelHistogram, autoWindow, sampleIndices, windowFromPercentiles
+from libs.dicom_io import DICOMReader
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestPixelHistogram(unittest.TestCase):
+
+    percentiles = [0, 0.5, 1, 5, 50, 95, 99, 99.5, 100]
+
+    def test_matches_np_percentile(self):
+        rng = np.random.RandomState(0)
+        for dtype in (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.int64):
+            low, high = (-1024, 3072) if np.dtype(dtype).itemsize > 1 else (0, 100)
+            if np.dtype(dtype).kind == 'i':
+                low = -high
+            for shape in ((1, 1), (7, 3), (64, 64)):
+                img = rng.randint(low, high, size=shape).astype(dtype)
+                histogram = PixelHistogram.fromPixels(img)
+                np.testing.assert_allclose(histogram.percentiles(self.percentiles),
+                                           np.percentile(img, self.percentiles))
+
+    def test_merge(self):
+        rng = np.random.RandomState(0)
+        images = [rng.randint(low, low + 500, size=(16, 16)).astype(np.int16)
+                  for low in (-1024, 0, 2000)]
+        merged = PixelHistogram.merge([PixelHistogram.fromPixels(img) for img in images])
+        np.testing.assert_allclose(merged.percentiles([1, 50, 99]),
+                                   np.percentile(np.stack(images), [1, 50, 99]))
+
+    def test_sample_indices(self):
+        self.assertEqual(sampleIndices(100, 5), [0, 25, 50, 74, 99])
+        self.assertEqual(sampleIndices(3, 16), [0, 1, 2])
+        self.assertEqual(sampleIndices(1, 16), [0])
+        self.assertEqual(sampleIndices(0, 16), [])
+
+    def test_unsupported(self):
+        self.assertIsNone(PixelHistogram.fromPixels(np.zeros((4, 4), dtype=np.float32)))
+        self.assertIsNone(PixelHistogram.fromPixels(np.array([0, 1 << 30], dtype=np.int32)))
+
+        img = np.linspace(-1000, 1000, 100).astype(np.float32)
+        expected = windowFromPercentiles(*np.percentile(img, (1, 99)))
+        self.assertEqual(autoWindow(img), expected)
+
+    def test_auto_window(self):
+        img = np.arange(-1024, 3072, dtype=np.int16).reshape(64, 64)
+        p1, p99 = np.percentile(img, (1, 99))
+        self.assertEqual(autoWindow(img), windowFromPercentiles(p1, p99))
+        self.assertEqual(autoWindow(img, (0, 100)), (4095, 1023))
+        # Constant images still get a window of at least 1
+        self.assertEqual(autoWindow(np.full((8, 8), 40, dtype=np.int16)), (1, 40))
+
+
+class TestSeriesAutoWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths, self.images = [], []
+        for i in range(9):
+            path = os.path.join(self.tmp_dir, '%d.dcm' % i)
+            pixels = np.random.RandomState(i).randint(0, 200 * (i + 1), size=(16, 16))
+            self.images.append(writeSyntheticDICOM(path, pixels=pixels.astype(np.int16),
+                                                   instance_number=i + 1))
+            self.paths.append(path)
+        DICOMReader.sliceCache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_merged_samples(self):
+        # Slices 0, 4 and 8, in Hounsfield Units
+        sampled = np.stack([self.images[i] for i in (0, 4, 8)]) - 1024
+        expected = windowFromPercentiles(*np.percentile(sampled, (1, 99)))
+        self.assertEqual(DICOMReader.seriesAutoWindow(self.paths, num_samples=3), expected)
+        # Sampled slices are not added to the cache
+        self.assertEqual(len(DICOMReader.sliceCache), 0)
+
+        os.remove(self.paths[4])
+        self.assertIsNotNone(DICOMReader.seriesAutoWindow(self.paths, num_samples=3))
+        self.assertIsNone(DICOMReader.seriesAutoWindow(self.paths[4:5]))
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        with mock.patch.object(DICOMReader, 'readSlice') as read_slice:
+            self.assertIsNone(DICOMReader.seriesAutoWindow(self.paths, num_samples=3, cancel=cancel))
+        read_slice.assert_not_called()
+
+
+class TestSliceHistogram(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'slice.dcm')
+        writeSyntheticDICOM(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_histogram_kept_with_slice(self):
+        dicom_slice = DICOMReader.readSlice(self.path, use_cache=False)
+        with mock.patch.object(PixelHistogram, 'fromPixels',
+                               wraps=PixelHistogram.fromPixels) as histogram_mock:
+            first = dicom_slice.autoWindow()
+            self.assertEqual(dicom_slice.autoWindow(), first)
+            dicom_slice.autoWindow((5, 95))
+        self.assertEqual(histogram_mock.call_count, 1)
+        self.assertEqual(first, DICOMReader.autoWindow(dicom_slice.pixels))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from libs.constants import INDEX_FILENAME
+from libs.dicom_index import INDEX_SCHEMA_VERSION, DICOMIndex
+from libs.dicom_io import DICOMReader
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestDICOMIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        layout = (('1001/a', '1001', 1, 16), ('1001/b', '1001', 2, 16), ('1002/c', '1002', 2, 24))
+        for sub_dir, accession, series_number, size in layout:
+            os.makedirs(os.path.join(self.tmp_dir, sub_dir))
+            for i in range(6):
+                writeSyntheticDICOM(os.path.join(self.tmp_dir, sub_dir, '%d.dcm' % i),
+                                    rows=size, columns=size, series_number=series_number,
+                                    instance_number=6 - i, description='Series %s' % sub_dir,
+                                    AccessionNumber=accession, StudyInstanceUID='1.2.3.' + accession,
+                                    SeriesInstanceUID='1.2.3.%s.%d' % (accession, series_number))
+        # Same instance as 1001/a/0.dcm: the first path must win, as in scanAllDICOMs
+        writeSyntheticDICOM(os.path.join(self.tmp_dir, '1001', 'a', 'dup.dcm'), rows=16, columns=16,
+                            series_number=1, instance_number=6, description='Series 1001/a',
+                            AccessionNumber='1001', StudyInstanceUID='1.2.3.1001',
+                            SeriesInstanceUID='1.2.3.1001.1')
+        with open(os.path.join(self.tmp_dir, '1001', 'a', 'broken.dcm'), 'wb') as fh:
+            fh.write(b'not a dicom')
+
+        self.index = DICOMIndex(self.tmp_dir)
+        self.built = self.index.build()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def summarize(series_infos):
+        return [(s.series_num, s.height, s.width, s.description, len(s), tuple(s.sorted_paths()))
+                for s in series_infos]
+
+    def test_matches_scan(self):
+        # Unreadable files are left out of the index; scanAllDICOMs would raise on them
+        self.assertEqual((self.built.added, self.built.unreadable), (20, 1))
+        os.remove(os.path.join(self.tmp_dir, '1001', 'a', 'broken.dcm'))
+        for sub_dir in ('', '1001', '1001/a', '1002'):
+            dirpath = os.path.join(self.tmp_dir, sub_dir)
+            expected = self.summarize(DICOMReader.scanAllDICOMs(dirpath, check_preloaded=False))
+            self.assertEqual(self.summarize(self.index.seriesInfos(dirpath)), expected)
+
+    def test_lookups(self):
+        self.assertEqual([s.series_num for s in self.index.seriesByAccession('1001')], [1, 2])
+        self.assertEqual([s.series_num for s in self.index.seriesByAccession('1002')], [2])
+        series_info, = self.index.seriesByUID('1.2.3.1002.2')
+        self.assertEqual((series_info.height, series_info.accession), (24, '1002'))
+        self.assertEqual(self.index.numFiles(os.path.join(self.tmp_dir, '1001')), 13)
+        self.assertEqual(self.index.seriesByAccession('9999'), [])
+
+    def test_update(self):
+        from libs import dicom_index
+        a_dir = os.path.join(self.tmp_dir, '1001', 'a')
+        os.remove(os.path.join(a_dir, 'broken.dcm'))
+        os.remove(os.path.join(a_dir, 'dup.dcm'))
+        shutil.rmtree(os.path.join(self.tmp_dir, '1002'))
+        writeSyntheticDICOM(os.path.join(a_dir, '6.dcm'), rows=16, columns=16, series_number=1,
+                            instance_number=7, AccessionNumber='1001',
+                            StudyInstanceUID='1.2.3.1001')
+        # Rewrite with another size, so the change does not depend on mtime resolution
+        writeSyntheticDICOM(os.path.join(a_dir, '0.dcm'), rows=32, columns=32, series_number=1,
+                            instance_number=6, AccessionNumber='1001',
+                            StudyInstanceUID='1.2.3.1001')
+
+        with mock.patch.object(dicom_index, '_readIndexRecord',
+                               wraps=dicom_index._readIndexRecord) as read_mock:
+            result = self.index.update()
+        self.assertEqual(result[:5], (1, 1, 7, 11, 0))
+        self.assertEqual(sorted(os.path.basename(c[0][0]) for c in read_mock.call_args_list),
+                         ['0.dcm', '6.dcm'])
+
+        expected = self.summarize(DICOMReader.scanAllDICOMs(self.tmp_dir, check_preloaded=False))
+        self.assertEqual(self.summarize(self.index.seriesInfos()), expected)
+        self.assertEqual(self.index.seriesByAccession('1002'), [])
+
+        result = self.index.update()
+        self.assertEqual(result[:5], (0, 0, 0, 13, 0))
+
+    def test_series_window(self):
+        series_a, series_b = self.index.seriesByAccession('1001')
+        self.assertIsNone(series_a.autoWindow((1, 99)))
+        series_a.setAutoWindow((1, 99), 400, 40)
+        series_b.setAutoWindow((1, 99), 1500, -600)
+        self.assertEqual(self.index.seriesInfos()[0].autoWindow((1, 99)), (400, 40))
+        self.assertIsNone(series_a.autoWindow((5, 95)))
+
+        # Changing a file of a series drops its window only
+        writeSyntheticDICOM(os.path.join(self.tmp_dir, '1001', 'a', '6.dcm'), rows=16, columns=16,
+                            series_number=1, instance_number=7, AccessionNumber='1001',
+                            StudyInstanceUID='1.2.3.1001')
+        self.index.update()
+        self.assertIsNone(series_a.autoWindow((1, 99)))
+        self.assertEqual(series_b.autoWindow((1, 99)), (1500, -600))
+
+    def test_load_slice(self):
+        import pydicom
+        path = os.path.join(self.tmp_dir, '1001', 'b', '3.dcm')
+        expected = DICOMReader.readSlice(path, use_cache=False)
+        with mock.patch.object(pydicom, 'dcmread', side_effect=AssertionError('header parsed')):
+            dicom_slice = self.index.loadSlice(path)
+        np.testing.assert_array_equal(dicom_slice.pixels, expected.pixels)
+        self.assertEqual(dicom_slice.pixels.dtype, expected.pixels.dtype)
+        self.assertEqual(dicom_slice.photometric, expected.photometric)
+
+        # Through the reader, as loadFile does
+        DICOMReader.sliceSource = self.index
+        try:
+            with mock.patch.object(self.index, 'loadSlice',
+                                   wraps=self.index.loadSlice) as load_mock:
+                dicom_slice = DICOMReader.readSlice(path, use_cache=False)
+        finally:
+            DICOMReader.sliceSource = None
+        load_mock.assert_called_once_with(path)
+        np.testing.assert_array_equal(dicom_slice.pixels, expected.pixels)
+
+        # Changed and unindexed files fall back to parsing
+        writeSyntheticDICOM(path, rows=16, columns=16, series_number=2, instance_number=3,
+                            intercept=0, AccessionNumber='1001', StudyInstanceUID='1.2.3.1001')
+        os.utime(path, ns=(0, 0))
+        self.assertIsNone(self.index.loadSlice(path))
+        self.assertIsNone(self.index.loadSlice(os.path.join(self.tmp_dir, 'missing.dcm')))
+
+        # A loader still running when the index is closed falls back to parsing
+        self.index.close()
+        self.assertIsNone(self.index.loadSlice(os.path.join(self.tmp_dir, '1001', 'b', '4.dcm')))
+
+    def test_pixel_offsets(self):
+        from libs.dicom_index import _readIndexRecord
+        path = os.path.join(self.tmp_dir, '1002', 'c', '0.dcm')
+        record = _readIndexRecord(path)
+        self.assertEqual(record['pixel_length'], 24 * 24 * 2)
+        self.assertEqual(record['pixel_offset'], os.path.getsize(path) - 24 * 24 * 2)
+        self.assertEqual(record['pixel_format'], ('<i2', 16))
+        self.assertEqual((record['slope'], record['intercept']), (1.0, -1024.0))
+
+        # Pixel data that is not last cannot be located from the end of the file
+        dcm = DICOMReader.readRawDICOM(path)
+        dcm.add_new(0xFFFCFFFC, 'OB', b'\0' * 16)
+        dcm.save_as(path)
+        self.assertIsNone(_readIndexRecord(path)['pixel_offset'])
+
+    def test_find(self):
+        self.index.close()
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, INDEX_FILENAME)))
+
+        self.index = DICOMIndex.find(os.path.join(self.tmp_dir, '1002', 'c'))
+        self.assertEqual(self.index.root, os.path.abspath(self.tmp_dir))
+        self.assertEqual(len(self.index.seriesInfos()), 3)
+
+        empty_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(DICOMIndex.find(empty_dir))
+        finally:
+            shutil.rmtree(empty_dir)
+
+    def test_read_only(self):
+        self.index.close()
+        connect = sqlite3.connect
+
+        def connectReadOnly(path, **kwargs):
+            return connect('file:{}?mode=ro'.format(path), uri=True, **kwargs)
+        with mock.patch('sqlite3.connect', side_effect=connectReadOnly):
+            self.index = DICOMIndex.find(self.tmp_dir)
+        self.assertEqual(len(self.index.seriesInfos()), 3)
+
+        # The window is kept with the series when it cannot be stored
+        series_info = self.index.seriesInfos()[0]
+        self.assertFalse(self.index.setSeriesWindow(series_info.series_id, (1, 99), 400, 40))
+        series_info.setAutoWindow((1, 99), 400, 40)
+        self.assertEqual(series_info.autoWindow((1, 99)), (400, 40))
+
+    def test_other_version(self):
+        num_files = self.index.numFiles()
+        self.index.close()
+        index_path = os.path.join(self.tmp_dir, INDEX_FILENAME)
+        with sqlite3.connect(index_path) as conn:
+            conn.execute('PRAGMA user_version = %d' % (INDEX_SCHEMA_VERSION + 1))
+
+        # Skipped, not wiped: an index of a newer version is left as it is
+        self.assertIsNone(DICOMIndex.find(self.tmp_dir))
+        with sqlite3.connect(index_path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM files').fetchone()[0], num_files)
+
+        self.index = DICOMIndex(self.tmp_dir)
+        self.assertEqual(self.index.build().added, 20)
+        self.assertEqual(self.index.version, INDEX_SCHEMA_VERSION)
+        self.index.close()
+        self.index = DICOMIndex.find(self.tmp_dir)
+        self.assertEqual(len(self.index.seriesInfos()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,396 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pydicom
+
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless
+
+from libs.dicom_io import DICOMReader, DICOMSeriesInfo, DICOMSliceCache, HEADER_PROBE_BYTES
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestDICOMSlice(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'slice.dcm')
+        self.stored = writeSyntheticDICOM(self.path, photometric='MONOCHROME1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_slice(self):
+        dicom_slice = DICOMReader.readSlice(self.path)
+        expected = DICOMReader._dicomToRaw(DICOMReader.readRawDICOM(self.path))
+
+        np.testing.assert_array_equal(dicom_slice.pixels, expected)
+        self.assertEqual(dicom_slice.photometric, 'MONOCHROME1')
+        self.assertEqual((dicom_slice.height, dicom_slice.width), self.stored.shape)
+        self.assertNotIn('PixelData', dicom_slice.dcm)
+        self.assertEqual(int(dicom_slice.dcm.SeriesNumber), 1)
+
+    def test_dicom_to_raw_keeps_dataset(self):
+        # pydicom caches pixel_array: converting twice must give the same pixels
+        dcm = DICOMReader.readRawDICOM(self.path)
+        first = DICOMReader._dicomToRaw(dcm)
+        np.testing.assert_array_equal(DICOMReader._dicomToRaw(dcm), first)
+        self.assertFalse(np.shares_memory(first, dcm.pixel_array))
+
+    def test_auto_window(self):
+        pixels = DICOMReader.readSlice(self.path).pixels
+        p1, p99 = np.percentile(pixels, 1), np.percentile(pixels, 99)
+
+        w_width, w_level = DICOMReader.autoWindow(pixels)
+        self.assertEqual(w_width, int(p99 - p1))
+        self.assertEqual(w_level, int((p1 + p99) / 2))
+
+    def test_render_slice(self):
+        dicom_slice = DICOMReader.readSlice(self.path)
+        rendered = DICOMReader.renderSlice(dicom_slice, 400, 40)
+        q_image = DICOMReader.sliceToQImage(dicom_slice, 400, 40)
+
+        self.assertEqual(rendered.dtype, np.uint8)
+        # MONOCHROME1 is inverted by default
+        np.testing.assert_array_equal(rendered, DICOMReader._applyWindow(dicom_slice.pixels, 40, 400, True))
+        np.testing.assert_array_equal(rendered, q_image.ndarray)
+        self.assertFalse(np.array_equal(rendered, DICOMReader.renderSlice(dicom_slice, 400, 40, False)))
+
+
+class TestPixelView(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'slice.dcm')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertMatchesPydicom(self, expect_view=True):
+        with open(self.path, 'rb') as fh:
+            header = pydicom.dcmread(fh, stop_before_pixels=True)
+            layout = DICOMReader.locatePixelData(header, fh)
+        self.assertEqual(layout is not None, expect_view)
+
+        expected = DICOMReader._dicomToRaw(DICOMReader.readRawDICOM(self.path))
+        if expect_view:
+            # Pixels come straight from the file, without pydicom decoding them
+            with mock.patch.object(pydicom.Dataset, 'pixel_array', new_callable=mock.PropertyMock,
+                                   side_effect=AssertionError('pixel_array decoded')):
+                actual = DICOMReader.readSlice(self.path, use_cache=False).pixels
+        else:
+            actual = DICOMReader.readSlice(self.path, use_cache=False).pixels
+        self.assertEqual(type(actual), np.ndarray)
+        self.assertEqual(actual.dtype, expected.dtype)
+        np.testing.assert_array_equal(actual, expected)
+
+    def test_native_syntaxes(self):
+        rng = np.random.RandomState(0)
+        signed = rng.randint(-2048, 2048, size=(32, 48)).astype(np.int16)
+        unsigned = rng.randint(0, 65536, size=(32, 48)).astype(np.uint16)
+        for transfer_syntax in (ExplicitVRLittleEndian, ImplicitVRLittleEndian):
+            writeSyntheticDICOM(self.path, pixels=signed, transfer_syntax=transfer_syntax)
+            self.assertMatchesPydicom()
+            # Unused high bits are masked or sign-extended as pydicom does
+            for pixels in (signed, unsigned):
+                writeSyntheticDICOM(self.path, pixels=pixels, transfer_syntax=transfer_syntax,
+                                    BitsStored=12, HighBit=11)
+                self.assertMatchesPydicom()
+
+    def test_view_layout(self):
+        pixels = writeSyntheticDICOM(self.path, rows=8, columns=12)
+        with open(self.path, 'rb') as fh:
+            layout = DICOMReader.locatePixelData(pydicom.dcmread(fh, stop_before_pixels=True), fh)
+        self.assertEqual(layout.offset, os.path.getsize(self.path) - pixels.nbytes)
+        view = DICOMReader.pixelView(self.path, layout)
+        self.assertIsInstance(view, np.memmap)
+        self.assertFalse(view.flags.writeable)
+        np.testing.assert_array_equal(view, pixels)
+
+    def test_compressed_falls_back(self):
+        writeSyntheticDICOM(self.path, rows=16, columns=16)
+        dcm = pydicom.dcmread(self.path)
+        try:
+            dcm.compress(RLELossless)
+        except Exception as e:
+            self.skipTest('RLE encoding unavailable: %s' % e)
+        dcm.save_as(self.path)
+        self.assertMatchesPydicom(expect_view=False)
+
+
+class TestDICOMSliceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.tmp_dir, '%d.dcm' % i) for i in range(3)]
+        for i, path in enumerate(self.paths):
+            writeSyntheticDICOM(path, instance_number=i + 1)
+        # Each 64x64 int16 slice is 8 KiB; budget for two of them
+        self.cache = DICOMSliceCache(budget_mb=2 * 64 * 64 * 2 / (1024 * 1024))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_miss_evict(self):
+        with mock.patch.object(DICOMReader, 'sliceCache', self.cache):
+            first = DICOMReader.readSlice(self.paths[0])
+            self.assertIs(DICOMReader.readSlice(self.paths[0]), first)
+            DICOMReader.readSlice(self.paths[1])
+            DICOMReader.readSlice(self.paths[2])
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+        self.assertEqual(stats['size'], 2)
+        self.assertLessEqual(stats['nbytes'], stats['budget_bytes'])
+        self.assertIsNone(self.cache.get(self.cache.key(self.paths[0])))
+
+    def test_changed_file_is_decoded_again(self):
+        with mock.patch.object(DICOMReader, 'sliceCache', self.cache):
+            first = DICOMReader.readSlice(self.paths[0])
+            st = os.stat(self.paths[0])
+            os.utime(self.paths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            second = DICOMReader.readSlice(self.paths[0])
+
+        self.assertIsNot(first, second)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.nbytes, second.nbytes)
+
+
+class CountingFile(object):
+    """File wrapper that counts the bytes read through it."""
+
+    def __init__(self, fh, counter):
+        self.fh = fh
+        self.counter = counter
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.counter.append(len(data))
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fh.close()
+
+    def __getattr__(self, name):
+        return getattr(self.fh, name)
+
+
+class TestProbeHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'slice.dcm')
+        writeSyntheticDICOM(self.path, rows=256, columns=128, series_number=7,
+                            instance_number=3, description='Probe me',
+                            photometric='MONOCHROME1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_counted(self, read_fn):
+        import libs.dicom_io as dicom_io
+        counter = []
+
+        def counting_open(*args, **kwargs):
+            return CountingFile(open(*args, **kwargs), counter)
+
+        with mock.patch.object(dicom_io, 'open', create=True, side_effect=counting_open):
+            dcm = read_fn()
+        return dcm, sum(counter)
+
+    def test_probe_matches_full_header(self):
+        full = DICOMReader.readRawDICOM(self.path, stop_before_pixels=True)
+        for prefix_bytes in (HEADER_PROBE_BYTES, 64):
+            probe = DICOMReader.probeHeader(self.path, prefix_bytes=prefix_bytes)
+            for keyword in ('SeriesNumber', 'InstanceNumber', 'SeriesDescription',
+                            'PhotometricInterpretation', 'Rows', 'Columns'):
+                self.assertEqual(probe.get(keyword), full.get(keyword))
+            self.assertNotIn('SOPInstanceUID', probe)
+        self.assertEqual(DICOMReader.getPhotometricInterpretation(self.path), 'MONOCHROME1')
+
+    def test_probe_skips_private_data(self):
+        # A large vendor header after the discovery tags, as in Siemens CSA headers
+        dcm = DICOMReader.readRawDICOM(self.path)
+        block = dcm.private_block(0x0029, 'SIEMENS CSA HEADER', create=True)
+        block.add_new(0x10, 'OB', b'\0' * 65536)
+        dcm.save_as(self.path)
+
+        _, full_bytes = self.read_counted(
+            lambda: DICOMReader.readRawDICOM(self.path, stop_before_pixels=True))
+        probe, probe_bytes = self.read_counted(lambda: DICOMReader.probeHeader(self.path))
+        self.assertEqual(int(probe.Rows), 256)
+        self.assertLessEqual(probe_bytes, HEADER_PROBE_BYTES)
+        self.assertGreater(full_bytes, 65536)
+
+
+class TestScanAllDICOMs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for sub_dir, series_number, size in (('a', 1, 16), ('b', 2, 16), ('c/d', 2, 24)):
+            os.makedirs(os.path.join(self.tmp_dir, sub_dir))
+            for i in range(6):
+                writeSyntheticDICOM(os.path.join(self.tmp_dir, sub_dir, '%d.dcm' % i),
+                                    rows=size, columns=size, series_number=series_number,
+                                    instance_number=6 - i, description='Series %s' % sub_dir)
+        # Same instance as a/0.dcm: the file visited first must win every time
+        writeSyntheticDICOM(os.path.join(self.tmp_dir, 'a', 'dup.dcm'), rows=16, columns=16,
+                            series_number=1, instance_number=6)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def summarize(series_infos):
+        return [(s.series_num, s.height, s.width, s.description, len(s), tuple(s.sorted_paths()))
+                for s in series_infos]
+
+    def test_parallel_matches_serial(self):
+        serial = self.summarize(DICOMReader.scanAllDICOMs(self.tmp_dir, check_preloaded=False))
+        self.assertEqual([s[:5] for s in serial],
+                         [(1, 16, 16, 'Series a', 6), (2, 16, 16, 'Series b', 6),
+                          (2, 24, 24, 'Series c/d', 6)])
+        self.assertNotIn(os.path.join(self.tmp_dir, 'a', 'dup.dcm'), serial[0][5])
+
+        for use_processes in (False, True):
+            parallel = DICOMReader.scanAllDICOMs(self.tmp_dir, check_preloaded=False,
+                                                 num_workers=3, use_processes=use_processes)
+            self.assertEqual(self.summarize(parallel), serial)
+
+
+class TestMainWindowDICOMLoad(unittest.TestCase):
+
+    def setUp(self):
+        from labelImg import get_main_app
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'slice.dcm')
+        writeSyntheticDICOM(self.path)
+        DICOMReader.sliceCache.clear()
+        self.app, self.win = get_main_app()
+
+    def tearDown(self):
+        self.win.close()
+        self.app.quit()
+        shutil.rmtree(self.tmp_dir)
+
+    def waitForLoad(self, timeout=10):
+        """Process events until the background slice load has been shown."""
+        import time
+        deadline = time.time() + timeout
+        while self.win.dicomLoader.pendingPath() is not None and time.time() < deadline:
+            self.app.processEvents()
+            time.sleep(0.005)
+        self.app.processEvents()
+
+    def loadFile(self, path):
+        self.assertTrue(self.win.loadFile(path))
+        self.waitForLoad()
+        self.assertEqual(self.win.filePath, path)
+
+    def test_load_file_parses_and_decodes_once(self):
+        import pydicom
+        with mock.patch.object(pydicom, 'dcmread', wraps=pydicom.dcmread) as dcmread_mock, \
+                mock.patch.object(DICOMReader, '_dicomToRaw',
+                                  wraps=DICOMReader._dicomToRaw) as decode_mock:
+            self.loadFile(self.path)
+
+        # One header parse and one pixel decode, however the file is opened for them
+        self.assertEqual(dcmread_mock.call_count, 1)
+        self.assertEqual(decode_mock.call_count, 1)
+        self.assertFalse(self.win.image.isNull())
+
+    def test_window_changes_skip_decode(self):
+        self.loadFile(self.path)
+        with mock.patch.object(DICOMReader, '_dicomToRaw') as decode_mock:
+            self.win.onDialogWindowLevelChanged(400, 40)
+            self.win.autoAdjustDicomWindow()
+        decode_mock.assert_not_called()
+
+    def test_series_window(self):
+        import time
+        other_path = os.path.join(self.tmp_dir, 'other.dcm')
+        writeSyntheticDICOM(other_path, pixels=np.full((64, 64), 3000, dtype=np.int16),
+                            instance_number=2)
+        series = DICOMSeriesInfo(1, 64, 64, 'Synthetic')
+        series.add_dicom(1, self.path)
+        series.add_dicom(2, other_path)
+        self.win.mImgList = series.sorted_paths()
+        self.win.dicomSeries = series
+        self.win.seriesWindowLevelOption.setChecked(True)
+        self.win.startSeriesAutoWindow()
+
+        deadline = time.time() + 10
+        while self.win.dicomSeriesWindow is None and time.time() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        expected = DICOMReader.seriesAutoWindow(series.sorted_paths())
+        self.assertEqual(self.win.dicomSeriesWindow, expected)
+        self.assertEqual(series.autoWindow(self.win.dicomAutoPercentiles), expected)
+
+        # Every slice of the series is shown with the series window
+        for path in series.sorted_paths():
+            self.loadFile(path)
+            self.assertEqual((self.win.dicomWindowWidth, self.win.dicomWindowLevel), expected)
+
+    def test_latest_load_wins(self):
+        paths = [self.path]
+        for i in range(1, 6):
+            paths.append(os.path.join(self.tmp_dir, 'slice%d.dcm' % i))
+            writeSyntheticDICOM(paths[-1], instance_number=i + 1)
+        self.win.mImgList = paths
+        shown = []
+        self.win.dicomLoader.sliceLoaded.connect(lambda result: shown.append(result.path))
+
+        # Navigation steps from the slice being loaded, not the one shown
+        self.win.filePath = None
+        for _ in range(4):
+            self.win.openNextImg()
+        self.assertEqual(self.win.dicomLoader.pendingPath(), paths[3])
+        self.waitForLoad()
+        self.assertEqual((self.win.filePath, shown), (paths[3], [paths[3]]))
+
+        # The shown image is replaced only when the latest request arrives
+        image = self.win.image
+        for path in paths[4:] + paths[:2]:
+            self.assertTrue(self.win.loadFile(path))
+        self.assertIs(self.win.image, image)
+        self.waitForLoad()
+        self.assertEqual((self.win.filePath, shown[-1]), (paths[1], paths[1]))
+        self.assertEqual(len(shown), 2)
+
+    def test_load_failure_keeps_image(self):
+        self.loadFile(self.path)
+        broken = os.path.join(self.tmp_dir, 'broken.dcm')
+        with open(broken, 'wb') as fh:
+            fh.write(b'not a dicom')
+        with mock.patch.object(self.win, 'errorMessage') as error_mock:
+            self.assertTrue(self.win.loadFile(broken))
+            self.waitForLoad()
+        error_mock.assert_called_once()
+        self.assertEqual(self.win.filePath, self.path)
+        self.assertTrue(self.win.canvas.isEnabled())
+
+    def test_window_ticks_coalesced(self):
+        self.loadFile(self.path)
+        scheduler = self.win.dicomRenderScheduler
+        with mock.patch.object(self.win, 'reloadCurrentDicomImage',
+                               wraps=self.win.reloadCurrentDicomImage) as reload_mock:
+            for width in range(100, 150):
+                self.win.windowLevelDialog.windowLevelChanged.emit(width, 40)
+            reload_mock.assert_not_called()
+            self.assertTrue(scheduler.isPending())
+            while scheduler.isPending():
+                self.app.processEvents()
+        reload_mock.assert_called_once()
+        self.assertEqual((scheduler.renders, scheduler.dropped), (1, 49))
+        self.assertEqual((self.win.dicomWindowWidth, self.win.dicomWindowLevel), (149, 40))
+
+
+if __name__ == '__main__':
+    unittest.main()
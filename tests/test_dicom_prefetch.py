@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from libs.dicom_io import DICOMReader, DICOMSliceCache
+from libs.dicom_prefetch import DICOMPrefetcher
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestDICOMPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.tmp_dir, '%02d.dcm' % i) for i in range(10)]
+        for i, path in enumerate(self.paths):
+            writeSyntheticDICOM(path, rows=16, columns=16, instance_number=i + 1)
+        self.cache = DICOMSliceCache()
+        self.cache_patch = mock.patch.object(DICOMReader, 'sliceCache', self.cache)
+        self.cache_patch.start()
+        self.prefetcher = DICOMPrefetcher(num_ahead=3)
+
+    def tearDown(self):
+        self.prefetcher.shutdown()
+        self.cache_patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def cached(self):
+        return [i for i, p in enumerate(self.paths) if self.cache.key(p) in self.cache]
+
+    def test_follows_direction(self):
+        self.prefetcher.update(self.paths, 0)
+        self.prefetcher.wait()
+        self.assertEqual(self.cached(), [1, 2, 3])
+
+        self.cache.clear()
+        self.prefetcher.update(self.paths, 6)
+        self.prefetcher.wait()
+        self.assertEqual(self.cached(), [5, 7, 8, 9])
+
+        self.cache.clear()
+        self.prefetcher.update(self.paths, 5)
+        self.prefetcher.wait()
+        self.assertEqual(self.cached(), [2, 3, 4, 6])
+
+    def test_jump_cancels_queued_work(self):
+        release = threading.Event()
+        first_started = threading.Event()
+        started = []
+
+        def slowRead(path, use_cache=True):
+            started.append(path)
+            first_started.set()
+            release.wait(5)
+
+        prefetcher = DICOMPrefetcher(num_ahead=3, num_workers=1)
+        with mock.patch.object(DICOMReader, 'readSlice', side_effect=slowRead):
+            prefetcher.update(self.paths, 0)
+            first_started.wait(5)
+            prefetcher.update(self.paths, 8)
+            release.set()
+            prefetcher.wait()
+        prefetcher.shutdown()
+
+        # Only the slice already being decoded before the jump was read
+        self.assertEqual(started[0], self.paths[1])
+        self.assertNotIn(self.paths[2], started)
+        self.assertNotIn(self.paths[3], started)
+        self.assertIn(self.paths[9], started)
+
+    def test_wait_for_avoids_double_decode(self):
+        with mock.patch.object(DICOMReader, '_dicomToRaw',
+                               wraps=DICOMReader._dicomToRaw) as decode_mock:
+            self.prefetcher.update(self.paths, 0)
+            self.prefetcher.waitFor(self.paths[1])
+            DICOMReader.readSlice(self.paths[1])
+            self.prefetcher.wait()
+        # Slices 1-3 ahead are each decoded once, whoever gets there first
+        self.assertEqual(decode_mock.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
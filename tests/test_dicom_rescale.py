@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from libs.dicom_io import DICOMReader
+from libs.dicom_rescale import PADDING_VALUE, rescaleDtype, rescaleToHU, storedRange
+from synthetic_dicom import writeSyntheticDICOM
+
+
+def legacyDicomToRaw(stored, slope, intercept, dtype=np.int16):
+    """Previous DICOMReader._dicomToRaw, as the reference for in-range data."""
+    img_np = stored.astype(dtype)
+    img_np[img_np == -2000] = 0
+    if slope != 1:
+        img_np = slope * img_np.astype(np.float64)
+        img_np = img_np.astype(dtype)
+    img_np += int(intercept)
+    return img_np.astype(np.int16)
+
+
+class TestRescaleToHU(unittest.TestCase):
+
+    rescales = [(1, -1024), (1, 0), (1, -1024.7), (0.5, -1000), (2, -1024), (-1.5, 3), (1.25, 1.9)]
+
+    def test_matches_legacy(self):
+        rng = np.random.RandomState(0)
+        for trial in range(200):
+            slope, intercept = self.rescales[trial % len(self.rescales)]
+            dtype = (np.int16, np.uint16)[trial % 2]
+            # Stay where the legacy int16 arithmetic did not overflow
+            high = int(min(32767, 30000 / abs(slope)))
+            low = 0 if dtype == np.uint16 else -high
+            stored = rng.randint(low, high, size=rng.randint(1, 40, size=2)).astype(dtype)
+            if dtype == np.int16:
+                stored.flat[rng.randint(0, stored.size, size=3)] = PADDING_VALUE
+
+            expected = legacyDicomToRaw(stored, slope, intercept)
+            actual = rescaleToHU(stored.copy(), slope, intercept)
+            self.assertEqual(actual.dtype, np.int16)
+            np.testing.assert_array_equal(actual, expected)
+
+    def test_in_place(self):
+        stored = np.array([[PADDING_VALUE, 0], [100, 2000]], dtype=np.int16)
+        out = rescaleToHU(stored, 1, -1024)
+        self.assertIs(out, stored)
+        np.testing.assert_array_equal(out, [[-1024, -1024], [-924, 976]])
+
+        stored = np.array([100, 2000], dtype=np.int16)
+        out = rescaleToHU(stored, 1, -1024, reuse=False)
+        self.assertIsNot(out, stored)
+        np.testing.assert_array_equal(stored, [100, 2000])
+
+        read_only = np.arange(4, dtype=np.int16)
+        read_only.flags.writeable = False
+        self.assertIsNot(rescaleToHU(read_only, 1, 0), read_only)
+
+    def test_unsigned_above_int16(self):
+        stored = np.array([0, 32767, 40000, 65535], dtype=np.uint16)
+        out = rescaleToHU(stored, 1, -1024)
+        self.assertEqual(out.dtype, np.int32)
+        np.testing.assert_array_equal(out, [-1024, 31743, 38976, 64511])
+
+        # Unsigned 16-bit data that fits int16 after rescale stays int16, no padding applied
+        stored = np.array([0, 4095, 63536], dtype=np.uint16)
+        np.testing.assert_array_equal(rescaleToHU(stored[:2], 1, -1024), [-1024, 3071])
+        self.assertEqual(rescaleToHU(stored[:2], 1, -1024).dtype, np.int16)
+        self.assertEqual(rescaleToHU(stored.copy(), 1, -40000)[2], 23536)
+
+    def test_dtype_choice(self):
+        self.assertEqual(storedRange(np.dtype(np.uint16), 12), (0, 4095))
+        self.assertEqual(storedRange(np.dtype(np.int16)), (-32768, 32767))
+        self.assertEqual(rescaleDtype(0, 4095, 1, -1024), np.int16)
+        self.assertEqual(rescaleDtype(0, 65535, 1, -1024), np.int32)
+        self.assertEqual(rescaleDtype(-32768, 32767, 2, 0), np.int32)
+        # Declared 12 bits: no data scan needed
+        stored = np.array([0, 4095], dtype=np.uint16)
+        self.assertEqual(rescaleToHU(stored, 1, -1024, bits_stored=12).dtype, np.int16)
+
+
+class TestDICOMToRaw(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unsigned_file(self):
+        path = os.path.join(self.tmp_dir, 'unsigned.dcm')
+        pixels = np.array([[0, 1000], [40000, 65535]], dtype=np.uint16)
+        writeSyntheticDICOM(path, pixels=pixels, intercept=-1024)
+        raw = DICOMReader.readSlice(path, use_cache=False).pixels
+        np.testing.assert_array_equal(raw, pixels.astype(np.int64) - 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from libs.dicom_io import DICOMReader, SliceSources
+from libs.dicom_volume import SeriesVolumeCache
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestSeriesVolumeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(5):
+            path = os.path.join(self.tmp_dir, '%d.dcm' % i)
+            writeSyntheticDICOM(path, rows=20, columns=24, instance_number=i + 1,
+                                photometric='MONOCHROME1' if i == 2 else 'MONOCHROME2')
+            self.paths.append(path)
+        self.cache = SeriesVolumeCache(os.path.join(self.tmp_dir, 'volumes'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_build_and_open(self):
+        self.assertIsNone(self.cache.open(self.paths))
+        built = self.cache.build(self.paths)
+        self.assertEqual(built.volume.shape, (5, 20, 24))
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)),
+                         sorted(os.path.basename(p) for p in self.cache.volumePaths(self.paths)))
+
+        volume = self.cache.open(self.paths)
+        self.assertEqual(len(volume), 5)
+        for path in self.paths:
+            expected = DICOMReader.readSlice(path, use_cache=False)
+            dicom_slice = volume.loadSlice(path)
+            np.testing.assert_array_equal(dicom_slice.pixels, expected.pixels)
+            self.assertEqual(dicom_slice.photometric, expected.photometric)
+            # Slices are views into the mapped volume
+            self.assertTrue(np.shares_memory(dicom_slice.pixels, volume.volume))
+        self.assertIsNone(volume.loadSlice(os.path.join(self.tmp_dir, 'other.dcm')))
+
+        # The volume is keyed by the ordered series paths
+        self.assertIsNone(self.cache.open(self.paths[::-1]))
+
+    def test_invalidation(self):
+        volume = self.cache.build(self.paths)
+        st = os.stat(self.paths[3])
+        os.utime(self.paths[3], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+        self.assertIsNone(volume.loadSlice(self.paths[3]))
+        self.assertIsNotNone(volume.loadSlice(self.paths[0]))
+        self.assertIsNone(self.cache.open(self.paths))
+        self.assertIsNotNone(self.cache.build(self.paths))
+        self.assertIsNotNone(self.cache.open(self.paths))
+
+        os.remove(self.paths[0])
+        self.assertIsNone(self.cache.open(self.paths))
+
+    def test_mismatched_slices(self):
+        writeSyntheticDICOM(self.paths[4], rows=16, columns=16, instance_number=5)
+        self.assertIsNone(self.cache.build(self.paths))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_mixed_dtypes(self):
+        # The rescaled values of one slice do not fit in int16
+        writeSyntheticDICOM(self.paths[3], rows=20, columns=24, instance_number=4, intercept=40000)
+        expected = [DICOMReader.readSlice(path, use_cache=False).pixels for path in self.paths]
+        self.assertEqual(expected[0].dtype, np.int16)
+        self.assertEqual(expected[3].dtype, np.int32)
+
+        volume = self.cache.build(self.paths)
+        self.assertEqual(volume.volume.dtype, np.result_type(*expected))
+        for path, pixels in zip(self.paths, expected):
+            np.testing.assert_array_equal(volume.loadSlice(path).pixels, pixels)
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)),
+                         sorted(os.path.basename(p) for p in self.cache.volumePaths(self.paths)))
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        read_slice = DICOMReader.readSlice
+
+        def readThenCancel(path, use_cache=True):
+            # Cancelled while the second slice is being read
+            if path == self.paths[1]:
+                cancel.set()
+            return read_slice(path, use_cache=use_cache)
+        with mock.patch.object(DICOMReader, 'readSlice', side_effect=readThenCancel) as patched:
+            self.assertIsNone(self.cache.build(self.paths, cancel))
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+        self.assertIsNone(self.cache.open(self.paths))
+
+    def test_slice_source(self):
+        volume = self.cache.build(self.paths[:3])
+        DICOMReader.sliceSource = SliceSources(None, volume)
+        try:
+            inside = DICOMReader.readSlice(self.paths[0], use_cache=False)
+            outside = DICOMReader.readSlice(self.paths[4], use_cache=False)
+        finally:
+            DICOMReader.sliceSource = None
+        self.assertTrue(np.shares_memory(inside.pixels, volume.volume))
+        self.assertFalse(np.shares_memory(outside.pixels, volume.volume))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from libs.dicom_io import DICOMReader
+from libs.dicom_window import applyWindowLUT, windowFloat, windowLUT
+
+
+class TestWindowLUT(unittest.TestCase):
+
+    windows = [(40, 400), (-600, 1500), (400, 1500), (50, 100), (0.5, 3), (-32000, 1)]
+
+    def test_matches_float_window(self):
+        rng = np.random.RandomState(0)
+        for dtype in (np.int16, np.uint16, np.int8, np.uint8):
+            info = np.iinfo(dtype)
+            img = rng.randint(info.min, int(info.max) + 1, size=(37, 53)).astype(dtype)
+            for w_center, w_width in self.windows:
+                for invert in (False, True):
+                    expected = windowFloat(img, w_center, w_width, invert)
+                    actual = applyWindowLUT(img, w_center, w_width, invert)
+                    self.assertEqual(actual.dtype, np.uint8)
+                    np.testing.assert_array_equal(actual, expected)
+
+    def test_monochrome1_inversion(self):
+        img = np.arange(-1024, 1024, dtype=np.int16).reshape(32, 64)
+        windowed = windowFloat(img, 40, 400)
+        inverted = applyWindowLUT(img, 40, 400, invert=True)
+        np.testing.assert_array_equal(inverted, 255 - windowed)
+
+        # Same result as windowing then applying photometric interpretation
+        dcm = type('Header', (), {'PhotometricInterpretation': 'MONOCHROME1'})()
+        expected = DICOMReader._applyPhotometricInterpretation(dcm, windowed)
+        np.testing.assert_array_equal(inverted, expected)
+
+    def test_fallback_and_out(self):
+        img = np.linspace(-2000, 70000, 64 * 64).astype(np.int32).reshape(64, 64)
+        np.testing.assert_array_equal(applyWindowLUT(img, 40, 400),
+                                      windowFloat(img, 40, 400))
+
+        img16 = img.clip(-32768, 32767).astype(np.int16)
+        out = np.empty(img16.shape, dtype=np.uint8)
+        result = applyWindowLUT(img16, 40, 400, out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, windowFloat(img16, 40, 400))
+
+    def test_blocks(self):
+        rng = np.random.RandomState(0)
+        img = rng.randint(-1024, 3072, size=(700, 500)).astype(np.int16)
+        expected = windowFloat(img, 40, 400)
+        np.testing.assert_array_equal(applyWindowLUT(img, 40, 400), expected)
+        # Non-contiguous input and output are mapped in one pass
+        out = np.empty((700, 1000), dtype=np.uint8)[:, ::2]
+        applyWindowLUT(img, 40, 400, out=out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_lut_is_cached(self):
+        self.assertIs(windowLUT(40, 400, False, np.dtype(np.int16)),
+                      windowLUT(40, 400, False, np.dtype(np.int16)))
+        self.assertFalse(windowLUT(40, 400).flags.writeable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,5 +28,32 @@ class TestPascalVocRW(unittest.TestCase):
         self.assertEqual(face[0], 'face')
         self.assertEqual(face[1], [(113, 40), (450, 40), (450, 403), (113, 403)])
 
+    def test_serialized_bytes(self):
+        from libs.pascal_voc_io import PascalVocWriter
+
+        writer = PascalVocWriter('f&o', 'a<b>.png', (10, 20, 3), localImgPath='')
+        writer.verified = True
+        writer.addBndBox(5, 2, 8, 4, u'n\u00f1 & "x"\r\ny', 1)
+        root = writer.genXML()
+        writer.appendObjects(root)
+        # Same bytes as the previous ElementTree and lxml writer
+        self.assertEqual(writer.prettify(root), (
+            u'<annotation verified="yes">\n'
+            u'\t<folder>f&amp;o</folder>\n'
+            u'\t<filename>a&lt;b&gt;.png</filename>\n'
+            u'\t<path/>\n'
+            u'\t<source>\n\t\t<database>Unknown</database>\n\t</source>\n'
+            u'\t<size>\n\t\t<width>20</width>\n\t\t<height>10</height>\n\t\t<depth>3</depth>\n\t</size>\n'
+            u'\t<segmented>0</segmented>\n'
+            u'\t<object>\n'
+            u'\t\t<name>n\u00f1 &amp; "x"\ny</name>\n'
+            u'\t\t<pose>Unspecified</pose>\n'
+            u'\t\t<truncated>0</truncated>\n'
+            u'\t\t<difficult>1</difficult>\n'
+            u'\t\t<bndbox>\n\t\t\t<xmin>5</xmin>\n\t\t\t<ymin>2</ymin>\n'
+            u'\t\t\t<xmax>8</xmax>\n\t\t\t<ymax>4</ymax>\n\t\t</bndbox>\n'
+            u'\t</object>\n'
+            u'</annotation>\n').encode('utf-8'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import gc
+import unittest
+
+import numpy as np
+
+from libs.dicom_io import DICOMReader, DICOMSlice
+from libs.qimage_adapter import FrameBuffer, ndarrayToQImage
+
+try:
+    from PyQt5.QtGui import qGray
+except ImportError:
+    from PyQt4.QtGui import qGray
+
+
+class TestNdarrayToQImage(unittest.TestCase):
+
+    def test_keeps_buffer_alive(self):
+        arr = np.arange(12 * 10, dtype=np.uint8).reshape(12, 10)
+        qim = ndarrayToQImage(arr)
+        del arr
+        gc.collect()
+        # Overwrite freed memory, if any, before reading the image back
+        np.full((12, 10), 255, dtype=np.uint8)
+        self.assertEqual((qim.width(), qim.height()), (10, 12))
+        self.assertEqual(qGray(qim.pixel(3, 2)), 23)
+
+    def test_zero_copy_and_copy(self):
+        arr = np.zeros((4, 6), dtype=np.uint8)
+        shared = ndarrayToQImage(arr)
+        owned = ndarrayToQImage(arr, do_copy=True)
+        arr[1, 2] = 200
+        self.assertEqual(qGray(shared.pixel(2, 1)), 200)
+        self.assertEqual(int(shared.constBits()), arr.ctypes.data)
+        self.assertEqual(qGray(owned.pixel(2, 1)), 0)
+
+    def test_non_contiguous_and_unsupported(self):
+        arr = np.arange(64, dtype=np.uint8).reshape(8, 8)[:, ::2]
+        qim = ndarrayToQImage(arr)
+        self.assertEqual(qGray(qim.pixel(3, 1)), arr[1, 3])
+        with self.assertRaises(NotImplementedError):
+            ndarrayToQImage(np.zeros((4, 4), dtype=np.int16))
+        self.assertTrue(ndarrayToQImage(None).isNull())
+
+
+class TestFrameBuffer(unittest.TestCase):
+
+    def test_render_in_place(self):
+        pixels = np.arange(-1024, 1024, dtype=np.int16).reshape(32, 64)
+        dcm = type('Header', (), {'PhotometricInterpretation': 'MONOCHROME2'})()
+        dicom_slice = DICOMSlice('slice.dcm', dcm, pixels)
+        frame = FrameBuffer()
+
+        first = DICOMReader.sliceToQImage(dicom_slice, 400, 40, frame=frame)
+        buffer = frame.get(pixels.shape)
+        expected = DICOMReader._applyWindow(pixels, 40, 400)
+        np.testing.assert_array_equal(buffer, expected)
+        self.assertEqual(qGray(first.pixel(63, 31)), 255)
+
+        second = DICOMReader.sliceToQImage(dicom_slice, 100, -500, frame=frame)
+        self.assertIs(frame.get(pixels.shape), buffer)
+        np.testing.assert_array_equal(buffer, DICOMReader._applyWindow(pixels, -500, 100))
+        self.assertEqual(qGray(second.pixel(0, 0)), 0)
+
+        self.assertIsNot(frame.get((16, 16)), buffer)
+
+
+if __name__ == '__main__':
+    unittest.main()
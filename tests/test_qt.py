@@ -1,5 +1,9 @@
 
-from unittest import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, mock
 
 from labelImg import get_main_app
 
@@ -13,8 +17,95 @@ class TestMainWindow(TestCase):
         self.app, self.win = get_main_app()
 
     def tearDown(self):
+        # Closing saves the settings: do not leave auto saving on for the next window
+        self.win.autoSaving.setChecked(False)
+        self.win.defaultSaveDir = None
         self.win.close()
         self.app.quit()
 
     def test_noop(self):
         pass
+
+    def test_dialogs_built_on_first_use(self):
+        self.assertIsNone(self.win._labelDialog)
+        self.assertIsNone(self.win._windowLevelDialog)
+        self.assertIs(self.win.windowLevelDialog, self.win.windowLevelDialog)
+        self.assertIsNotNone(self.win._windowLevelDialog)
+
+    def test_close_shuts_down_workers(self):
+        with mock.patch.object(self.win.dicomLoader, 'shutdown') as loader_shutdown, \
+                mock.patch.object(self.win.dicomPrefetcher, 'shutdown') as prefetcher_shutdown:
+            self.win.close()
+        loader_shutdown.assert_called_once_with()
+        prefetcher_shutdown.assert_called_once_with()
+
+    def test_index_closed(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        # Opening another folder closes the index of the previous one
+        old_index = self.win.dicomIndex = mock.Mock()
+        self.win.importDirDICOMs(tmp_dir)
+        old_index.close.assert_called_once_with()
+        self.assertIsNone(self.win.dicomIndex)
+
+        index = self.win.dicomIndex = mock.Mock()
+        self.win.close()
+        index.close.assert_called_once_with()
+        self.assertIsNone(self.win.dicomIndex)
+
+    def test_navigation_does_not_wait_for_saves(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        images = [os.path.join(tmp_dir, name) for name in ('a.bmp', 'b.bmp')]
+        for path in images:
+            shutil.copy(os.path.join(os.path.dirname(__file__), 'test.bmp'), path)
+        self.win.defaultSaveDir = tmp_dir
+        self.win.autoSaving.setChecked(True)
+        self.win.mImgList = images
+        self.win.loadFile(images[0])
+
+        # Hold the save worker, as a slow disk would
+        started, release = threading.Event(), threading.Event()
+
+        def blocked():
+            started.set()
+            release.wait()
+        self.win.saveQueue.submit(os.path.join(tmp_dir, 'slow.xml'), blocked)
+        started.wait()
+        # Fails instead of hanging if navigating waits for the save
+        timer = threading.Timer(5, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.win.setDirty()
+        self.win.openNextImg()
+        self.assertEqual(self.win.filePath, images[1])
+        self.assertFalse(release.is_set())
+        self.assertTrue(self.win.saveQueue.isPending(os.path.join(tmp_dir, 'a.xml')))
+        self.assertFalse(self.win.saveQueue.isPending(os.path.join(tmp_dir, 'b.xml')))
+
+        release.set()
+        self.win.saveQueue.flush()
+        self.assertTrue(os.path.isfile(os.path.join(tmp_dir, 'a.xml')))
+
+    def test_failed_save_keeps_changes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        image_path = os.path.join(tmp_dir, 'a.bmp')
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'test.bmp'), image_path)
+        # Writes into a regular file as if it were a folder fail
+        self.win.defaultSaveDir = image_path
+        self.win.loadFile(image_path)
+
+        self.win.setDirty()
+        try:
+            with mock.patch.object(self.win, 'errorMessage') as error_message:
+                self.win.saveFile()
+                self.assertFalse(self.win.dirty)
+                self.win.saveQueue.flush()
+                self.app.processEvents()
+            error_message.assert_called_once()
+            self.assertTrue(self.win.dirty)
+        finally:
+            # Closing a dirty window would ask whether to discard the changes
+            self.win.setClean()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from PyQt5.QtCore import Qt
+except ImportError:
+    from PyQt4.QtCore import Qt
+
+from libs.atomic_io import atomicWrite
+from libs.save_queue import AnnotationSaveQueue
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'a.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replace(self):
+        atomicWrite(self.path, b'old')
+        atomicWrite(self.path, b'new')
+        with open(self.path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'new')
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.xml'])
+
+    def test_failure_keeps_file(self):
+        atomicWrite(self.path, b'old')
+        with self.assertRaises(TypeError):
+            atomicWrite(self.path, u'not bytes')
+        with open(self.path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'old')
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.xml'])
+
+
+class TestAnnotationSaveQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = AnnotationSaveQueue()
+        self.written = []
+        self.failed = []
+        # Delivered in the worker, no event loop runs here
+        self.queue.saveFailed.connect(lambda path, message: self.failed.append((path, message)),
+                                      Qt.DirectConnection)
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def save(self, path, snapshot):
+        return lambda: self.written.append((path, snapshot))
+
+    def test_merge(self):
+        # Hold the worker so that later saves wait
+        started, release = threading.Event(), threading.Event()
+
+        def blocked():
+            started.set()
+            release.wait()
+        self.queue.submit('a.xml', blocked)
+        started.wait()
+
+        self.queue.submit('b.xml', self.save('b.xml', 1))
+        self.queue.submit('c.xml', self.save('c.xml', 1))
+        self.queue.submit('b.xml', self.save('b.xml', 2))
+        # Already being written: a new save of it is queued, not merged
+        self.queue.submit('a.xml', self.save('a.xml', 1))
+        self.assertTrue(self.queue.isPending())
+        release.set()
+        self.queue.flush()
+
+        self.assertFalse(self.queue.isPending())
+        self.assertEqual(self.queue.merged, 1)
+        self.assertEqual(self.written, [('b.xml', 2), ('c.xml', 1), ('a.xml', 1)])
+
+    def test_flush_path(self):
+        started, release = threading.Event(), threading.Event()
+
+        def blocked():
+            started.set()
+            release.wait()
+        self.queue.submit('a.xml', blocked)
+        started.wait()
+        self.queue.submit('dir/b.xml', self.save('b.xml', 1))
+
+        # Nothing pending for c.xml: returns without waiting for the others
+        self.queue.flush('c.xml')
+        self.assertTrue(self.queue.isPending('a.xml'))
+        self.assertTrue(self.queue.isPending('dir//b.xml'))
+        self.assertFalse(self.queue.isPending('c.xml'))
+        release.set()
+        self.queue.flush('dir/b.xml')
+        self.assertEqual(self.written, [('b.xml', 1)])
+        self.assertFalse(self.queue.isPending('a.xml'))
+
+    def test_failure(self):
+        def fail():
+            raise ValueError('disk full')
+        self.queue.submit('a.xml', fail)
+        self.queue.submit('b.xml', self.save('b.xml', 1))
+        self.queue.flush()
+        self.assertEqual(self.failed, [('a.xml', 'disk full')])
+        self.assertEqual(self.written, [('b.xml', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from libs.constants import BBOX_DIR_NAME
+from libs.dicom_io import DICOMReader
+from libs.pascal_voc_io import PascalVocWriter
+from libs.shard_export import MANIFEST_FILENAME, exportShards, planShards, readShard
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestShardExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'shards')
+        self.series_paths = []
+        for series_dir, size in (('a', 16), ('b', 24), ('c', 16)):
+            os.makedirs(os.path.join(self.tmp_dir, series_dir))
+            paths = []
+            for i in range(4):
+                path = os.path.join(self.tmp_dir, series_dir, '%d.dcm' % i)
+                writeSyntheticDICOM(path, rows=size, columns=size, instance_number=i + 1)
+                paths.append(path)
+            self.series_paths.append(tuple(paths))
+
+        # Series a: Pascal VOC boxes on slices 1 and 2, series b: YOLO boxes on slice 0
+        bbox_dir = os.path.join(self.tmp_dir, 'a', BBOX_DIR_NAME)
+        os.makedirs(bbox_dir)
+        for i, boxes in ((1, [(1, 2, 5, 6, 'nodule', 0)]),
+                         (2, [(0, 0, 4, 4, 'nodule', 1), (8, 8, 15, 12, 'vessel', 0)])):
+            writer = PascalVocWriter('a', '%d.dcm' % i, (16, 16, 1))
+            for box in boxes:
+                writer.addBndBox(*box)
+            writer.save(os.path.join(bbox_dir, '%d.xml' % i))
+        bbox_dir = os.path.join(self.tmp_dir, 'b', BBOX_DIR_NAME)
+        os.makedirs(bbox_dir)
+        with open(os.path.join(bbox_dir, 'classes.txt'), 'w') as fh:
+            fh.write('nodule\nvessel\n')
+        with open(os.path.join(bbox_dir, '0.txt'), 'w') as fh:
+            fh.write('1 0.5 0.25 0.5 0.25\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def export(self, **kwargs):
+        return exportShards(self.tmp_dir, self.output_dir, self.series_paths, shard_size=3, **kwargs)
+
+    def readAll(self):
+        slices = []
+        for name in sorted(os.listdir(self.output_dir)):
+            if name.endswith('.npz'):
+                slices += list(readShard(os.path.join(self.output_dir, name)))
+        return slices
+
+    def test_plan(self):
+        # Series c has no bbox folder
+        shards = planShards(self.tmp_dir, self.series_paths, shard_size=3)
+        self.assertEqual([len(shard) for shard in shards], [3, 3, 2])
+        self.assertEqual(shards[0][0].rel_path, os.path.join('a', '0.dcm'))
+        self.assertIsNone(shards[0][0].annotation_path)
+
+        shards = planShards(self.tmp_dir, self.series_paths, shard_size=3, annotated_only=True)
+        self.assertEqual([s.rel_path for s in shards[0]],
+                         [os.path.join('a', '1.dcm'), os.path.join('a', '2.dcm'), os.path.join('b', '0.dcm')])
+
+    def test_export(self):
+        result = self.export()
+        self.assertEqual((result.written, result.skipped, result.num_slices, result.num_boxes), (3, 0, 8, 4))
+
+        slices = self.readAll()
+        self.assertEqual([path for path, _, _ in slices],
+                         [os.path.relpath(p, self.tmp_dir) for p in self.series_paths[0] + self.series_paths[1]])
+        for (_, image, _), dicom_path in zip(slices, self.series_paths[0] + self.series_paths[1]):
+            np.testing.assert_array_equal(image, DICOMReader.readSlice(dicom_path).pixels)
+        self.assertEqual(slices[0][2], [])
+        self.assertEqual(slices[1][2], [('nodule', 1, 2, 5, 6, False)])
+        self.assertEqual(slices[2][2], [('nodule', 0, 0, 4, 4, True), ('vessel', 8, 8, 15, 12, False)])
+        # YOLO boxes are converted to pixels of the 24x24 slice
+        self.assertEqual(slices[4][2], [('vessel', 6, 3, 18, 9, False)])
+
+        with np.load(os.path.join(self.output_dir, 'shard-00000.npz')) as shard:
+            self.assertEqual(shard['pixels'].dtype, np.int16)
+
+    def test_windowed(self):
+        self.export(window=(400, 40))
+        _, image, _ = self.readAll()[0]
+        expected = DICOMReader.renderSlice(DICOMReader.readSlice(self.series_paths[0][0]), 400, 40)
+        np.testing.assert_array_equal(image, expected)
+
+    def test_resume(self):
+        self.export()
+        with open(os.path.join(self.output_dir, MANIFEST_FILENAME)) as fh:
+            self.assertEqual(sorted(json.load(fh)['shards']), ['shard-00000.npz', 'shard-00001.npz', 'shard-00002.npz'])
+
+        result = self.export()
+        self.assertEqual((result.written, result.skipped, result.slices_written), (0, 3, 0))
+
+        # Only the shard holding the changed annotation is written again
+        with open(os.path.join(self.tmp_dir, 'b', BBOX_DIR_NAME, '0.txt'), 'a') as fh:
+            fh.write('0 0.5 0.5 0.5 0.5\n')
+        os.remove(os.path.join(self.output_dir, 'shard-00002.npz'))
+        result = self.export()
+        self.assertEqual((result.written, result.skipped, result.num_boxes), (2, 1, 5))
+
+        # Other export options change every shard
+        result = self.export(window='auto')
+        self.assertEqual((result.written, result.skipped), (3, 0))
+
+    def test_failures(self):
+        annotation_path = os.path.join(self.tmp_dir, 'a', BBOX_DIR_NAME, '3.xml')
+        with open(annotation_path, 'w') as fh:
+            fh.write('<annotation><object>')
+        result = self.export()
+        self.assertEqual([path for path, _ in result.failures], [annotation_path])
+        self.assertEqual((result.written, result.num_boxes), (3, 4))
+        # The slice is left out, not exported without boxes
+        paths = [path for path, _, _ in self.readAll()]
+        self.assertNotIn(os.path.join('a', '3.dcm'), paths)
+        self.assertEqual(len(paths), 7)
+
+        # Still reported when its shard is up to date
+        result = self.export()
+        self.assertEqual((result.skipped, [path for path, _ in result.failures]), (3, [annotation_path]))
+
+        writer = PascalVocWriter('a', '3.dcm', (16, 16, 1))
+        writer.addBndBox(2, 2, 6, 6, 'nodule', 0)
+        writer.save(annotation_path)
+        result = self.export()
+        self.assertEqual((result.written, result.num_boxes, result.failures), (1, 5, []))
+
+    def test_workers(self):
+        serial = self.export()
+        serial_slices = self.readAll()
+        shutil.rmtree(self.output_dir)
+        parallel = self.export(num_workers=2)
+        self.assertEqual(parallel[:5], serial[:5])
+        for (path, image, boxes), (s_path, s_image, s_boxes) in zip(self.readAll(), serial_slices):
+            self.assertEqual((path, boxes), (s_path, s_boxes))
+            np.testing.assert_array_equal(image, s_image)
+
+
+if __name__ == '__main__':
+    unittest.main()
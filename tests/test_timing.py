@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from libs.dicom_io import DICOMReader
+from libs.timing import StageTimer, stageTimer
+from synthetic_dicom import writeSyntheticDICOM
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        timer = StageTimer()
+        with timer.span('decode'):
+            pass
+        timer.record('decode', 0.5)
+        self.assertEqual(timer.stats(), {})
+        # One shared no-op span while disabled
+        self.assertIs(timer.span('decode'), timer.span('window'))
+
+    def test_percentiles(self):
+        timer = StageTimer(window=100)
+        timer.enable()
+        for ms in range(1, 201):
+            timer.record('decode', ms / 1000.0)
+        with timer.span('window'):
+            pass
+
+        stats = timer.stats()
+        # Only the latest 100 spans are kept
+        self.assertEqual(stats['decode']['n'], 100)
+        self.assertAlmostEqual(stats['decode']['p50'], 150.5)
+        self.assertAlmostEqual(stats['decode']['p99'], 199.01)
+        self.assertEqual(stats['window']['n'], 1)
+        self.assertTrue(timer.summary(['decode']).startswith('decode 150.5/'))
+
+        timer.disable()
+        timer.record('decode', 1.0)
+        self.assertEqual(timer.stats()['decode']['n'], 100)
+
+    def test_log(self):
+        log_path = os.path.join(self.tmp_dir, 'timing.jsonl')
+        timer = StageTimer()
+        timer.enable(log_path)
+        timer.record('decode', 0.002)
+        timer.record('window', 0.001)
+        timer.disable()
+
+        with open(log_path) as fh:
+            records = [json.loads(line) for line in fh]
+        self.assertEqual([(r['stage'], r['ms']) for r in records], [('decode', 2.0), ('window', 1.0)])
+
+    def test_dicom_stages(self):
+        dicom_path = os.path.join(self.tmp_dir, 'slice.dcm')
+        writeSyntheticDICOM(dicom_path)
+        stageTimer.reset()
+        stageTimer.enable()
+        try:
+            DICOMReader.sliceCache.clear()
+            DICOMReader.getQImage(dicom_path, 400, 40)
+            stats = stageTimer.stats()
+        finally:
+            stageTimer.disable()
+            stageTimer.reset()
+        for stage in ('dicom.read', 'dicom.parse', 'dicom.rescale', 'dicom.window', 'dicom.qimage'):
+            self.assertEqual(stats[stage]['n'], 1, stage)
+
+
+if __name__ == '__main__':
+    unittest.main()